@@ -1,4 +1,5 @@
 import os
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -6,9 +7,17 @@ from sklearn.decomposition import PCA
 from matplotlib.backends.backend_pdf import PdfPages
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from analysis_utils.instrumentation import RunReport
+from analysis_utils.plotting import density_scatter
+from analysis_utils.profiles import profile_name, read_profiles
+from analysis_utils.storage import read_table, table_exists
+from analysis_utils.subsampling import sample_rows
+
 # === CONFIG ===
 input_controls = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/positive_controls_only")
 input_experimentals = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/experimental_samples")
+input_profiles = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/feature_groups_split")
 output_base = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/pca_controls_vs_experimentals")
 output_base.mkdir(parents=True, exist_ok=True)
 
@@ -19,85 +28,172 @@ experimental_samples = ["SIS", "UBM", "Cardiac"]
 control_palette = {"M0": "blue", "M1": "red", "M2": "green"}
 experimental_colors = {"SIS": "orange", "UBM": "purple", "Cardiac": "brown"}
 
+# "density" bins the cells into one raster image per page (fast, small PDFs at any cell count);
+# "points" draws every cell as a vector marker
+SCATTER_MODE = "density"
+
+# "refit": fit PCA on controls + each experimental group (one fit per pair)
+# "reference": fit once per feature group on the controls and project each experimental group onto it
+PCA_MODE = "refit"
+
+# SVD solver for the PCA fits: "auto", "full", "randomized" or "arpack" (truncated, only the 10
+# components are computed) or "covariance_eigh" (eigendecomposition of the feature covariance,
+# cheapest for tall tables with few features)
+SVD_SOLVER = "auto"
+N_COMPONENTS = 10
+
+# "well" / "field": compare well or field profiles instead of single cells (analysis_utils/profiles.py).
+# The controls' profiles come from pca_positive_control.py run with the same PROFILE_LEVEL, the
+# experimental groups' from the <group>_<level>_profiles tables of feature_groups.py; output names
+# get a _<level>_profiles suffix. None: single cells.
+PROFILE_LEVEL = None
+
+# At most SUBSAMPLE_CAP cells per sample type go into each PCA and plot (None: every cell). The
+# rows are drawn with analysis_utils/subsampling.py and saved to SAMPLE_DIR per feature group, then
+# reused while that group's labels are unchanged; the same cap and seed pick the same control cells
+# in every feature group and in umap_positive_controls.py.
+SUBSAMPLE_CAP = None
+SUBSAMPLE_SEED = 42
+SAMPLE_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/sample_indices")
+
+# Run report: wall/CPU time, peak memory, rows and bytes per stage, as JSON + CSV
+# (analysis_utils/instrumentation.py); PROFILE_STAGES adds a cProfile dump per stage
+RUN_REPORT_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/run_reports")
+PROFILE_STAGES = False
+run_report = RunReport("pca_control_vs_experimental", RUN_REPORT_DIR, profile=PROFILE_STAGES)
+
 # === PCA COMPARISON LOOP ===
 for group in feature_groups:
-    controls_file = input_controls / f"{group}_positive_controls.csv"
-    controls_df = pd.read_csv(controls_file)
+    controls_base = input_controls / profile_name(f"{group}_positive_controls", PROFILE_LEVEL)
+    with run_report.stage("table load", group=group, sample="controls") as stage:
+        controls_df = read_table(controls_base)
+        stage.read(controls_base)
+        stage.rows_out = len(controls_df)
     label_col = "Sample Type" if "Sample Type" in controls_df.columns else "sample_type"
     controls_df[label_col] = controls_df[label_col].astype(str).str.strip()
+    if SUBSAMPLE_CAP:
+        with run_report.stage("subsample", rows_in=len(controls_df), group=group, sample="controls") as stage:
+            keep = sample_rows(controls_df[label_col], SUBSAMPLE_CAP, SUBSAMPLE_SEED, SAMPLE_DIR,
+                               profile_name(f"{group}_positive_controls", PROFILE_LEVEL))
+            controls_df = controls_df.iloc[keep]
+            stage.rows_out = len(controls_df)
+
+    # Reference mode: the controls are decomposed once and reused for every experimental group
+    if PCA_MODE == "reference":
+        with run_report.stage("PCA fit", rows_in=len(controls_df), group=group, sample="controls"):
+            reference_pca = PCA(n_components=N_COMPONENTS, svd_solver=SVD_SOLVER, random_state=42)
+            reference_pca.fit(controls_df.drop(columns=[label_col]).dropna())
+        print(f"🔍 Fitted reference PCA for {group} on {len(positive_controls)} control groups")
 
     for exp in experimental_samples:
-        exp_file = input_experimentals / f"{group}_{exp}.csv"
-        if not exp_file.exists():
+        exp_file = (input_profiles / profile_name(group, PROFILE_LEVEL) if PROFILE_LEVEL
+                    else input_experimentals / f"{group}_{exp}")
+        if not table_exists(exp_file):
             print(f" Skipping missing file: {exp_file}")
             continue
 
         # Load and clean experimental data
-        experimental_df = pd.read_csv(exp_file)
+        with run_report.stage("table load", group=group, sample=exp) as stage:
+            experimental_df = read_profiles(exp_file, samples=[exp]) if PROFILE_LEVEL else read_table(exp_file)
+            stage.read(exp_file)
+            stage.rows_out = len(experimental_df)
+        if experimental_df.empty:
+            print(f" Skipping {exp}: no rows in {exp_file}")
+            continue
         experimental_df[label_col] = experimental_df[label_col].astype(str).str.strip()
+        if SUBSAMPLE_CAP:
+            with run_report.stage("subsample", rows_in=len(experimental_df), group=group, sample=exp) as stage:
+                keep = sample_rows(experimental_df[label_col], SUBSAMPLE_CAP, SUBSAMPLE_SEED, SAMPLE_DIR,
+                                   profile_name(f"{group}_experimental_{exp}", PROFILE_LEVEL))
+                experimental_df = experimental_df.iloc[keep]
+                stage.rows_out = len(experimental_df)
 
         # Combine controls + one experimental group
         combined_df = pd.concat([controls_df, experimental_df], ignore_index=True)
         sample_types = combined_df[label_col].unique()
-        print(f"🔍 Running PCA for {group} | Controls vs {exp} | Sample Types: {sample_types}")
+        print(f"🔍 Running PCA ({PCA_MODE}) for {group} | Controls vs {exp} | Sample Types: {sample_types}")
 
         # Prepare input for PCA
         X = combined_df.drop(columns=[label_col]).dropna()
         y = combined_df.loc[X.index, label_col]
 
-        # Run PCA
-        pca = PCA(n_components=10)
-        components = pca.fit_transform(X)
-        pc_cols = [f"PC{i+1}" for i in range(10)]
+        # Run PCA (or project onto the reference fit of the controls)
+        stage_name = "PCA transform" if PCA_MODE == "reference" else "PCA fit"
+        with run_report.stage(stage_name, rows_in=len(X), group=group, sample=exp, mode=PCA_MODE) as stage:
+            if PCA_MODE == "reference":
+                components = reference_pca.transform(X)
+                # Share of the plotted cells' variance along each control-defined PC
+                explained_var = components.var(axis=0, ddof=1) / X.to_numpy(dtype=float).var(axis=0, ddof=1).sum()
+            else:
+                pca = PCA(n_components=N_COMPONENTS, svd_solver=SVD_SOLVER, random_state=42)
+                components = pca.fit_transform(X)
+                explained_var = pca.explained_variance_ratio_
+            stage.rows_out = len(components)
+        pc_cols = [f"PC{i+1}" for i in range(N_COMPONENTS)]
         pca_df = pd.DataFrame(components, columns=pc_cols)
-        pca_df[label_col] = y
-        explained_var = pca.explained_variance_ratio_
+        pca_df[label_col] = y.values
+        pca_df["PCA Mode"] = PCA_MODE
 
         # Output paths
         output_dir = output_base / exp
         output_dir.mkdir(parents=True, exist_ok=True)
-        base_filename = f"{group}_controls_vs_{exp}"
+        base_filename = f"{profile_name(group, PROFILE_LEVEL)}_controls_vs_{exp}"
 
         # Save PCA data
-        pca_df.to_csv(output_dir / f"{base_filename}_pca_components.csv", index=False)
-        pd.DataFrame({
-            "Principal Component": pc_cols,
-            "Explained Variance Ratio": explained_var
-        }).to_csv(output_dir / f"{base_filename}_explained_variance.csv", index=False)
+        with run_report.stage("save results", rows_in=len(pca_df), group=group, sample=exp) as stage:
+            pca_df.to_csv(output_dir / f"{base_filename}_pca_components.csv", index=False)
+            pd.DataFrame({
+                "Principal Component": pc_cols,
+                "Explained Variance Ratio": explained_var,
+                "PCA Mode": PCA_MODE
+            }).to_csv(output_dir / f"{base_filename}_explained_variance.csv", index=False)
+            stage.wrote(output_dir / f"{base_filename}_pca_components.csv",
+                        output_dir / f"{base_filename}_explained_variance.csv")
 
         # Top 3 PCs for plotting
-        top3_idx = sorted(range(10), key=lambda i: explained_var[i], reverse=True)[:3]
+        top3_idx = sorted(range(N_COMPONENTS), key=lambda i: explained_var[i], reverse=True)[:3]
         top3_pcs = [pc_cols[i] for i in top3_idx]
 
         # Plotting
         pdf_path = output_dir / f"{base_filename}_pca_plots.pdf"
-        with PdfPages(pdf_path) as pdf:
+        with run_report.stage("PDF render", rows_in=len(pca_df), group=group, sample=exp) as stage, \
+                PdfPages(pdf_path) as pdf:
+            stage.wrote(pdf_path)
             for i in range(3):
                 for j in range(i + 1, 3):
                     x_pc, y_pc = top3_pcs[i], top3_pcs[j]
                     plt.figure(figsize=(12, 9))
 
-                    # Plot controls
-                    for ctrl in positive_controls:
+                    if SCATTER_MODE == "density":
+                        # Controls first, experimental group layered on top
+                        density_scatter(
+                            plt.gca(), pca_df, x_pc, y_pc, label_col,
+                            palette={**control_palette, exp: experimental_colors[exp]},
+                            order=positive_controls + [exp],
+                            alpha={**{ctrl: 0.6 for ctrl in positive_controls}, exp: 0.9}
+                        )
+                    else:
+                        # Plot controls
+                        for ctrl in positive_controls:
+                            sns.scatterplot(
+                                data=pca_df[pca_df[label_col] == ctrl],
+                                x=x_pc, y=y_pc,
+                                label=ctrl,
+                                color=control_palette[ctrl],
+                                alpha=0.6
+                            )
+
+                        # Plot experimental group
                         sns.scatterplot(
-                            data=pca_df[pca_df[label_col] == ctrl],
+                            data=pca_df[pca_df[label_col] == exp],
                             x=x_pc, y=y_pc,
-                            label=ctrl,
-                            color=control_palette[ctrl],
-                            alpha=0.6
+                            label=exp,
+                            color=experimental_colors[exp],
+                            alpha=0.9,
+                            edgecolor="black",
+                            linewidth=0.5
                         )
 
-                    # Plot experimental group
-                    sns.scatterplot(
-                        data=pca_df[pca_df[label_col] == exp],
-                        x=x_pc, y=y_pc,
-                        label=exp,
-                        color=experimental_colors[exp],
-                        alpha=0.9,
-                        edgecolor="black",
-                        linewidth=0.5
-                    )
-
                     plt.xlabel(f"{x_pc} ({explained_var[pc_cols.index(x_pc)] * 100:.2f}%)")
                     plt.ylabel(f"{y_pc} ({explained_var[pc_cols.index(y_pc)] * 100:.2f}%)")
                     plt.title(f"PCA: {x_pc} vs {y_pc} — {group.replace('_', ' ').title()} | Controls vs {exp}")
@@ -1,11 +1,22 @@
 import os
+import sys
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
 from matplotlib.backends.backend_pdf import PdfPages
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from analysis_utils.feature_schema import FEATURE_DTYPE
+from analysis_utils.instrumentation import RunReport
+from analysis_utils.profiles import profile_name, read_profiles
+from analysis_utils.plotting import (
+    density_scatter, draw_density_layers, histogram_layers, merge_layers, padded_extent, resolve_palette
+)
+from analysis_utils.storage import TableWriter, iter_table_chunks, read_table, read_table_columns, write_table
+
 # === CONFIG ===
 input_dir = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/feature_groups_split")
 filtered_dir = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/positive_controls_only")
@@ -17,79 +28,203 @@ output_dir.mkdir(parents=True, exist_ok=True)
 feature_groups = ["shape_and_size", "intensity_and_texture", "ser"]
 positive_controls = ["M0", "M1", "M2"]
 
-# === STEP 1: Extract & Save Positive Controls ===
-for group in feature_groups:
-    df = pd.read_csv(input_dir / f"{group}.csv")
-    sample_col = "Sample Type" if "Sample Type" in df.columns else "sample_type"
+# Intermediate tables are Parquet; set True to also export the filtered controls as CSV
+EXPORT_CSV = False
 
-    df[sample_col] = df[sample_col].astype(str).str.strip()
-    df_pos = df[df[sample_col].isin(positive_controls)].copy()
-    out_file = filtered_dir / f"{group}_positive_controls.csv"
-    df_pos.to_csv(out_file, index=False)
-    print(f" Saved positive controls for {group} → {out_file}")
+# "density" bins the cells into one raster image per page (fast, small PDFs at any cell count);
+# "points" draws every cell as a vector marker
+SCATTER_MODE = "density"
 
-# === STEP 2: Run PCA on Filtered Files ===
-for group in feature_groups:
-    print(f"\n Running PCA for positive controls: {group}")
+# "memory": filter the controls and decompose them directly (no write-then-reread round trip)
+# "incremental": stream the tables in CHUNK_SIZE rows, fit IncrementalPCA over the chunks and
+#   transform chunk by chunk, so memory stays flat however many plates are merged
+#   (plots are always drawn as density rasters in this mode)
+PCA_BACKEND = "memory"
+CHUNK_SIZE = 200_000
+N_COMPONENTS = 10
 
-    df = pd.read_csv(filtered_dir / f"{group}_positive_controls.csv")
-    sample_col = "Sample Type" if "Sample Type" in df.columns else "sample_type"
+# "well" / "field": run on the well or field profiles split by feature_groups.py (median of every
+# feature per well/field, analysis_utils/profiles.py) instead of single cells; every output name
+# gets a _<level>_profiles suffix. Profiles always use the "memory" backend. None: single cells.
+PROFILE_LEVEL = None
 
-    # Separate features and labels
-    X = df.drop(columns=[sample_col])
-    y = df[sample_col].astype(str).str.strip()
+# Run report: wall/CPU time, peak memory, rows and bytes per stage, as JSON + CSV
+# (analysis_utils/instrumentation.py); PROFILE_STAGES adds a cProfile dump per stage
+RUN_REPORT_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/run_reports")
+PROFILE_STAGES = False
+run_report = RunReport("pca_positive_control", RUN_REPORT_DIR, profile=PROFILE_STAGES)
 
-    # Run PCA
-    pca = PCA(n_components=10)
-    components = pca.fit_transform(X)
+pc_cols = [f"PC{i+1}" for i in range(N_COMPONENTS)]
 
-    # PCA DataFrame
-    pc_cols = [f"PC{i+1}" for i in range(10)]
-    pca_df = pd.DataFrame(components, columns=pc_cols)
-    pca_df[sample_col] = y
+# Fixed color mapping for M0, M1, M2
+palette = {
+    "M0": "blue",
+    "M1": "red",
+    "M2": "green"
+}
 
-    # Save transformed data
-    pca_df.to_csv(output_dir / f"{group}_pca_data.csv", index=False)
 
-    # Save explained variance
+def save_explained_variance(group, explained_var):
     variance_df = pd.DataFrame({
         "Principal Component": pc_cols,
-        "Explained Variance Ratio": pca.explained_variance_ratio_
+        "Explained Variance Ratio": explained_var
     })
     variance_df.to_csv(output_dir / f"{group}_explained_variance.csv", index=False)
 
-    # Plot top 3 PCs
-    top3_idx = sorted(range(10), key=lambda i: pca.explained_variance_ratio_[i], reverse=True)[:3]
+
+def top3_pairs(explained_var):
+    top3_idx = sorted(range(N_COMPONENTS), key=lambda i: explained_var[i], reverse=True)[:3]
     top3_pcs = [pc_cols[i] for i in top3_idx]
+    return [(top3_pcs[i], top3_pcs[j]) for i in range(3) for j in range(i + 1, 3)]
 
-    # Fixed color mapping for M0, M1, M2
-    palette = {
-        "M0": "blue",
-        "M1": "red",
-        "M2": "green"
-    }
 
+def save_top3_plots(group, explained_var, draw_pair):
+    # draw_pair(ax, x_pc, y_pc) puts the points for one PC pair on the axes
     pdf_path = output_dir / f"{group}_top3_pca_plots.pdf"
-    with PdfPages(pdf_path) as pdf:
-        for i in range(3):
-            for j in range(i + 1, 3):
-                x_pc, y_pc = top3_pcs[i], top3_pcs[j]
-
-                plt.figure(figsize=(12, 9))
-                sns.scatterplot(
-                    x=x_pc, y=y_pc,
-                    hue=sample_col,
-                    palette=palette,
-                    data=pca_df,
-                    alpha=0.8
-                )
-                plt.xlabel(f"{x_pc} ({pca.explained_variance_ratio_[pc_cols.index(x_pc)] * 100:.2f}%)")
-                plt.ylabel(f"{y_pc} ({pca.explained_variance_ratio_[pc_cols.index(y_pc)] * 100:.2f}%)")
-                plt.title(f"PCA: {x_pc} vs {y_pc} ({group})")
-                plt.legend(title="Sample Type", bbox_to_anchor=(1.05, 1), loc='upper left')
-                plt.tight_layout()
-                pdf.savefig()
-                plt.close()
+    with run_report.stage("PDF render", group=group) as stage, PdfPages(pdf_path) as pdf:
+        stage.wrote(pdf_path)
+        for x_pc, y_pc in top3_pairs(explained_var):
+            plt.figure(figsize=(12, 9))
+            draw_pair(plt.gca(), x_pc, y_pc)
+            plt.xlabel(f"{x_pc} ({explained_var[pc_cols.index(x_pc)] * 100:.2f}%)")
+            plt.ylabel(f"{y_pc} ({explained_var[pc_cols.index(y_pc)] * 100:.2f}%)")
+            plt.title(f"PCA: {x_pc} vs {y_pc} ({group})")
+            plt.legend(title="Sample Type", bbox_to_anchor=(1.05, 1), loc='upper left')
+            plt.tight_layout()
+            pdf.savefig()
+            plt.close()
+
+
+def run_pca_in_memory(group):
+    # STEP 1: Extract & save positive controls, STEP 2: PCA on the filtered rows already in memory
+    name = profile_name(group, PROFILE_LEVEL)
+    with run_report.stage("table load", group=group) as stage:
+        df = read_profiles(input_dir / name) if PROFILE_LEVEL else read_table(input_dir / name)
+        stage.read(input_dir / name)
+        stage.rows_out = len(df)
+    sample_col = "Sample Type" if "Sample Type" in df.columns else "sample_type"
 
-    print(f" PCA for {group} done. Saved plots + data to {output_dir}")
+    df[sample_col] = df[sample_col].astype(str).str.strip()
+    with run_report.stage("filter controls", rows_in=len(df), group=group) as stage:
+        df_pos = df[df[sample_col].isin(positive_controls)].copy()
+        del df
+        out_files = write_table(df_pos, filtered_dir / profile_name(f"{group}_positive_controls", PROFILE_LEVEL),
+                                export_csv=EXPORT_CSV)
+        stage.wrote(*out_files)
+        stage.rows_out = len(df_pos)
+    print(f" Saved positive controls for {group} → {out_files[0]}")
+
+    print(f"\n Running PCA for positive controls: {name}")
 
+    # Separate features and labels
+    X = df_pos.drop(columns=[sample_col])
+    y = df_pos[sample_col]
+
+    # Run PCA
+    with run_report.stage("PCA fit", rows_in=len(X), group=group, backend="memory"):
+        pca = PCA(n_components=N_COMPONENTS)
+        components = pca.fit_transform(X)
+
+    # PCA DataFrame
+    pca_df = pd.DataFrame(components, columns=pc_cols)
+    pca_df[sample_col] = y.values
+
+    # Save transformed data and explained variance
+    with run_report.stage("save results", rows_in=len(pca_df), group=group) as stage:
+        pca_df.to_csv(output_dir / f"{name}_pca_data.csv", index=False)
+        save_explained_variance(name, pca.explained_variance_ratio_)
+        stage.wrote(output_dir / f"{name}_pca_data.csv", output_dir / f"{name}_explained_variance.csv")
+
+    def draw_pair(ax, x_pc, y_pc):
+        if SCATTER_MODE == "density":
+            density_scatter(ax, pca_df, x_pc, y_pc, sample_col, palette, order=positive_controls, alpha=0.8)
+        else:
+            sns.scatterplot(
+                x=x_pc, y=y_pc,
+                hue=sample_col,
+                palette=palette,
+                data=pca_df,
+                alpha=0.8,
+                ax=ax
+            )
+
+    save_top3_plots(name, pca.explained_variance_ratio_, draw_pair)
+
+
+def run_pca_incremental(group):
+    columns = read_table_columns(input_dir / group)
+    sample_col = "Sample Type" if "Sample Type" in columns else "sample_type"
+    feature_cols = [col for col in columns if col != sample_col]
+    filtered_base = filtered_dir / f"{group}_positive_controls"
+
+    # STEP 1: Extract & save positive controls chunk by chunk
+    with run_report.stage("filter controls", group=group, backend="incremental") as stage, \
+            TableWriter(filtered_base, export_csv=EXPORT_CSV) as writer:
+        stage.read(input_dir / group)
+        stage.wrote(writer.path)
+        for chunk in iter_table_chunks(input_dir / group, chunk_size=CHUNK_SIZE):
+            chunk[sample_col] = chunk[sample_col].astype(str).str.strip()
+            writer.write(chunk[chunk[sample_col].isin(positive_controls)])
+    print(f" Saved positive controls for {group} → {writer.path}")
+
+    print(f"\n Running incremental PCA for positive controls: {group}")
+
+    # STEP 2a: Fit over the chunks. A chunk smaller than N_COMPONENTS (the tail) is fitted
+    # together with the chunk before it, since partial_fit needs at least that many rows.
+    with run_report.stage("PCA fit", group=group, backend="incremental") as stage:
+        pca = IncrementalPCA(n_components=N_COMPONENTS)
+        held = None
+        for chunk in iter_table_chunks(filtered_base, columns=feature_cols, chunk_size=CHUNK_SIZE):
+            X = chunk.to_numpy(dtype=FEATURE_DTYPE)
+            if held is not None and len(X) >= N_COMPONENTS:
+                pca.partial_fit(held)
+                held = X
+            else:
+                held = X if held is None else np.vstack([held, X])
+        if held is not None:
+            pca.partial_fit(held)
+        stage.read(filtered_base)
+    save_explained_variance(group, pca.explained_variance_ratio_)
+
+    # STEP 2b: Transform chunk by chunk into the components file, tracking the plot ranges
+    pca_path = output_dir / f"{group}_pca_data.csv"
+    with run_report.stage("PCA transform", group=group, backend="incremental") as stage:
+        lows, highs = np.full(N_COMPONENTS, np.inf), np.full(N_COMPONENTS, -np.inf)
+        for k, chunk in enumerate(iter_table_chunks(filtered_base, columns=feature_cols + [sample_col], chunk_size=CHUNK_SIZE)):
+            components = pca.transform(chunk[feature_cols].to_numpy(dtype=FEATURE_DTYPE))
+            lows, highs = np.minimum(lows, components.min(axis=0)), np.maximum(highs, components.max(axis=0))
+            pca_df = pd.DataFrame(components, columns=pc_cols)
+            pca_df[sample_col] = chunk[sample_col].to_numpy()
+            pca_df.to_csv(pca_path, mode="a" if k else "w", header=not k, index=False)
+        stage.read(filtered_base)
+        stage.wrote(pca_path)
+
+    # STEP 2c: Bin the components file into density layers for each plotted PC pair
+    pairs = top3_pairs(pca.explained_variance_ratio_)
+    extents = {}
+    for x_pc, y_pc in pairs:
+        xi, yi = pc_cols.index(x_pc), pc_cols.index(y_pc)
+        extents[x_pc, y_pc] = padded_extent(lows[xi], highs[xi], lows[yi], highs[yi])
+    with run_report.stage("density binning", group=group, backend="incremental") as stage:
+        layers = dict.fromkeys(pairs)
+        for chunk in pd.read_csv(pca_path, chunksize=CHUNK_SIZE):
+            for x_pc, y_pc in pairs:
+                chunk_layers = histogram_layers(chunk[x_pc], chunk[y_pc], chunk[sample_col].astype(str),
+                                                positive_controls, extents[x_pc, y_pc])
+                layers[x_pc, y_pc] = merge_layers(layers[x_pc, y_pc], chunk_layers)
+        stage.read(pca_path)
+
+    def draw_pair(ax, x_pc, y_pc):
+        present = {label: counts for label, counts in layers[x_pc, y_pc].items() if counts.any()}
+        draw_density_layers(ax, present, extents[x_pc, y_pc], resolve_palette(palette, present), alpha=0.8)
+
+    save_top3_plots(group, pca.explained_variance_ratio_, draw_pair)
+
+
+# === Run PCA for each feature group ===
+for group in feature_groups:
+    if PCA_BACKEND == "incremental" and PROFILE_LEVEL is None:
+        run_pca_incremental(group)
+    else:
+        run_pca_in_memory(group)
+    print(f" PCA for {group} done. Saved plots + data to {output_dir}")
@@ -1,67 +1,151 @@
 # Import necessary packages
 import os
+import sys
+from pathlib import Path
+import numpy as np
 import pandas as pd
-import umap
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-# Define file paths
-input_folder = "/Volumes/SM/RP1B Coding Portfolio/step_4_normalized_data"
-file_path = os.path.join(input_folder, "merged_dataset_with_sample_type.csv")
-
-# Read CSV and ensure proper encoding
-df = pd.read_csv(file_path)
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from analysis_utils.embedding_cache import cached_umap_model, fit_umap
+from analysis_utils.instrumentation import RunReport
+from analysis_utils.knn_graph import extended_knn, searchable_knn
+from analysis_utils.plotting import density_scatter
+from analysis_utils.storage import read_table, read_table_columns
+from analysis_utils.subsampling import read_rows, sample_table
 
-# Display basic info
-print("First few rows of the dataset:")
-print(df.head())
-print("\nColumn names:", df.columns)
+# Define file paths (Parquet is preferred, the CSV version is used if that is all there is)
+input_folder = "/Volumes/SM/RP1B Coding Portfolio/step_4_normalized_data"
+file_path = os.path.join(input_folder, "merged_dataset_with_sample_type")
 
 # Ensure "sample_type" exists
-if "sample_type" not in df.columns:
+available_columns = read_table_columns(file_path)
+if "sample_type" not in available_columns:
     raise KeyError("The column 'sample_type' is missing from the dataset!")
 
 # Define positive controls and experimental sample types
 positive_controls = ["M0", "M1", "M2"]
 experimental_types = ["SIS", "UBM", "Cardiac"]
 
-# Columns to exclude from UMAP
+# "density" bins the cells into one raster layer per sample type (fast at any cell count);
+# "points" draws every cell as a marker
+SCATTER_MODE = "density"
+
+# At most SUBSAMPLE_CAP cells per sample type are loaded, embedded and plotted (None: every cell).
+# The sample is drawn from the streamed sample_type column (analysis_utils/subsampling.py) and
+# only the sampled rows are read; it is saved to SAMPLE_DIR and reused while the table is unchanged.
+SUBSAMPLE_CAP = None
+SUBSAMPLE_SEED = 42
+SAMPLE_DIR = "/Volumes/SM/RP1B Coding Portfolio/test run/sample_indices"
+
+# Run report: wall/CPU time, peak memory, rows and bytes per stage, as JSON + CSV
+# (analysis_utils/instrumentation.py); PROFILE_STAGES adds a cProfile dump per stage
+RUN_REPORT_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/run_reports")
+PROFILE_STAGES = False
+run_report = RunReport("umap_comparison", RUN_REPORT_DIR, profile=PROFILE_STAGES)
+
+# Columns to exclude from UMAP (never loaded)
 exclude_columns = ["Well ID", "Unique ID", "Row", "Column", "Field", "Object Number (per well)", "sample_type"]
-feature_columns = [col for col in df.columns if col not in exclude_columns]
+feature_columns = [col for col in available_columns if col not in exclude_columns]
+
+# Read only the label and feature columns
+with run_report.stage("table load", cap=SUBSAMPLE_CAP) as stage:
+    if SUBSAMPLE_CAP:
+        keep = sample_table(file_path, "sample_type", SUBSAMPLE_CAP, SUBSAMPLE_SEED, SAMPLE_DIR,
+                            "merged_dataset_with_sample_type")
+        df = read_rows(file_path, keep, columns=feature_columns + ["sample_type"])
+    else:
+        df = read_table(file_path, columns=feature_columns + ["sample_type"])
+    stage.read(file_path)
+    stage.rows_out = len(df)
+
+# Display basic info
+print("First few rows of the dataset:")
+print(df.head())
+print("\nColumn names:", df.columns)
 
 # Create output folder if it doesn't exist
 test_run_folder = "/Volumes/SM/RP1B Coding Portfolio/test run"
 if not os.path.exists(test_run_folder):
     os.makedirs(test_run_folder)
 
+# UMAP settings
+umap_params = dict(n_neighbors=5, min_dist=0.3, n_components=2, random_state=42)
+
+# Shared kNN graph store: the control cells' neighbour graph is computed once (and cached across
+# scripts and reruns), then extended with each experimental group instead of searched from scratch.
+# Off by default: the merged graph is approximate, puts the controls first and is no faster than
+# UMAP's own search on a first run (see "Shared kNN Graph" in UMAP Comparison.md)
+REUSE_KNN_GRAPH = False
+knn_cache_dir = os.path.join(test_run_folder, "knn_graph_cache")
+controls_features = df[df["sample_type"].isin(positive_controls)][feature_columns].dropna()
+
+# "refit": fit UMAP on controls + each experimental group (one fit per group, each with its own
+#   control layout)
+# "reference": fit on the controls once, save the model, and place each experimental group into
+#   that embedding with transform (all plots share one control layout)
+UMAP_MODE = "refit"
+umap_model_dir = os.path.join(test_run_folder, "umap_reference_model")
+
+if UMAP_MODE == "reference":
+    # The graph must be searchable so the saved model can transform new cells
+    with run_report.stage("kNN graph", rows_in=len(controls_features), sample="controls"):
+        knn = (searchable_knn(controls_features, umap_params["n_neighbors"], knn_cache_dir)
+               if REUSE_KNN_GRAPH else None)
+    with run_report.stage("UMAP fit", rows_in=len(controls_features), sample="controls", mode=UMAP_MODE):
+        reference_umap = cached_umap_model(controls_features, umap_params, umap_model_dir, knn=knn)
+    controls_embedding = reference_umap.embedding_
+    print(f"Reference UMAP ready: {len(controls_features)} control cells")
+
 # Loop through each experimental sample type and create a separate UMAP plot
 for exp_type in experimental_types:
-    # Filter dataset: Select only positive controls + current experimental type
-    subset_df = df[df["sample_type"].isin(positive_controls + [exp_type])]
-
-    # Extract features and labels
-    features = subset_df[feature_columns].dropna()  # Handle missing values
-    labels = subset_df["sample_type"].astype(str).loc[features.index]  # Keep labels aligned
+    if UMAP_MODE == "reference":
+        # Controls keep their reference coordinates; the experimental cells are transformed
+        exp_features = df[df["sample_type"] == exp_type][feature_columns].dropna()
+        features = pd.concat([controls_features, exp_features])
+        with run_report.stage("UMAP transform", rows_in=len(exp_features), sample=exp_type) as stage:
+            embedding = np.vstack([controls_embedding, reference_umap.transform(exp_features)])
+            stage.rows_out = len(exp_features)
+    elif REUSE_KNN_GRAPH:
+        # Controls first, then the experimental cells, matching the extended kNN graph
+        exp_features = df[df["sample_type"] == exp_type][feature_columns].dropna()
+        features = pd.concat([controls_features, exp_features])
+        with run_report.stage("kNN graph", rows_in=len(features), sample=exp_type):
+            knn = extended_knn(controls_features, exp_features, umap_params["n_neighbors"], knn_cache_dir)
+    else:
+        # Filter dataset: Select only positive controls + current experimental type
+        subset_df = df[df["sample_type"].isin(positive_controls + [exp_type])]
+        features = subset_df[feature_columns].dropna()  # Handle missing values
+        knn = None
+    labels = df["sample_type"].astype(str).loc[features.index]  # Keep labels aligned
 
     # Apply UMAP
-    reducer = umap.UMAP(n_neighbors=5, min_dist=0.3, n_components=2, random_state=42)
-    embedding = reducer.fit_transform(features)
+    if UMAP_MODE != "reference":
+        with run_report.stage("UMAP fit", rows_in=len(features), sample=exp_type, mode=UMAP_MODE) as stage:
+            reducer, embedding = fit_umap(features, umap_params, knn=knn)
+            stage.rows_out = len(embedding)
 
     # Convert UMAP output to a DataFrame for plotting
     embedding_df = pd.DataFrame(embedding, columns=["UMAP1", "UMAP2"])
     embedding_df["sample_type"] = labels.values  # Assign labels for coloring
 
     # Plot UMAP results
-    plt.figure(figsize=(6, 4))
-    sns.scatterplot(
-        x="UMAP1", y="UMAP2", hue="sample_type", palette="Set1", data=embedding_df, s=100
-    )
-    plt.title(f"UMAP Projection: {exp_type} vs. M0, M1, M2", fontsize=16)
-    plt.legend(title="Sample Type", loc='center left', bbox_to_anchor=(1, 0.5))
-
-    # Save plot
-    png_path = os.path.join(test_run_folder, f"umap_projection_{exp_type}.png")
-    plt.savefig(png_path, bbox_inches='tight', dpi=300)
+    with run_report.stage("PNG render", rows_in=len(embedding_df), sample=exp_type) as stage:
+        plt.figure(figsize=(6, 4))
+        if SCATTER_MODE == "density":
+            density_scatter(plt.gca(), embedding_df, "UMAP1", "UMAP2", "sample_type", "Set1")
+        else:
+            sns.scatterplot(
+                x="UMAP1", y="UMAP2", hue="sample_type", palette="Set1", data=embedding_df, s=100
+            )
+        plt.title(f"UMAP Projection: {exp_type} vs. M0, M1, M2", fontsize=16)
+        plt.legend(title="Sample Type", loc='center left', bbox_to_anchor=(1, 0.5))
+
+        # Save plot
+        png_path = os.path.join(test_run_folder, f"umap_projection_{exp_type}.png")
+        plt.savefig(png_path, bbox_inches='tight', dpi=300)
+        stage.wrote(png_path)
     plt.show()
 
     print(f"UMAP plot for {exp_type} saved at: {png_path}")
@@ -1,67 +1,115 @@
 import os
+import sys
+from pathlib import Path
 import pandas as pd
-import umap
 import matplotlib.pyplot as plt
 import seaborn as sns
 from matplotlib.backends.backend_pdf import PdfPages
 
-# Define file paths
-input_folder = "/Volumes/SM/RP1B Coding Portfolio/step_4_normalized_data"
-file_path = os.path.join(input_folder, "merged_dataset_with_sample_type.csv")
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from analysis_utils.embedding_cache import cached_umap_embedding
+from analysis_utils.instrumentation import RunReport
+from analysis_utils.knn_graph import extended_knn
+from analysis_utils.plotting import density_scatter
+from analysis_utils.storage import read_table, read_table_columns
 
-# Read CSV and ensure proper encoding
-df = pd.read_csv(file_path)
+# Define file paths (Parquet is preferred, the CSV version is used if that is all there is)
+input_folder = "/Volumes/SM/RP1B Coding Portfolio/step_4_normalized_data"
+file_path = os.path.join(input_folder, "merged_dataset_with_sample_type")
 
 # Ensure "sample_type" exists
-if "sample_type" not in df.columns:
+available_columns = read_table_columns(file_path)
+if "sample_type" not in available_columns:
     raise KeyError("The column 'sample_type' is missing from the dataset!")
 
 # Define positive controls and experimental sample types
 positive_controls = ["M0", "M1", "M2"]
 experimental_types = ["SIS", "UBM", "Cardiac"]
 
-# Columns to exclude from UMAP
+# "density" bins the cells into one raster image per page (fast, small PDFs at any cell count);
+# "points" draws every cell as a vector marker
+SCATTER_MODE = "density"
+
+# Run report: wall/CPU time, peak memory, rows and bytes per stage, as JSON + CSV
+# (analysis_utils/instrumentation.py); PROFILE_STAGES adds a cProfile dump per stage
+RUN_REPORT_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/run_reports")
+PROFILE_STAGES = False
+run_report = RunReport("umap_controls_vs_experimentals", RUN_REPORT_DIR, profile=PROFILE_STAGES)
+
+# Columns to exclude from UMAP (never loaded)
 exclude_columns = ["Well ID", "Unique ID", "Row", "Column", "Field", "Object Number (per well)", "sample_type"]
-feature_columns = [col for col in df.columns if col not in exclude_columns]
+feature_columns = [col for col in available_columns if col not in exclude_columns]
+
+# Read only the label and feature columns
+with run_report.stage("table load") as stage:
+    df = read_table(file_path, columns=feature_columns + ["sample_type"])
+    stage.read(file_path)
+    stage.rows_out = len(df)
 
 # Create output folder if it doesn't exist
 test_run_folder = "/Volumes/SM/RP1B Coding Portfolio/test run"
 os.makedirs(test_run_folder, exist_ok=True)
 
+# UMAP settings and on-disk embedding cache (one fit per dataset/feature set/parameter combination)
+umap_params = dict(n_neighbors=5, min_dist=0.3, n_components=10, random_state=42)
+embedding_cache_dir = os.path.join(test_run_folder, "umap_embedding_cache")
+
+# Shared kNN graph store: the control cells' neighbour graph is computed once (and cached across
+# scripts and reruns), then extended with each experimental group instead of searched from scratch.
+# Off by default: the merged graph is approximate, puts the controls first and is no faster than
+# UMAP's own search on a first run (see "Shared kNN Graph" in UMAP Control Vs Experimentals.md)
+REUSE_KNN_GRAPH = False
+knn_cache_dir = os.path.join(test_run_folder, "knn_graph_cache")
+controls_features = df[df["sample_type"].isin(positive_controls)][feature_columns].dropna()
+
 # Loop through each experimental sample type and create a separate PDF
 for exp_type in experimental_types:
     pdf_path = os.path.join(test_run_folder, f"umap_projections_{exp_type}.pdf")
 
-    with PdfPages(pdf_path) as pdf:
+    if REUSE_KNN_GRAPH:
+        # Controls first, then the experimental cells, matching the extended kNN graph
+        exp_features = df[df["sample_type"] == exp_type][feature_columns].dropna()
+        features = pd.concat([controls_features, exp_features])
+        with run_report.stage("kNN graph", rows_in=len(features), sample=exp_type):
+            knn = extended_knn(controls_features, exp_features, umap_params["n_neighbors"], knn_cache_dir)
+    else:
         # Filter dataset: Select only positive controls + current experimental type
         subset_df = df[df["sample_type"].isin(positive_controls + [exp_type])]
-
-        # Extract features and labels
         features = subset_df[feature_columns].dropna()
-        labels = subset_df["sample_type"].astype(str).loc[features.index]
+        knn = None
 
-        # Generate all UMAP projections between components 1 to 10
-        for i in range(1, 11):
-            for j in range(i + 1, 11):
-                # Apply UMAP with 10 components
-                reducer = umap.UMAP(n_neighbors=5, min_dist=0.3, n_components=10, random_state=42)
-                embedding = reducer.fit_transform(features)
+    # Extract labels
+    labels = df["sample_type"].astype(str).loc[features.index]
 
-                # Convert UMAP output to a DataFrame for plotting
-                umap_columns = [f"UMAP{k}" for k in range(1, 11)]
-                embedding_df = pd.DataFrame(embedding, columns=umap_columns)
-                embedding_df["sample_type"] = labels.values
+    # Fit UMAP with 10 components once (or load it from the cache on reruns)
+    with run_report.stage("UMAP fit", rows_in=len(features), sample=exp_type) as stage:
+        embedding = cached_umap_embedding(features, umap_params, embedding_cache_dir, knn=knn)
+        stage.rows_out = len(embedding)
 
+    # Convert UMAP output to a DataFrame for plotting
+    umap_columns = [f"UMAP{k}" for k in range(1, 11)]
+    embedding_df = pd.DataFrame(embedding, columns=umap_columns)
+    embedding_df["sample_type"] = labels.values
+
+    with run_report.stage("PDF render", rows_in=len(embedding_df), sample=exp_type) as stage, \
+            PdfPages(pdf_path) as pdf:
+        stage.wrote(pdf_path)
+        # Generate all UMAP projections between components 1 to 10 from the single embedding
+        for i in range(1, 11):
+            for j in range(i + 1, 11):
                 # Plot UMAP results
                 plt.figure(figsize=(6, 4))
-                sns.scatterplot(
-                    x=f"UMAP{i}",
-                    y=f"UMAP{j}",
-                    hue="sample_type",
-                    palette="Set1",
-                    data=embedding_df,
-                    s=100
-                )
+                if SCATTER_MODE == "density":
+                    density_scatter(plt.gca(), embedding_df, f"UMAP{i}", f"UMAP{j}", "sample_type", "Set1")
+                else:
+                    sns.scatterplot(
+                        x=f"UMAP{i}",
+                        y=f"UMAP{j}",
+                        hue="sample_type",
+                        palette="Set1",
+                        data=embedding_df,
+                        s=100
+                    )
                 plt.title(f"UMAP Projection ({i},{j}): {exp_type} vs. M0, M1, M2", fontsize=16)
                 plt.legend(title="Sample Type", loc='center left', bbox_to_anchor=(1, 0.5))
 
@@ -1,11 +1,20 @@
 import os
+import sys
 import pandas as pd
-import umap
 import matplotlib.pyplot as plt
 import seaborn as sns
 from matplotlib.backends.backend_pdf import PdfPages
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from analysis_utils.embedding_cache import fit_umap
+from analysis_utils.instrumentation import RunReport
+from analysis_utils.knn_graph import cached_knn
+from analysis_utils.plotting import density_scatter
+from analysis_utils.profiles import profile_name
+from analysis_utils.storage import read_table
+from analysis_utils.subsampling import sample_rows
+
 # === CONFIG ===
 input_dir = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/positive_controls_only")
 output_dir = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/umap_positive_controls")
@@ -17,44 +26,93 @@ positive_controls = ["M0", "M1", "M2"]
 # Color scheme
 color_map = {"M0": "blue", "M1": "red", "M2": "green"}
 
+# "density" bins the cells into one raster image per page (fast, small PDFs at any cell count);
+# "points" draws every cell as a vector marker
+SCATTER_MODE = "density"
+
+# "well" / "field": embed the controls' well or field profiles written by pca_positive_control.py
+# with the same PROFILE_LEVEL (analysis_utils/profiles.py) instead of single cells; output names
+# get a _<level>_profiles suffix. None: single cells.
+PROFILE_LEVEL = None
+
+# At most SUBSAMPLE_CAP cells per sample type go into the fit and the plot (None: every cell).
+# The rows are drawn with analysis_utils/subsampling.py and saved to SAMPLE_DIR per feature group,
+# then reused while that group's labels are unchanged; the same cap and seed pick the same control
+# cells in every feature group and in pca_control_vs_experimental.py.
+SUBSAMPLE_CAP = None
+SUBSAMPLE_SEED = 42
+SAMPLE_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/sample_indices")
+
+# kNN graphs (and their search indexes) are cached and reused across reruns
+REUSE_KNN_GRAPH = True
+knn_cache_dir = output_dir / "knn_graph_cache"
+
+# Run report: wall/CPU time, peak memory, rows and bytes per stage, as JSON + CSV
+# (analysis_utils/instrumentation.py); PROFILE_STAGES adds a cProfile dump per stage
+RUN_REPORT_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/run_reports")
+PROFILE_STAGES = False
+run_report = RunReport("umap_positive_controls", RUN_REPORT_DIR, profile=PROFILE_STAGES)
+
 # === RUN UMAP for each group ===
 for group in feature_groups:
-    print(f"\n Running UMAP for: {group}")
+    name = profile_name(group, PROFILE_LEVEL)
+    print(f"\n Running UMAP for: {name}")
 
-    df = pd.read_csv(input_dir / f"{group}_positive_controls.csv")
+    input_base = input_dir / profile_name(f"{group}_positive_controls", PROFILE_LEVEL)
+    with run_report.stage("table load", group=group) as stage:
+        df = read_table(input_base)
+        stage.read(input_base)
+        stage.rows_out = len(df)
     sample_col = "Sample Type" if "Sample Type" in df.columns else "sample_type"
     df[sample_col] = df[sample_col].astype(str).str.strip()
     df = df[df[sample_col].isin(positive_controls)]
+    if SUBSAMPLE_CAP:
+        with run_report.stage("subsample", rows_in=len(df), group=group, cap=SUBSAMPLE_CAP) as stage:
+            keep = sample_rows(df[sample_col], SUBSAMPLE_CAP, SUBSAMPLE_SEED, SAMPLE_DIR,
+                               profile_name(f"{group}_positive_controls", PROFILE_LEVEL))
+            df = df.iloc[keep]
+            stage.rows_out = len(df)
 
     # Split features and labels
     X = df.drop(columns=[sample_col]).dropna()
     y = df.loc[X.index, sample_col]
 
     # UMAP 2D with adjusted params to increase spacing
-    reducer = umap.UMAP(n_components=2, n_neighbors=10, min_dist=0.6, random_state=42)
-    embedding = reducer.fit_transform(X)
+    umap_params = dict(n_components=2, n_neighbors=10, min_dist=0.6, random_state=42)
+    with run_report.stage("kNN graph", rows_in=len(X), group=group):
+        knn = cached_knn(X, umap_params["n_neighbors"], knn_cache_dir, searchable=True) if REUSE_KNN_GRAPH else None
+    with run_report.stage("UMAP fit", rows_in=len(X), group=group) as stage:
+        reducer, embedding = fit_umap(X, umap_params, knn=knn)
+        stage.rows_out = len(embedding)
 
     # Combine with labels
     umap_df = pd.DataFrame(embedding, columns=["UMAP1", "UMAP2"])
     umap_df[sample_col] = y.values
-    umap_df.to_csv(output_dir / f"{group}_umap_2d.csv", index=False)
+    with run_report.stage("save results", rows_in=len(umap_df), group=group) as stage:
+        umap_df.to_csv(output_dir / f"{name}_umap_2d.csv", index=False)
+        stage.wrote(output_dir / f"{name}_umap_2d.csv")
 
     # Plot to PDF
-    pdf_path = output_dir / f"{group}_umap_2d_plot.pdf"
-    with PdfPages(pdf_path) as pdf:
+    pdf_path = output_dir / f"{name}_umap_2d_plot.pdf"
+    with run_report.stage("PDF render", rows_in=len(umap_df), group=group) as stage, PdfPages(pdf_path) as pdf:
+        stage.wrote(pdf_path)
         plt.figure(figsize=(12, 9))  #  Make plot smaller
-        sns.scatterplot(
-            data=umap_df,
-            x="UMAP1", y="UMAP2",
-            hue=sample_col,
-            palette=color_map,
-            s=50,
-            alpha=0.85
-        )
-        plt.title(f"UMAP 2D - {group}")
+        if SCATTER_MODE == "density":
+            density_scatter(plt.gca(), umap_df, "UMAP1", "UMAP2", sample_col, color_map,
+                            order=positive_controls, alpha=0.85)
+        else:
+            sns.scatterplot(
+                data=umap_df,
+                x="UMAP1", y="UMAP2",
+                hue=sample_col,
+                palette=color_map,
+                s=50,
+                alpha=0.85
+            )
+        plt.title(f"UMAP 2D - {name}")
         plt.legend(title="Sample Type", bbox_to_anchor=(1.05, 1), loc='upper left')
         plt.tight_layout()
         pdf.savefig()
         plt.close()
 
-    print(f" Saved 2D UMAP plot for {group} → {pdf_path}")
+    print(f" Saved 2D UMAP plot for {name} → {pdf_path}")
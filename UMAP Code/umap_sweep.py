@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+from functools import lru_cache
+from itertools import product
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from analysis_utils import umap_store
+from analysis_utils.embedding_cache import fit_umap, hash_inputs
+from analysis_utils.instrumentation import RunReport, StageRecorder
+from analysis_utils.knn_graph import extended_knn
+from analysis_utils.plotting import density_scatter
+from analysis_utils.storage import read_table, table_exists
+
+# === CONFIG ===
+input_controls = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/positive_controls_only")
+input_experimentals = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/experimental_samples")
+# Results store: index.csv + embeddings/ (see analysis_utils/umap_store.py)
+output_base = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/umap_sweep")
+knn_cache_dir = output_base / "knn_graph_cache"
+
+feature_groups = ["shape_and_size", "intensity_and_texture", "ser"]
+positive_controls = ["M0", "M1", "M2"]
+experimental_samples = ["SIS", "UBM", "Cardiac"]
+
+# Parameter grid, fitted for every feature group x experiment (controls + one experimental group).
+# One kNN graph is computed per n_neighbors and shared by all its min_dist/n_components fits.
+N_NEIGHBORS = [5, 10, 15, 30]
+MIN_DIST = [0.0, 0.1, 0.3, 0.6]
+N_COMPONENTS = [2]
+RANDOM_STATE = 42
+
+# Worker processes (at most this many fits run at once); finished fits are skipped on reruns
+N_WORKERS = os.cpu_count() or 1
+
+# One PDF page per feature group x experiment: a grid of n_neighbors (rows) x min_dist (columns)
+PLOT_GRID = True
+palette = {"M0": "blue", "M1": "red", "M2": "green", "SIS": "orange", "UBM": "purple", "Cardiac": "brown"}
+
+# Run report: wall/CPU time, peak memory, rows and bytes per stage, as JSON + CSV
+# (analysis_utils/instrumentation.py); PROFILE_STAGES adds a cProfile dump per stage
+RUN_REPORT_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/run_reports")
+PROFILE_STAGES = False
+
+
+@lru_cache(maxsize=2)
+def load_pair(group, exp):
+    # Controls first, then the experimental cells (the row order of the extended kNN graph);
+    # cached so a worker loads each table once for all the fits it runs on it
+    controls_df = read_table(input_controls / f"{group}_positive_controls")
+    exp_df = read_table(input_experimentals / f"{group}_{exp}")
+    label_col = "Sample Type" if "Sample Type" in controls_df.columns else "sample_type"
+    controls_df, exp_df = controls_df.dropna(), exp_df.dropna()
+    labels = pd.concat([controls_df[label_col], exp_df[label_col]]).astype(str).str.strip().to_numpy()
+    return controls_df.drop(columns=[label_col]), exp_df.drop(columns=[label_col]), labels
+
+
+def build_graphs(group, n_neighbors, experiments, profile_dir=None):
+    # Controls' graph (cached, searchable) extended with each experimental group; each combined
+    # graph is saved under a name keyed by its input cells and returned per experiment,
+    # together with the stage records of this task
+    stages = StageRecorder(profile_dir)
+    graph_files = {}
+    for exp in experiments:
+        with stages.stage("table load", group=group, sample=exp) as stage:
+            controls, exp_features, _ = load_pair(group, exp)
+            stage.read(input_controls / f"{group}_positive_controls", input_experimentals / f"{group}_{exp}")
+            stage.rows_out = len(controls) + len(exp_features)
+        features = pd.concat([controls, exp_features])
+        key = hash_inputs(features, dict(n_neighbors=n_neighbors, random_state=RANDOM_STATE, extended=True))
+        graph_file = knn_cache_dir / f"sweep_knn_{key}.npz"
+        if not graph_file.exists():
+            with stages.stage("kNN graph", rows_in=len(features), group=group, sample=exp,
+                              n_neighbors=n_neighbors) as stage:
+                indices, distances = extended_knn(controls, exp_features, n_neighbors, knn_cache_dir,
+                                                  random_state=RANDOM_STATE)
+                tmp_file = graph_file.with_suffix(".tmp.npz")
+                np.savez(tmp_file, indices=indices, distances=distances)
+                os.replace(tmp_file, graph_file)
+                stage.wrote(graph_file)
+        graph_files[exp] = graph_file.name
+    return graph_files, stages.records
+
+
+def fit_one(group, exp, n_neighbors, min_dist, n_components, graph_name, profile_dir=None):
+    # Returns the index row of the stored embedding and the stage records of this fit
+    stages = StageRecorder(profile_dir)
+    controls, exp_features, labels = load_pair(group, exp)
+    features = pd.concat([controls, exp_features])
+    graph = np.load(knn_cache_dir / graph_name)
+    params = dict(n_neighbors=n_neighbors, min_dist=min_dist, n_components=n_components,
+                  random_state=RANDOM_STATE)
+
+    start = time.perf_counter()
+    with stages.stage("UMAP fit", rows_in=len(features), group=group, sample=exp, n_neighbors=n_neighbors,
+                      min_dist=min_dist, n_components=n_components) as stage:
+        _, embedding = fit_umap(features, params, knn=(graph["indices"], graph["distances"]))
+        stage.read(knn_cache_dir / graph_name)
+        stage.rows_out = len(embedding)
+    seconds = time.perf_counter() - start
+
+    name = umap_store.embedding_name(group, exp, n_neighbors, min_dist, n_components)
+    umap_store.save_embedding(output_base, embedding, labels, name)
+    row = [group, exp, n_neighbors, min_dist, n_components, len(features), round(seconds, 2), graph_name, name]
+    return row, stages.records
+
+
+def run_sweep(n_workers=N_WORKERS, report=None):
+    report = report or StageRecorder()
+    output_base.mkdir(parents=True, exist_ok=True)
+    pairs = [(group, exp) for group in feature_groups for exp in experimental_samples
+             if table_exists(input_experimentals / f"{group}_{exp}")]
+    experiments = {group: [exp for g, exp in pairs if g == group] for group in feature_groups}
+
+    with ProcessPoolExecutor(max_workers=max(1, n_workers)) as pool:
+        # Stage 1: one kNN graph per feature group x experiment x n_neighbors (the controls'
+        # graph is built once per feature group x n_neighbors and reused for every experiment)
+        graph_jobs = {(group, k): pool.submit(build_graphs, group, k, experiments[group], report.profile_dir)
+                      for group in feature_groups if experiments[group] for k in N_NEIGHBORS}
+        graphs = {}
+        for (group, k), job in graph_jobs.items():
+            graph_files, records = job.result()
+            report.add(records)
+            for exp, graph_name in graph_files.items():
+                graphs[group, exp, k] = graph_name
+        print(f"kNN graphs ready: {len(graphs)} ({len(pairs)} datasets x {len(N_NEIGHBORS)} n_neighbors)")
+
+        # Stage 2: the fits, skipping any already in the store for the same graph
+        index = umap_store.load_index(output_base)
+        done = umap_store.stored_keys(index)
+        fits = [(group, exp, k, d, c, graphs[group, exp, k])
+                for (group, exp), k, d, c in product(pairs, N_NEIGHBORS, MIN_DIST, N_COMPONENTS)]
+        todo = [fit for fit in fits if fit not in done]
+        print(f"UMAP fits: {len(todo)} to run, {len(fits) - len(todo)} already stored")
+
+        futures = [pool.submit(fit_one, *fit, report.profile_dir) for fit in todo]
+        for fit, future in zip(todo, futures):
+            try:
+                row, records = future.result()
+            except Exception as e:
+                print(f"Failed {fit[:5]}: {type(e).__name__}: {e}")
+                continue
+            report.add(records)
+            # Index rewritten after every fit, so an interrupted sweep keeps what finished
+            index = umap_store.add_entries(index, [row])
+            umap_store.save_index(index, output_base)
+            print(f"{row[-1]}: {row[5]} cells in {row[6]:.1f}s")
+    return index
+
+
+def plot_grids(report=None):
+    # Reads everything back through the store's query interface
+    report = report or StageRecorder()
+    for (group, exp), c in product(product(feature_groups, experimental_samples), N_COMPONENTS):
+        rows = umap_store.query(output_base, **{"Feature Group": group, "Experiment": exp, "n_components": c})
+        if rows.empty:
+            continue
+        neighbors, dists = sorted(rows["n_neighbors"].unique()), sorted(rows["min_dist"].unique())
+        fig, axes = plt.subplots(len(neighbors), len(dists), figsize=(3 * len(dists), 3 * len(neighbors)),
+                                 squeeze=False)
+        for ax in axes.ravel():
+            ax.set_axis_off()
+        for _, row in rows.iterrows():
+            ax = axes[neighbors.index(row["n_neighbors"]), dists.index(row["min_dist"])]
+            ax.set_axis_on()
+            embedding_df = umap_store.load_embedding(output_base, row)
+            density_scatter(ax, embedding_df, "UMAP1", "UMAP2", "Sample Type", palette,
+                            order=positive_controls + [exp])
+            ax.set_title(f"n_neighbors={row['n_neighbors']}, min_dist={row['min_dist']:g}", fontsize=9)
+            ax.set_xticks([])
+            ax.set_yticks([])
+        handles, labels = axes.ravel()[0].get_legend_handles_labels()
+        fig.legend(handles, labels, title="Sample Type", loc="center left", bbox_to_anchor=(1, 0.5))
+        fig.suptitle(f"UMAP sweep: {group} | {exp} vs. M0, M1, M2 ({c} components)")
+        fig.tight_layout()
+
+        pdf_path = output_base / f"umap_sweep_{group}_{exp}_nc{c}.pdf"
+        with report.stage("PDF render", group=group, sample=exp, n_components=c) as stage, \
+                PdfPages(pdf_path) as pdf:
+            stage.wrote(pdf_path)
+            pdf.savefig(fig, bbox_inches="tight", dpi=300)
+        plt.close(fig)
+        print(f"Sweep grid saved: {pdf_path}")
+
+
+if __name__ == "__main__":
+    run_report = RunReport("umap_sweep", RUN_REPORT_DIR, profile=PROFILE_STAGES)
+    run_sweep(report=run_report)
+    if PLOT_GRID:
+        plot_grids(run_report)
@@ -0,0 +1,2 @@
+# Shared helpers used by the scripts in data_pre_processing/, PCA Code/ and UMAP Code/.
+# Scripts add the repository root to sys.path and import from here directly.
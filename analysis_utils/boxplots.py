@@ -0,0 +1,111 @@
+import atexit
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from analysis_utils.instrumentation import StageRecorder
+
+
+def boxplot_stats(values, labels, whis=1.5, max_fliers=200, seed=0):
+    # Summary statistics for matplotlib's Axes.bxp, computed for all columns at once:
+    # quartiles, whiskers (most extreme data within whis * IQR) and a capped random
+    # sample of fliers, so the full column data never reaches matplotlib
+    values = np.asarray(values, dtype=float)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        q1, med, q3 = np.nanquantile(values, [0.25, 0.5, 0.75], axis=0)
+        iqr = q3 - q1
+        inside = (values >= q1 - whis * iqr) & (values <= q3 + whis * iqr)
+        whislo = np.nanmin(np.where(inside, values, np.nan), axis=0)
+        whishi = np.nanmax(np.where(inside, values, np.nan), axis=0)
+
+    rng = np.random.default_rng(seed)
+    outside = ~inside & ~np.isnan(values)
+    stats = []
+    for j, label in enumerate(labels):
+        fliers = values[outside[:, j], j]
+        if len(fliers) > max_fliers:
+            fliers = rng.choice(fliers, size=max_fliers, replace=False)
+        stats.append(dict(label=label, med=med[j], q1=q1[j], q3=q3[j],
+                          whislo=whislo[j], whishi=whishi[j], fliers=fliers))
+    return stats
+
+
+def boxplot_stats_from_summary(labels, q1, med, q3, min_value, max_value, whis=1.5):
+    # Approximate bxp statistics from streamed summaries: whiskers are the IQR fences clipped
+    # to the observed range, and only the column min/max are shown as fliers
+    iqr = q3 - q1
+    whislo = np.maximum(q1 - whis * iqr, min_value)
+    whishi = np.minimum(q3 + whis * iqr, max_value)
+    stats = []
+    for j, label in enumerate(labels):
+        fliers = [v for v in (min_value[j], max_value[j]) if v < whislo[j] or v > whishi[j]]
+        stats.append(dict(label=label, med=med[j], q1=q1[j], q3=q3[j],
+                          whislo=whislo[j], whishi=whishi[j], fliers=np.array(fliers)))
+    return stats
+
+
+def render_boxplots(stats, path):
+    # One subplot per feature, three per row. Uses the object-oriented API (no pyplot state).
+    # The grid is regular, so margins are fixed in inches instead of measured by tight_layout,
+    # which laid out every axis' ticks and title (about a third of the render time).
+    height = len(stats) * 1.5
+    fig = Figure(figsize=(15, height))
+    FigureCanvasAgg(fig)
+    fig.subplots_adjust(left=0.05, right=0.98, top=1 - 0.3 / height, bottom=0.2 / height,
+                        hspace=0.12, wspace=0.2)
+    for idx, feature_stats in enumerate(stats, 1):
+        ax = fig.add_subplot((len(stats) // 3) + 1, 3, idx)
+        ax.bxp([feature_stats], flierprops=dict(markerfacecolor='red', marker='o'))
+        ax.set_xticks([])
+        ax.set_title(feature_stats["label"])
+    fig.savefig(path)
+    return path
+
+
+def _render_job(stats, path, profile_dir=None):
+    # Runs in the renderer's worker process; returns the stage records for the parent's report
+    stages = StageRecorder(profile_dir)
+    with stages.stage("boxplot render", file=Path(path).stem) as stage:
+        render_boxplots(stats, path)
+        stage.wrote(path)
+    return path, stages.records
+
+
+class BackgroundBoxplotRenderer:
+    # Renders boxplot PNGs in a worker process so the data pipeline neither waits for them nor
+    # shares the GIL with them. Nearly all of a render is matplotlib building and drawing one
+    # axes per feature, so it cannot be made much cheaper than a few seconds per plate.
+    # stages: optional StageRecorder (analysis_utils/instrumentation.py) collecting each render.
+
+    def __init__(self, stages=None):
+        self._pool = ProcessPoolExecutor(max_workers=1)
+        self._futures = []
+        self._stages = stages
+
+    def submit(self, stats, path):
+        profile_dir = self._stages.profile_dir if self._stages is not None else None
+        self._futures.append(self._pool.submit(_render_job, stats, path, profile_dir))
+
+    def wait(self):
+        for future in self._futures:
+            try:
+                path, records = future.result()
+            except Exception as e:
+                print(f"Boxplot rendering failed: {type(e).__name__}: {e}")
+                continue
+            if self._stages is not None:
+                self._stages.add(records)
+            print(f"Boxplot saved at {path}")
+        self._futures = []
+        self._pool.shutdown()
+
+    def wait_at_exit(self):
+        # Join when the interpreter exits instead of now, so the caller's remaining work (and
+        # its run time) does not include renders still in flight. Registered after a RunReport,
+        # so it runs first and the render records are in the saved report.
+        atexit.register(self.wait)
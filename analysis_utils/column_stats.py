@@ -0,0 +1,12 @@
+import numpy as np
+
+
+def column_skew(values):
+    # NaN-aware, biased sample skewness per column (matches scipy.stats.skew defaults).
+    # Accumulated in float64 whatever the input dtype (float32 sums drift on large plates).
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nanmean(values, axis=0, dtype=np.float64)
+        centered = values - mean
+        m2 = np.nanmean(centered ** 2, axis=0)
+        m3 = np.nanmean(centered ** 3, axis=0)
+        return m3 / m2 ** 1.5
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import pickle
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import umap
+
+
+def hash_inputs(features, params):
+    # Key covers the feature values, the column order and every UMAP parameter
+    row_hashes = pd.util.hash_pandas_object(features, index=False).to_numpy()
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(col) for col in features.columns]).encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    digest.update(umap.__version__.encode())
+    digest.update(row_hashes.tobytes())
+    return digest.hexdigest()
+
+
+def fit_umap(features, params, knn=None):
+    # knn: optional (indices, distances[, NNDescent index]) graph with exactly n_neighbors columns,
+    # used instead of UMAP's own neighbour search. Without an index the model cannot transform
+    # new data, which UMAP warns about; the warning is expected here and silenced.
+    if knn is None:
+        reducer = umap.UMAP(**params)
+        return reducer, reducer.fit_transform(features)
+    indices, distances, index = (tuple(knn) + (None,))[:3]
+    reducer = umap.UMAP(**params, precomputed_knn=(indices, distances, index))
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="precomputed_knn\\[2\\]")
+        return reducer, reducer.fit_transform(features)
+
+
+def cached_umap_embedding(features, params, cache_dir, knn=None):
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Embeddings from a precomputed (approximate) graph are cached separately from UMAP's own
+    key_params = dict(params, precomputed_knn=True) if knn is not None else params
+    cache_file = cache_dir / f"umap_{hash_inputs(features, key_params)}.npy"
+
+    if cache_file.exists():
+        print(f"Loaded cached UMAP embedding: {cache_file.name}")
+        return np.load(cache_file)
+
+    _, embedding = fit_umap(features, params, knn)
+
+    # Write to a temp file first so an interrupted run never leaves a truncated cache entry
+    tmp_file = cache_file.with_suffix(".tmp.npy")
+    np.save(tmp_file, embedding)
+    os.replace(tmp_file, cache_file)
+    print(f"Cached UMAP embedding: {cache_file.name}")
+    return embedding
+
+
+def cached_umap_model(features, params, cache_dir, knn=None):
+    # Fitted UMAP model for features, pickled as umap_model_<hash>.pkl so later runs can transform
+    # new cells into the same embedding without refitting. A precomputed knn must include its
+    # NNDescent index (searchable), which transform needs to place new cells.
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    key_params = dict(params, precomputed_knn=True) if knn is not None else params
+    cache_file = cache_dir / f"umap_model_{hash_inputs(features, key_params)}.pkl"
+
+    if cache_file.exists():
+        with open(cache_file, "rb") as handle:
+            reducer = pickle.load(handle)
+        print(f"Loaded cached UMAP model: {cache_file.name}")
+        return reducer
+
+    reducer, _ = fit_umap(features, params, knn)
+
+    # Write to a temp file first so an interrupted run never leaves a truncated cache entry
+    tmp_file = cache_file.with_suffix(".tmp")
+    with open(tmp_file, "wb") as handle:
+        pickle.dump(reducer, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+    print(f"Cached UMAP model: {cache_file.name}")
+    return reducer
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+# Feature columns of the high-content imaging exports, grouped as split by feature_groups.py.
+# Kept here so other code (e.g. benchmarks/synthetic_data.py) can use them without running the splitter.
+
+shape_and_size = [
+    "body_roundness", "CellArea", "cellbody_area", "Cell_Elongation", "cell_full_length",
+    "cell_half_width", "Cell_length_by_area", "Cell_width_by_area", "cytoplasm_area",
+    "NucleusArea", "Nuc_Elongation", "Nuc_full_length", "Nuc_half_width", "Nuc_Roundness",
+    "number_protrusions", "percentProtrusion", "protrusion_extent", "mean_prlength",
+    "mean_protrusionarea", "skeleton_area", "skeleton_node_count", "skeletonareapercent",
+    "total_protrusionarea", "ringregion_area"
+]
+
+intensity_and_texture = [
+    "cytointensityAct", "cytointensityTub", "CytoIntensityH", "CytoNonMembraneIntensityAct",
+    "CytoNonMembraneIntensityTub", "GaborMax1_Actin", "GaborMin1_Actin", "HarConCellAct",
+    "HarConCytoTub", "HarConMembAct", "HarCorrCellAct", "HarCorrCytoTub", "HarCorrMembAct",
+    "HarHomCellAct", "HarHomCytoTub", "HarHomMembAct", "HarSVCellAct", "HarSVCytoTub",
+    "HarSVMembAct", "logNucbyRingAct", "logNucbyRingTub", "MembranebyCytoOnlyAct",
+    "MembranebyCytoOnlyTub", "MembraneIntensityAct", "MembraneIntensityTub", "NucbyCytoArea",
+    "NucbyRingAct", "NucbyRingTub", "NucIntensityAct", "NucIntensityTub", "NucIntensityH",
+    "NucPlusRingAct", "NucPlusRingTub", "ProtrusionIntensityAct", "ProtrusionIntensityTub",
+    "RingbyCytoAct", "RingbyCytoTub", "ringIntensityAct", "ringIntensityTub", "RingIntensityH",
+    "WholeCellIntensityAct", "WholeCellIntensityTub", "WholeCellIntensityH"
+]
+
+ser_features = [
+    f"SER{pattern}{region}" for pattern in [
+        "Bright", "Dark", "Edge", "Hole", "Ridge", "Saddle", "Spot", "Valley"
+    ] for region in ["CellAct", "CytoTub", "MembAct", "Nuc"]
+]
+
+# Output table name -> feature columns
+FEATURE_GROUPS = {
+    "shape_and_size": shape_and_size,
+    "intensity_and_texture": intensity_and_texture,
+    "ser": ser_features,
+}
+FEATURES = set(shape_and_size + intensity_and_texture + ser_features)
+
+# Compact in-memory types: features as float32 (statistics are still accumulated in float64),
+# labels and identifiers as categoricals, counters as small integers. Integer columns are only
+# cast when they hold no missing values; the integer widths fit any plate layout.
+FEATURE_DTYPE = np.float32
+META_DTYPES = {
+    "Sample Type": "category", "sample_type": "category", "Experiment": "category", "Plate": "category",
+    "Well ID": "category", "Row": np.int16, "Column": np.int16, "Field": np.int16,
+    "Object Number (per well)": np.int32, "Unique ID": np.int64,
+}
+
+
+def read_dtypes(columns, feature_cols=None):
+    # dtype= map for pd.read_csv: float32 features (the schema's, or feature_cols) and categorical
+    # labels. Integer counters are left to compact_dtypes, as the parser cannot cast missing values.
+    feature_cols = FEATURES if feature_cols is None else set(feature_cols)
+    dtypes = {col: FEATURE_DTYPE for col in columns if col in feature_cols}
+    dtypes.update({col: META_DTYPES[col] for col in columns if META_DTYPES.get(col) == "category"})
+    return dtypes
+
+
+def compact_dtypes(df, feature_cols=None):
+    # Cast the known columns of df to their compact types (no-op for columns already cast)
+    dtypes = read_dtypes(df.columns, feature_cols)
+    for col in df.columns:
+        dtype = META_DTYPES.get(col)
+        if dtype not in (None, "category") and pd.api.types.is_integer_dtype(df[col]):
+            dtypes[col] = dtype
+    changed = {col: dtype for col, dtype in dtypes.items() if df[col].dtype != dtype}
+    return df.astype(changed) if changed else df
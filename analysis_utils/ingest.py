@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Sample types
+SAMPLE_TYPE_MAPPING = {
+    'SIS': ['SIS', 'sis'],
+    'UBM': ['UBM', 'ubm'],
+    'Cardiac': ['Cardiac', 'cardiac'],
+    'M0': ['M0', 'm0'],
+    'M1': ['M1', 'm1'],
+    'M2': ['M2', 'm2']
+}
+
+
+def get_sample_type_from_filename(filename):
+    filename = str(filename).lower()
+    for sample_type, patterns in SAMPLE_TYPE_MAPPING.items():
+        if any(pattern.lower() in filename for pattern in patterns):
+            return sample_type
+    return 'Unknown'
+
+
+def add_sample_type(df, file):
+    # Derive Sample Type from the file name at load time; raw files are never rewritten
+    if 'Sample Type' not in df.columns:
+        sample_type = get_sample_type_from_filename(Path(file).name)
+        labels = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), [sample_type])
+        # Prepended with one concat: inserting into a wide CSV frame warns about fragmentation
+        df = pd.concat([pd.DataFrame({'Sample Type': labels}, index=df.index), df], axis=1)
+    return df
+
+
+def fingerprint_file(path, block_size=8 * 1024 * 1024):
+    # SHA-256 of the file contents and its data row count (newlines minus the header),
+    # computed in a single streaming read. Assumes no quoted newlines inside CSV fields.
+    digest = hashlib.sha256()
+    newlines, last_byte = 0, b"\n"
+    with open(path, "rb") as handle:
+        while block := handle.read(block_size):
+            digest.update(block)
+            newlines += block.count(b"\n")
+            last_byte = block[-1:]
+    lines = newlines + (last_byte != b"\n")
+    return digest.hexdigest(), max(lines - 1, 0)
+
+
+def load_manifest(manifest_path):
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path) as handle:
+        return json.load(handle)
+
+
+def save_manifest(manifest, manifest_path):
+    manifest_path = Path(manifest_path)
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def update_manifest(files, manifest_path):
+    # Record size, mtime, content hash, row count and sample type for every raw file.
+    # Files whose size and mtime match the manifest are not re-read. Returns the manifest
+    # and the files that are new or whose contents changed since the last run.
+    old_manifest = load_manifest(manifest_path)
+    manifest, changed = {}, []
+    for file in files:
+        file = Path(file)
+        stat = file.stat()
+        entry = old_manifest.get(file.name)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            manifest[file.name] = entry
+            continue
+
+        content_hash, rows = fingerprint_file(file)
+        if not entry or entry["sha256"] != content_hash:
+            changed.append(file)
+        manifest[file.name] = {
+            "path": str(file),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": content_hash,
+            "rows": rows,
+            "sample_type": get_sample_type_from_filename(file.name),
+        }
+    save_manifest(manifest, manifest_path)
+    return manifest, changed
@@ -0,0 +1,174 @@
+import atexit
+import cProfile
+import itertools
+import json
+import os
+import platform
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from analysis_utils.storage import find_table
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, peak RSS is reported as NaN
+    resource = None
+
+# Override a script's report directory / turn on per-stage cProfile dumps without editing it
+REPORT_DIR_ENV = "RUN_REPORT_DIR"
+PROFILE_ENV = "RUN_PROFILE"
+
+# Numbers profile dumps uniquely within a process (workers run many recorders)
+_profile_ids = itertools.count()
+
+STAGE_COLUMNS = ["Stage", "Status", "Wall Seconds", "CPU Seconds", "Child CPU Seconds", "Peak RSS MB",
+                 "RSS Growth MB", "Rows In", "Rows Out", "Bytes Read", "Bytes Written", "PID", "Profile"]
+
+
+def peak_rss_mb():
+    # Process high-water mark so far (ru_maxrss is bytes on macOS, kilobytes on Linux)
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def child_cpu_seconds():
+    # CPU time of finished child processes (pool workers count once they have exited)
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def file_size(path):
+    # Size of a file, or of the table stored under a base path without suffix (storage.py)
+    try:
+        return os.path.getsize(path) if os.path.exists(path) else os.path.getsize(find_table(path))
+    except (OSError, FileNotFoundError):
+        return 0
+
+
+class StageRecord:
+    # Filled in by the caller inside a stage: rows in/out and the files read/written. File sizes
+    # are taken when the stage ends, so outputs can be registered before they are written.
+
+    def __init__(self, name, rows_in=None, **tags):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.read_paths = []
+        self.written_paths = []
+        self.tags = tags
+
+    def read(self, *paths):
+        self.read_paths.extend(paths)
+
+    def wrote(self, *paths):
+        self.written_paths.extend(paths)
+
+
+class StageRecorder:
+    # Records named stages: wall time, CPU time (own + finished children), process peak RSS and
+    # how much the stage raised it, rows in/out and bytes read/written. Also usable inside worker
+    # processes, which return .records for the parent's RunReport.add(). CPU time and peak RSS
+    # are process-wide, so stages overlapping on other threads are included. With profile_dir
+    # set, each outermost stage of a thread is run under cProfile and dumped there (nested
+    # stages are covered by their parent's profile).
+
+    def __init__(self, profile_dir=None):
+        self.records = []
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self._thread = threading.local()
+
+    def add(self, records):
+        # Stage records collected in worker processes
+        self.records.extend(records)
+
+    @contextmanager
+    def stage(self, name, rows_in=None, **tags):
+        record = StageRecord(name, rows_in, **tags)
+        profiler = None
+        if self.profile_dir is not None and not getattr(self._thread, "profiling", False):
+            profiler = cProfile.Profile()
+            self._thread.profiling = True
+        status = "ok"
+        peak_before, child_before = peak_rss_mb(), child_cpu_seconds()
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            profile_path = None
+            if profiler:
+                profiler.disable()
+                self._thread.profiling = False
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                label = re.sub(r"[^A-Za-z0-9]+", "_", " ".join([name] + [str(v) for v in tags.values()]))
+                profile_path = self.profile_dir / f"{os.getpid()}_{next(_profile_ids):03d}_{label.strip('_')}.prof"
+                profiler.dump_stats(profile_path)
+            peak_after = peak_rss_mb()
+            self.records.append({
+                "Stage": name,
+                "Status": status,
+                "Wall Seconds": round(time.perf_counter() - wall_start, 4),
+                "CPU Seconds": round(time.process_time() - cpu_start, 4),
+                "Child CPU Seconds": round(child_cpu_seconds() - child_before, 4),
+                "Peak RSS MB": round(peak_after, 1),
+                "RSS Growth MB": round(peak_after - peak_before, 1),
+                "Rows In": record.rows_in,
+                "Rows Out": record.rows_out,
+                "Bytes Read": sum(file_size(path) for path in record.read_paths),
+                "Bytes Written": sum(file_size(path) for path in record.written_paths),
+                "PID": os.getpid(),
+                "Profile": str(profile_path) if profile_path else None,
+                **record.tags,
+            })
+
+
+class RunReport(StageRecorder):
+    # Stage records of one script run, saved as <script>_<timestamp>.json and .csv in report_dir
+    # (or $RUN_REPORT_DIR) when the run ends, including runs that stop with an error.
+    # profile=True (or RUN_PROFILE=1) dumps one cProfile file per outermost stage to profiles/.
+
+    def __init__(self, script, report_dir, profile=False):
+        self.script = script
+        self.report_dir = Path(os.environ.get(REPORT_DIR_ENV) or report_dir)
+        self.started = datetime.now()
+        self.run_id = f"{script}_{self.started:%Y%m%d-%H%M%S}"
+        profile = profile or os.environ.get(PROFILE_ENV, "") not in ("", "0")
+        super().__init__(self.report_dir / "profiles" / self.run_id if profile else None)
+        self._wall_start, self._cpu_start = time.perf_counter(), time.process_time()
+        atexit.register(self.save)
+
+    def save(self):
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+        report = {
+            "script": self.script,
+            "run_id": self.run_id,
+            "started": self.started.isoformat(timespec="seconds"),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "wall_seconds": round(time.perf_counter() - self._wall_start, 4),
+            "cpu_seconds": round(time.process_time() - self._cpu_start, 4),
+            "child_cpu_seconds": round(child_cpu_seconds(), 4),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "stages": self.records,
+        }
+        json_path = self.report_dir / f"{self.run_id}.json"
+        with open(json_path, "w") as handle:
+            json.dump(report, handle, indent=2, default=str)
+        stages = pd.DataFrame(self.records)
+        stages = stages.reindex(columns=STAGE_COLUMNS + [col for col in stages.columns if col not in STAGE_COLUMNS])
+        stages.to_csv(json_path.with_suffix(".csv"), index=False)
+        return json_path
@@ -0,0 +1,164 @@
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pynndescent
+from pynndescent import NNDescent
+
+from analysis_utils.embedding_cache import hash_inputs
+
+# Cached NNDescent kNN graphs for UMAP's precomputed_knn. cached_knn builds the graph of one table
+# once; extended_knn appends a new group of cells to a cached reference graph (the controls). An
+# extension costs O(reference + new cells) per group, about as much as a fresh search of both
+# tables, so the saving is the cache: every graph, merged ones included, is searched only once.
+#
+# Graphs for UMAP fits are searched with at least this many neighbours per cell and cut to the
+# closest n_neighbors (searchable_knn, extended_knn): NNDescent graphs at the small k UMAP is run
+# with (5) miss many true neighbours. At 10, recall at k=5 is above a fresh UMAP neighbour search.
+MIN_SEARCH_NEIGHBORS = 10
+
+
+def _build_index(values, n_neighbors, metric, random_state):
+    # Same NNDescent settings umap.UMAP uses for its own neighbour search
+    n_trees = min(64, 5 + int(round(values.shape[0] ** 0.5 / 20.0)))
+    n_iters = max(5, int(round(np.log2(values.shape[0]))))
+    return NNDescent(values, n_neighbors=n_neighbors, metric=metric, random_state=random_state,
+                     n_trees=n_trees, n_iters=n_iters, max_candidates=60, low_memory=True,
+                     compressed=False, verbose=False)
+
+
+def cached_knn(features, n_neighbors, cache_dir, metric="euclidean", random_state=42, searchable=False):
+    # kNN graph (indices, distances, index) of the rows of features, each row's first neighbour
+    # being itself. Stored as knn_<hash>.npz, keyed by the feature values, column order, metric and
+    # n_neighbors. With searchable=True the NNDescent index is also prepared for queries and
+    # pickled next to it (knn_<hash>_index.pkl); otherwise index is None.
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    key = hash_inputs(features, dict(n_neighbors=n_neighbors, metric=metric, random_state=random_state,
+                                     pynndescent=pynndescent.__version__))
+    graph_file, index_file = cache_dir / f"knn_{key}.npz", cache_dir / f"knn_{key}_index.pkl"
+
+    if graph_file.exists() and (index_file.exists() or not searchable):
+        graph = np.load(graph_file)
+        index = None
+        if searchable:
+            with open(index_file, "rb") as handle:
+                index = pickle.load(handle)
+        print(f"Loaded cached kNN graph: {graph_file.name}")
+        return graph["indices"], graph["distances"], index
+
+    index = _build_index(features.to_numpy(dtype=np.float32), n_neighbors, metric, random_state)
+    indices, distances = index.neighbor_graph
+
+    # Write to temp files first so an interrupted run never leaves a truncated cache entry
+    if searchable:
+        index.prepare()
+        tmp_index = index_file.with_suffix(".tmp")
+        with open(tmp_index, "wb") as handle:
+            pickle.dump(index, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_index, index_file)
+    tmp_graph = graph_file.with_suffix(".tmp.npz")
+    np.savez(tmp_graph, indices=indices, distances=distances)
+    os.replace(tmp_graph, graph_file)
+    print(f"Cached kNN graph: {graph_file.name}")
+    return indices, distances, index if searchable else None
+
+
+def searchable_knn(features, n_neighbors, cache_dir, metric="euclidean", random_state=42):
+    # (indices, distances, index) with n_neighbors columns for a UMAP fit whose model must transform
+    # new cells, searched at MIN_SEARCH_NEIGHBORS or more. Shares its cache entry with the
+    # reference graph of extended_knn.
+    indices, distances, index = cached_knn(features, max(n_neighbors, MIN_SEARCH_NEIGHBORS), cache_dir, metric,
+                                           random_state, searchable=True)
+    return indices[:, :n_neighbors], distances[:, :n_neighbors], index
+
+
+def _closest(indices, distances, n_neighbors):
+    # Keep the n_neighbors closest distinct candidates in each row (stable, so a row's self match
+    # stays first). A candidate found twice keeps its first copy; the others become -1 / inf.
+    by_index = np.lexsort((distances, indices), axis=1)
+    sorted_indices = np.take_along_axis(indices, by_index, axis=1)
+    repeat = np.zeros(indices.shape, dtype=bool)
+    repeat[:, 1:] = (sorted_indices[:, 1:] == sorted_indices[:, :-1]) & (sorted_indices[:, 1:] >= 0)
+    duplicate = np.zeros(indices.shape, dtype=bool)
+    np.put_along_axis(duplicate, by_index, repeat, axis=1)
+    indices = np.where(duplicate, -1, indices)
+    distances = np.where(duplicate, np.inf, distances)
+    order = np.argsort(distances, axis=1, kind="stable")[:, :n_neighbors]
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+
+def _shift(indices, offset):
+    # Row numbers of a table appended after `offset` rows (-1 marks a missing neighbour and stays -1)
+    return np.where(indices < 0, -1, indices + offset)
+
+
+def _reverse_edges(n_rows, indices, distances, source_offset, n_neighbors):
+    # Turns edges source -> target (rows of indices) into per-target candidate lists target -> source,
+    # keeping the n_neighbors closest sources per target (-1 / inf where there are fewer)
+    n_sources, k = indices.shape
+    targets, dists = indices.ravel(), distances.ravel()
+    sources = np.repeat(np.arange(n_sources) + source_offset, k)
+    valid = targets >= 0
+    targets, sources, dists = targets[valid], sources[valid], dists[valid]
+    order = np.lexsort((dists, targets))
+    targets, sources, dists = targets[order], sources[order], dists[order]
+    counts = np.bincount(targets, minlength=n_rows)
+    rank = np.arange(len(targets)) - np.repeat(np.cumsum(counts) - counts, counts)
+    keep = rank < n_neighbors
+
+    candidates = np.full((n_rows, n_neighbors), -1, dtype=indices.dtype)
+    candidate_dists = np.full((n_rows, n_neighbors), np.inf, dtype=distances.dtype)
+    candidates[targets[keep], rank[keep]] = sources[keep]
+    candidate_dists[targets[keep], rank[keep]] = dists[keep]
+    return candidates, candidate_dists
+
+
+def extended_knn(reference, new, n_neighbors, cache_dir, metric="euclidean", random_state=42):
+    # Approximate kNN graph of the rows of reference followed by the rows of new, reusing the
+    # cached reference graph (e.g. the M0/M1/M2 controls) so only the new cells are searched:
+    # - new rows: their own graph merged with queries against the new cells' and the reference index
+    # - reference rows: their cached graph merged with a query against the new cells' index and
+    #   with the new cells that found them (the reverse of the reference query's edges)
+    # Both graphs are searched with at least MIN_SEARCH_NEIGHBORS neighbours.
+    # Cost: the reference graph is built once and cached, but a new group costs
+    # O(reference + new cells), since every reference row is queried against the new cells' index.
+    # The merged graph is cached per reference/new pair (knn_extended_<hash>.npz), so reruns and
+    # the other UMAP scripts pay nothing for a group already seen.
+    # Returns (indices, distances) for UMAP's precomputed_knn.
+    search_k = max(n_neighbors, MIN_SEARCH_NEIGHBORS)
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    params = dict(n_neighbors=n_neighbors, search_neighbors=search_k, metric=metric, random_state=random_state,
+                  pynndescent=pynndescent.__version__)
+    key = hash_inputs(new, dict(params, reference=hash_inputs(reference, params)))
+    graph_file = cache_dir / f"knn_extended_{key}.npz"
+    if graph_file.exists():
+        graph = np.load(graph_file)
+        print(f"Loaded cached extended kNN graph: {graph_file.name}")
+        return graph["indices"], graph["distances"]
+
+    ref_indices, ref_distances, ref_index = cached_knn(reference, search_k, cache_dir, metric, random_state,
+                                                       searchable=True)
+    new_indices, new_distances, new_index = cached_knn(new, search_k, cache_dir, metric, random_state,
+                                                       searchable=True)
+    offset = len(reference)
+    reference_values, new_values = reference.to_numpy(dtype=np.float32), new.to_numpy(dtype=np.float32)
+
+    new_to_ref, new_to_ref_dist = ref_index.query(new_values, k=n_neighbors)
+    new_to_new, new_to_new_dist = new_index.query(new_values, k=n_neighbors)
+    ref_to_new, ref_to_new_dist = new_index.query(reference_values, k=n_neighbors)
+    reverse, reverse_dist = _reverse_edges(offset, new_to_ref, new_to_ref_dist, offset, n_neighbors)
+
+    ref_rows = _closest(np.hstack([ref_indices, _shift(ref_to_new, offset), reverse]),
+                        np.hstack([ref_distances, ref_to_new_dist, reverse_dist]), n_neighbors)
+    new_rows = _closest(np.hstack([_shift(new_indices, offset), _shift(new_to_new, offset), new_to_ref]),
+                        np.hstack([new_distances, new_to_new_dist, new_to_ref_dist]), n_neighbors)
+    indices, distances = np.vstack([ref_rows[0], new_rows[0]]), np.vstack([ref_rows[1], new_rows[1]])
+
+    tmp_graph = graph_file.with_suffix(".tmp.npz")
+    np.savez(tmp_graph, indices=indices, distances=distances)
+    os.replace(tmp_graph, graph_file)
+    print(f"Cached extended kNN graph: {graph_file.name}")
+    return indices, distances
@@ -0,0 +1,236 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy.stats import t
+
+from analysis_utils.column_stats import column_skew
+
+
+def _nan_column_stats(values):
+    # Per-column count, mean and sum of squared deviations, ignoring NaNs
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        n = np.sum(~np.isnan(values), axis=0)
+        mean = np.nanmean(values, axis=0)
+        m2 = np.nansum((values - mean) ** 2, axis=0)
+    return n, mean, m2
+
+
+def grubbs_critical_values(n, alpha=0.05):
+    # Same critical value formula as the original per-column grubbs_test. Note it has no
+    # 1/sqrt(n) factor, so it is more conservative than the textbook Grubbs threshold;
+    # kept unchanged so results match earlier runs.
+    n = np.asarray(n, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t_value = t.ppf(1 - alpha / (2 * n), n - 2)
+        return ((n - 1) * t_value) / np.sqrt(n - 2 + t_value ** 2)
+
+
+def grubbs_from_stats(n, mean, std_dev, min_value, max_value, alpha=0.05):
+    # Two-sided single-outlier Grubbs test from per-column summary statistics
+    with np.errstate(invalid="ignore", divide="ignore"):
+        G_max = np.abs(max_value - mean) / std_dev
+        G_min = np.abs(min_value - mean) / std_dev
+    G_value = np.fmax(G_max, G_min)
+    outlier = np.where(G_max > G_min, max_value, min_value)
+    critical_value = grubbs_critical_values(n, alpha)
+    is_outlier = (n >= 3) & (G_value > critical_value)
+    return outlier, is_outlier, G_value, critical_value
+
+
+def grubbs_test_batched(values, alpha=0.05):
+    # Two-sided single-outlier Grubbs test for every column of a 2D array at once.
+    # Returns (outlier value, is_outlier, mean, std, G, critical value), one entry per column.
+    values = np.asarray(values, dtype=float)
+    n, mean, m2 = _nan_column_stats(values)
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        std_dev = np.sqrt(m2 / (n - 1))
+        max_value, min_value = np.nanmax(values, axis=0), np.nanmin(values, axis=0)
+    outlier, is_outlier, G_value, critical_value = grubbs_from_stats(
+        n, mean, std_dev, min_value, max_value, alpha)
+    return outlier, is_outlier, mean, std_dev, G_value, critical_value
+
+
+def grubbs_test(data, alpha=0.05):
+    # Single-Series wrapper kept for callers that test one feature at a time
+    if data.count() < 3:
+        return [], None, None, None, None
+    outlier, is_outlier, mean, std_dev, G_value, critical_value = grubbs_test_batched(
+        data.dropna().to_numpy(dtype=float)[:, None], alpha=alpha)
+    return ([outlier[0]] if is_outlier[0] else [], mean[0], std_dev[0],
+            G_value[0], critical_value[0])
+
+
+def column_extremes(values, k):
+    # k smallest (ascending) and k largest (descending) values per column; NaNs sort last
+    k = min(k, values.shape[0])
+    lows = np.sort(np.partition(values, k - 1, axis=0)[:k], axis=0)
+    highs = -np.sort(np.partition(-values, k - 1, axis=0)[:k], axis=0)
+    return lows, highs
+
+
+def generalized_esd_from_extremes(n, mean, m2, lows, highs, max_outliers, alpha=0.05):
+    # Rosner's generalized ESD test for up to max_outliers per column, driven only by
+    # per-column summary statistics (count, mean, sum of squared deviations) and the
+    # max_outliers smallest/largest values. Each ESD step removes the current min or max,
+    # so the running mean/variance are downdated in O(columns) without revisiting the data.
+    # Returns (number of outliers, lower threshold, upper threshold) per column: values
+    # <= lower threshold or >= upper threshold are the detected outliers.
+    n = np.asarray(n, dtype=float)
+    mean = np.array(mean, dtype=float)
+    m2 = np.array(m2, dtype=float)
+    n_cols = n.shape[0]
+    k = min(max_outliers, lows.shape[0])
+    cols = np.arange(n_cols)
+
+    lo_idx = np.zeros(n_cols, dtype=int)
+    hi_idx = np.zeros(n_cols, dtype=int)
+    R = np.full((k, n_cols), np.nan)
+    removed_low = np.zeros((k, n_cols), dtype=bool)
+    remaining = n.copy()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for step in range(k):
+            lo = lows[np.minimum(lo_idx, k - 1), cols]
+            hi = highs[np.minimum(hi_idx, k - 1), cols]
+            std_dev = np.sqrt(m2 / (remaining - 1))
+            take_low = (mean - lo) > (hi - mean)
+            x = np.where(take_low, lo, hi)
+            R[step] = np.abs(x - mean) / std_dev
+            removed_low[step] = take_low
+
+            new_remaining = remaining - 1
+            new_mean = (remaining * mean - x) / new_remaining
+            m2 = np.maximum(m2 - (x - mean) * (x - new_mean), 0.0)
+            mean, remaining = new_mean, new_remaining
+            lo_idx += take_low
+            hi_idx += ~take_low
+
+        # Critical values for every step and column in one call
+        m = n[None, :] - np.arange(k)[:, None]
+        p = 1 - alpha / (2 * m)
+        t_value = t.ppf(p, m - 2)
+        lam = (m - 1) * t_value / np.sqrt((m - 2 + t_value ** 2) * m)
+
+    exceeds = (R > lam) & (m >= 3)
+    steps = np.arange(1, k + 1)[:, None]
+    n_outliers = np.max(np.where(exceeds, steps, 0), axis=0)
+
+    # Which removed values were lows vs highs among the first n_outliers steps
+    counted = steps <= n_outliers[None, :]
+    n_low = np.sum(removed_low & counted, axis=0)
+    n_high = n_outliers - n_low
+    lower = np.where(n_low > 0, lows[np.maximum(n_low - 1, 0), cols], -np.inf)
+    upper = np.where(n_high > 0, highs[np.maximum(n_high - 1, 0), cols], np.inf)
+    return n_outliers, lower, upper
+
+
+def generalized_esd(values, max_outliers=10, alpha=0.05):
+    values = np.asarray(values, dtype=float)
+    n, mean, m2 = _nan_column_stats(values)
+    lows, highs = column_extremes(values, max_outliers)
+    return generalized_esd_from_extremes(n, mean, m2, lows, highs, max_outliers, alpha)
+
+
+def iqr_bounds(q1, q3, k=1.5):
+    iqr = q3 - q1
+    return q1 - k * iqr, q3 + k * iqr
+
+
+def grubbs_thresholds(outlier, is_outlier, min_value, max_value):
+    # Express the single Grubbs outlier as a lower/upper threshold pair
+    lower = np.where(is_outlier & (outlier == min_value), min_value, -np.inf)
+    upper = np.where(is_outlier & (outlier == max_value) & (lower == -np.inf), max_value, np.inf)
+    return lower, upper
+
+
+def make_outlier_rules(feature_cols, iqr_lower, iqr_upper, test_lower, test_upper, col_skew):
+    # Per-column outlier rule: values outside the IQR fences, or at/beyond the Grubbs/ESD
+    # thresholds, are flagged. Flagged cells in skewed columns (|skew| > 1) are
+    # log1p-transformed; flagged cells elsewhere drop their row.
+    return pd.DataFrame({
+        "IQR Lower": iqr_lower, "IQR Upper": iqr_upper,
+        "Test Lower": test_lower, "Test Upper": test_upper,
+        "Skewed": np.abs(col_skew) > 1,
+    }, index=pd.Index(feature_cols, name="Feature"))
+
+
+def fit_outlier_rules(values, feature_cols, alpha=0.05, method="grubbs", max_outliers=10):
+    q1, q3 = np.nanquantile(values, [0.25, 0.75], axis=0)
+    iqr_lower, iqr_upper = iqr_bounds(q1, q3)
+    if method == "grubbs":
+        outlier, is_outlier, *_ = grubbs_test_batched(values, alpha=alpha)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            min_value, max_value = np.nanmin(values, axis=0), np.nanmax(values, axis=0)
+        test_lower, test_upper = grubbs_thresholds(outlier, is_outlier, min_value, max_value)
+    elif method == "esd":
+        _, test_lower, test_upper = generalized_esd(values, max_outliers=max_outliers, alpha=alpha)
+    else:
+        raise ValueError(f"Unknown outlier test: {method!r} (expected 'grubbs' or 'esd')")
+    return make_outlier_rules(feature_cols, iqr_lower, iqr_upper, test_lower, test_upper,
+                              column_skew(values))
+
+
+def outlier_rules_from_stats(feature_cols, moments, q1, q3, extremes=None, alpha=0.05,
+                             method="grubbs", max_outliers=10):
+    # Same rules as fit_outlier_rules, built from streamed statistics: running moments
+    # (n, mean, m2, min, max, skew), sketched quartiles and, for ESD, running extremes
+    iqr_lower, iqr_upper = iqr_bounds(q1, q3)
+    if method == "grubbs":
+        outlier, is_outlier, *_ = grubbs_from_stats(
+            moments.n, moments.mean, moments.std(ddof=1), moments.min, moments.max, alpha)
+        test_lower, test_upper = grubbs_thresholds(outlier, is_outlier, moments.min, moments.max)
+    elif method == "esd":
+        _, test_lower, test_upper = generalized_esd_from_extremes(
+            moments.n, moments.mean, moments.m2, extremes.lows, extremes.highs, max_outliers, alpha)
+    else:
+        raise ValueError(f"Unknown outlier test: {method!r} (expected 'grubbs' or 'esd')")
+    return make_outlier_rules(feature_cols, iqr_lower, iqr_upper, test_lower, test_upper,
+                              moments.skew())
+
+
+def outlier_mask(values, rules):
+    return ((values < rules["IQR Lower"].to_numpy()) | (values > rules["IQR Upper"].to_numpy())
+            | (values <= rules["Test Lower"].to_numpy()) | (values >= rules["Test Upper"].to_numpy()))
+
+
+def apply_outlier_rules(df, feature_cols, rules, values=None):
+    # Log1p-transform flagged cells of skewed columns in place and drop every row with a
+    # flagged cell in a non-skewed column in a single operation. Note: df is modified in place.
+    if values is None:
+        values = df[feature_cols].to_numpy(dtype=float)
+    mask = outlier_mask(values, rules)
+    skewed = rules["Skewed"].to_numpy(dtype=bool)
+
+    replace_mask = mask & skewed
+    drop_mask = mask & ~skewed
+    drop_rows = drop_mask.any(axis=1)
+
+    fixed_cols = np.flatnonzero(replace_mask.any(axis=0))
+    if fixed_cols.size:
+        fixed = values[:, fixed_cols]
+        cells = replace_mask[:, fixed_cols]
+        fixed[cells] = np.log1p(fixed[cells])
+        fixed_names = [feature_cols[j] for j in fixed_cols]
+        # values may be a float64 copy of float32 columns; keep the columns' dtype
+        df[fixed_names] = fixed.astype(np.result_type(*df.dtypes[fixed_names]), copy=False)
+
+    outlier_counts = pd.DataFrame({
+        "Rows Dropped": drop_mask.sum(axis=0),
+        "Values Log-transformed": replace_mask.sum(axis=0),
+    }, index=pd.Index(feature_cols, name="Feature"))
+
+    df_clean = df[~drop_rows] if drop_rows.any() else df
+    return df_clean, outlier_counts
+
+
+def remove_outliers(df, feature_cols, alpha=0.05, method="grubbs", max_outliers=10):
+    # Flag IQR outliers plus Grubbs (method="grubbs") or generalized ESD (method="esd")
+    # outliers for all feature columns at once, then apply the rules (see apply_outlier_rules)
+    values = df[feature_cols].to_numpy(dtype=float)
+    rules = fit_outlier_rules(values, feature_cols, alpha=alpha, method=method,
+                              max_outliers=max_outliers)
+    return apply_outlier_rules(df, feature_cols, rules, values=values)
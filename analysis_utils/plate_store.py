@@ -0,0 +1,94 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from analysis_utils.profiles import profile_name
+from analysis_utils.storage import find_table, read_table, write_table
+from analysis_utils.streaming_stats import RunningMoments
+
+# Store of cleaned plates for incremental preprocessing: every plate that went through skew
+# transform and outlier handling is a table under plates/, and index.json records per plate the
+# raw file hash and settings it was built from, its row counts and the moments (count, mean, sum of
+# squared deviations) of its normalization columns. Pooling those moments gives the exact mean and
+# variance of all stored cells, so adding a plate never needs the other plates' data again.
+# The plate's well/field profiles (analysis_utils/profiles.py, of the unscaled cells) are stored
+# next to it as plates/<name>_<level>_profiles.
+
+
+def load_index(store_dir):
+    index_path = Path(store_dir) / "index.json"
+    if not index_path.exists():
+        return {}
+    with open(index_path) as handle:
+        return json.load(handle)
+
+
+def save_index(index, store_dir):
+    index_path = Path(store_dir) / "index.json"
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as handle:
+        json.dump(index, handle, indent=2, sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+
+def plate_base(store_dir, name):
+    return Path(store_dir) / "plates" / name
+
+
+def is_current(index, name, sha256, settings):
+    # True when the stored plate was built from this raw file content with these settings
+    entry = index.get(name)
+    return bool(entry) and entry["sha256"] == sha256 and entry["settings"] == settings
+
+
+def add_plate(store_dir, index, name, df, sha256, settings, norm_columns, counts, profiles=None):
+    # Write a cleaned plate, its profiles (level -> table) and its index entry (the index itself
+    # is saved by the caller)
+    write_table(df, plate_base(store_dir, name))
+    for level, level_profiles in (profiles or {}).items():
+        write_table(level_profiles, plate_base(store_dir, profile_name(name, level)))
+    moments = RunningMoments.from_values(df[norm_columns].to_numpy(dtype=float))
+    index[name] = {
+        "sha256": sha256,
+        "settings": settings,
+        "rows": len(df),
+        "counts": counts.to_dict(orient="records"),
+        "moments": {"columns": list(norm_columns), "n": moments.n.tolist(), "mean": moments.mean.tolist(),
+                    "m2": moments.m2.tolist()},
+    }
+    return index
+
+
+def load_profiles(store_dir, name, level):
+    return read_table(plate_base(store_dir, profile_name(name, level)))
+
+
+def remove_plates(store_dir, index, names):
+    for name in names:
+        levels = (index.get(name) or {}).get("settings", {}).get("profile_levels") or []
+        for base in [plate_base(store_dir, name)] + [plate_base(store_dir, profile_name(name, level))
+                                                     for level in levels]:
+            try:
+                os.remove(find_table(base))
+            except FileNotFoundError:
+                pass
+        index.pop(name, None)
+    return index
+
+
+def pooled_moments(index, names, columns):
+    # Moments of `columns` over the given plates; a plate without a column adds no cells to it
+    pooled = RunningMoments(len(columns))
+    position = {col: j for j, col in enumerate(columns)}
+    for name in names:
+        stored = index[name]["moments"]
+        moments = RunningMoments(len(columns))
+        idx = [position[col] for col in stored["columns"] if col in position]
+        keep = [j for j, col in enumerate(stored["columns"]) if col in position]
+        for attr in ("n", "mean", "m2"):
+            getattr(moments, attr)[idx] = np.asarray(stored[attr], dtype=float)[keep]
+        pooled = pooled.merge(moments)
+    return pooled
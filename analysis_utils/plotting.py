@@ -0,0 +1,97 @@
+import numpy as np
+import seaborn as sns
+from matplotlib.colors import to_rgb
+from matplotlib.lines import Line2D
+
+# Raster resolution of the point layer; page size and render time depend on this, not on the cell count
+DENSITY_BINS = 400
+
+
+def resolve_palette(palette, order):
+    # Accepts a {label: color} mapping or a seaborn palette name ("Set1"), matched to labels in order
+    if isinstance(palette, dict):
+        return {label: to_rgb(palette[label]) for label in order}
+    return dict(zip(order, (to_rgb(c) for c in sns.color_palette(palette, len(order)))))
+
+
+def padded_extent(xmin, xmax, ymin, ymax, pad=0.02):
+    # (xmin, xmax, ymin, ymax) widened by a margin so edge points stay visible
+    extent = []
+    for lo, hi in ((xmin, xmax), (ymin, ymax)):
+        margin = (hi - lo) * pad or 0.5
+        extent += [lo - margin, hi + margin]
+    return tuple(extent)
+
+
+def data_extent(x, y, pad=0.02):
+    # Padded extent around the finite points
+    ranges = []
+    for values in (np.asarray(x, dtype=float), np.asarray(y, dtype=float)):
+        values = values[np.isfinite(values)]
+        ranges += [values.min(), values.max()] if len(values) else [0.0, 1.0]
+    return padded_extent(*ranges, pad=pad)
+
+
+def histogram_layers(x, y, labels, order, extent, bins=DENSITY_BINS):
+    # Per-label 2D counts on a shared grid. Layers from several chunks can be summed,
+    # so large tables can be binned without holding all points at once.
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    labels = np.asarray(labels)
+    xmin, xmax, ymin, ymax = extent
+    layers = {}
+    for label in order:
+        mask = labels == label
+        counts, _, _ = np.histogram2d(y[mask], x[mask], bins=bins, range=[[ymin, ymax], [xmin, xmax]])
+        layers[label] = counts
+    return layers
+
+
+def merge_layers(total, layers):
+    # Adds one chunk's histogram layers to a running total (None to start)
+    if total is None:
+        return {label: counts.copy() for label, counts in layers.items()}
+    for label, counts in layers.items():
+        total[label] += counts
+    return total
+
+
+def draw_density_layers(ax, layers, extent, palette, alpha=0.8, min_alpha=0.25):
+    # Composites the layers in order (later layers on top) into one RGBA image. Opacity grows
+    # with log density; any occupied bin gets at least min_alpha so sparse cells stay visible.
+    # Legend entries are added as point proxies, so plt.legend() works as with scatterplot.
+    if isinstance(alpha, (int, float)):
+        alpha = {label: alpha for label in layers}
+    image = np.zeros(next(iter(layers.values())).shape + (4,))
+    for label, counts in layers.items():
+        if not counts.any():
+            continue
+        density = np.log1p(counts) / np.log1p(counts.max())
+        layer_alpha = np.where(counts > 0, alpha[label] * (min_alpha + (1 - min_alpha) * density), 0.0)
+        a = layer_alpha[..., None]
+        image[..., :3] = np.asarray(palette[label]) * a + image[..., :3] * (1 - a)
+        image[..., 3:] = a + image[..., 3:] * (1 - a)
+    # Stored colour is premultiplied; undo it where anything was drawn
+    drawn = image[..., 3] > 0
+    image[drawn, :3] /= image[drawn, 3:]
+
+    ax.imshow(image, extent=extent, origin="lower", aspect="auto", interpolation="nearest")
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+    for label in layers:
+        ax.add_line(Line2D([], [], linestyle="", marker="o", color=palette[label], label=label))
+
+
+def density_scatter(ax, data, x, y, hue, palette, order=None, alpha=0.8, bins=DENSITY_BINS, extent=None):
+    # Drop-in replacement for sns.scatterplot(data=..., x=..., y=..., hue=..., palette=...)
+    # that embeds the points as one raster image while axes and labels stay vector
+    labels = data[hue].to_numpy()
+    present = set(labels)
+    order = [label for label in (order if order is not None else dict.fromkeys(labels)) if label in present]
+    if extent is None:
+        extent = data_extent(data[x], data[y])
+    layers = histogram_layers(data[x], data[y], labels, order, extent, bins)
+    draw_density_layers(ax, layers, extent, resolve_palette(palette, order), alpha)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    return extent
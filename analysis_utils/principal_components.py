@@ -0,0 +1,47 @@
+import numpy as np
+
+# Rows centred per block when building the covariance
+BLOCK_ROWS = 65_536
+
+
+def leading_component(values, tol=1e-10, max_iter=1000):
+    # PC1 loadings and explained variance ratio without a full decomposition.
+    # The data is reduced to its feature covariance, summed over blocks of centred rows (only one
+    # block is ever copied, and subtracting the mean before multiplying avoids the cancellation of
+    # Gram matrix minus mean outer product for columns with large means), then the top eigenvector is
+    # found by power iteration. If the top two eigenvalues are too close for it to converge,
+    # the (small, features x features) covariance is solved exactly.
+    values = np.asarray(values, dtype=float)
+    if np.isnan(values).any():
+        raise ValueError("Input contains NaN")
+    if len(values) < 2:
+        raise ValueError(f"PC1 needs at least 2 rows, got {len(values)}")
+
+    n = len(values)
+    mean = values.mean(axis=0)
+    cov = np.zeros((values.shape[1], values.shape[1]))
+    for start in range(0, n, BLOCK_ROWS):
+        block = values[start:start + BLOCK_ROWS] - mean
+        cov += block.T @ block
+    cov /= n - 1
+    total_variance = np.trace(cov)
+    if total_variance == 0:
+        raise ValueError("All features are constant")
+
+    # Start from the highest-variance feature, which is never orthogonal to PC1 unless PC1 has no weight on it
+    vector = np.zeros(cov.shape[0])
+    vector[np.argmax(np.diag(cov))] = 1.0
+    vector = cov @ vector
+    for _ in range(max_iter):
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            break
+        vector /= norm
+        next_vector = cov @ vector
+        eigenvalue = vector @ next_vector
+        if np.linalg.norm(next_vector - eigenvalue * vector) <= tol * max(eigenvalue, 1.0):
+            return vector, eigenvalue / total_variance
+        vector = next_vector
+
+    eigenvalues, eigenvectors = np.linalg.eigh(cov)
+    return eigenvectors[:, -1], eigenvalues[-1] / total_variance
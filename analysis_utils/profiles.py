@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+from analysis_utils.feature_schema import FEATURE_DTYPE, compact_dtypes
+from analysis_utils.storage import read_table, read_table_columns
+
+# Per-well and per-field profiles: the median, median absolute deviation (MAD) and cell count of
+# every feature over the cells of each well (or field). A screen of millions of cells has a few
+# hundred wells, so PCA/UMAP on profiles runs on orders of magnitude fewer rows.
+#
+# Profile tables hold the group keys, COUNT_COLUMN, every feature's median under the feature's own
+# name and its MAD as "<feature> MAD", so a profile table can stand in for a cell-level table once
+# the keys, counts and MADs are dropped (read_profiles).
+
+# Grouping columns per level; the ones present in a table are used. Sample Type is part of the key
+# so every profile keeps its label, and Row/Column (fixed per well) are kept for plate maps.
+PROFILE_KEYS = {
+    "well": ["Sample Type", "Experiment", "Plate", "Well ID", "Row", "Column"],
+    "field": ["Sample Type", "Experiment", "Plate", "Well ID", "Row", "Column", "Field"],
+}
+COUNT_COLUMN = "Cell Count"
+MAD_SUFFIX = " MAD"
+# Feature columns per groupby pass, so the per-cell deviations are never built for all at once
+COLUMN_BLOCK = 16
+
+
+def profile_name(name, level):
+    # Table name of the `level` profiles of table `name` (level None: the cell-level table itself)
+    return name if level is None else f"{name}_{level}_profiles"
+
+
+def profile_keys(columns, level):
+    return [col for col in PROFILE_KEYS[level] if col in columns]
+
+
+def aggregate_profiles(df, level, feature_cols):
+    # One row per group of cells: keys, cell count, median and MAD of every feature (NaNs skipped)
+    keys = profile_keys(df.columns, level)
+    if "Well ID" not in keys:
+        raise KeyError(f"{level} profiles need a 'Well ID' column")
+    if df[keys].isna().any().any():
+        df = df.dropna(subset=keys)
+    grouped = df.groupby(keys, observed=True, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    medians, mads = [], []
+    for start in range(0, len(feature_cols), COLUMN_BLOCK):
+        block = feature_cols[start:start + COLUMN_BLOCK]
+        block_medians = grouped[block].median()
+        # Groups are numbered in key order, so row k of the medians is group k
+        deviations = np.abs(df[block].to_numpy(dtype=float) - block_medians.to_numpy()[codes])
+        block_mads = pd.DataFrame(deviations, columns=block).groupby(codes).median()
+        block_mads.index = block_medians.index
+        medians.append(block_medians.astype(FEATURE_DTYPE))
+        mads.append(block_mads.astype(FEATURE_DTYPE).add_suffix(MAD_SUFFIX))
+    counts = grouped.size().rename(COUNT_COLUMN).astype(np.int32)
+    # Keys and values are joined once (reset_index on the wide frame would insert the keys one by one)
+    key_frame = counts.index.to_frame(index=False)
+    values = pd.concat([counts, *medians, *mads], axis=1).reset_index(drop=True)
+    return compact_dtypes(pd.concat([key_frame, values], axis=1))
+
+
+def standardize_profiles(profiles, columns, mean, std):
+    # Profiles of standardized cells from the profiles of the unscaled cells: a median moves and
+    # scales with the cells ((median - mean) / std), a MAD only scales (MAD / std)
+    present = [j for j, col in enumerate(columns) if col in profiles.columns]
+    columns = [columns[j] for j in present]
+    mean, std = np.asarray(mean)[present], np.asarray(std)[present]
+    profiles = profiles.copy()
+    profiles[columns] = ((profiles[columns].to_numpy(dtype=float) - mean) / std).astype(FEATURE_DTYPE)
+    mad_columns = [col + MAD_SUFFIX for col in columns]
+    profiles[mad_columns] = (profiles[mad_columns].to_numpy(dtype=float) / std).astype(FEATURE_DTYPE)
+    return profiles
+
+
+def merge_profiles(frames):
+    # Profiles of several plates in one table (categorical keys with different categories concatenate
+    # to plain values, so they are recast)
+    return compact_dtypes(pd.concat(frames, ignore_index=True))
+
+
+def select_profile_columns(columns, feature_cols):
+    # Keys, cell count, then the median and MAD columns of feature_cols (a feature group's slice)
+    keys = [col for col in PROFILE_KEYS["field"] if col in columns]
+    features = [col for col in feature_cols if col in columns]
+    return keys + [COUNT_COLUMN] + features + [col + MAD_SUFFIX for col in features]
+
+
+def profile_features(columns):
+    # The median columns of a profile table
+    keys = set(PROFILE_KEYS["field"]) | {"sample_type"}
+    return [col for col in columns if col not in keys and col != COUNT_COLUMN and not col.endswith(MAD_SUFFIX)]
+
+
+def read_profiles(base, samples=None):
+    # A profile table shaped like a cell-level feature table: the label column and the feature
+    # medians, optionally only the rows of the given sample types
+    columns = read_table_columns(base)
+    label_col = "Sample Type" if "Sample Type" in columns else "sample_type"
+    df = read_table(base, columns=[label_col] + profile_features(columns))
+    if samples is not None:
+        df = df[df[label_col].astype(str).str.strip().isin(samples)].reset_index(drop=True)
+    return df
@@ -0,0 +1,61 @@
+from fnmatch import fnmatch
+from pathlib import Path
+
+import pandas as pd
+
+from analysis_utils.ingest import get_sample_type_from_filename
+
+# Compact per-stage row counts written by preprocessing, so reports never re-read the data
+COUNT_INDEX_COLUMNS = ["Stage", "File Name", "Sample Type", "Rows"]
+STAGES = ["raw", "after_outliers", "normalized"]
+
+
+def count_sample_types(df, file_name, stage):
+    # One index row per sample type present in df
+    counts = df["Sample Type"].value_counts(sort=False)
+    counts = counts[counts > 0]
+    return pd.DataFrame({
+        "Stage": stage,
+        "File Name": file_name,
+        "Sample Type": counts.index.astype(str),
+        "Rows": counts.to_numpy(dtype="int64"),
+    }, columns=COUNT_INDEX_COLUMNS)
+
+
+def merge_counts(frames):
+    # Combine count frames, summing rows that share stage, file and sample type (e.g. chunks of one file)
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=COUNT_INDEX_COLUMNS)
+    merged = pd.concat(frames, ignore_index=True)
+    return merged.groupby(COUNT_INDEX_COLUMNS[:3], sort=False, as_index=False)["Rows"].sum()
+
+
+def save_count_index(counts, path):
+    counts = merge_counts([counts])
+    counts["Stage"] = pd.Categorical(counts["Stage"], categories=STAGES, ordered=True)
+    counts.sort_values(["Stage", "File Name", "Sample Type"]).to_csv(path, index=False)
+
+
+def load_count_index(path):
+    path = Path(path)
+    if not path.exists():
+        return None
+    return pd.read_csv(path, dtype={"Stage": str, "File Name": str, "Sample Type": str, "Rows": "int64"})
+
+
+def stage_counts(index, stage, file_pattern=None):
+    # Rows per sample type for one stage, summed over files (optionally only files matching a glob)
+    rows = index[index["Stage"] == stage]
+    if file_pattern is not None:
+        rows = rows[[fnmatch(name, file_pattern) for name in rows["File Name"]]]
+    return rows.groupby("Sample Type")["Rows"].sum()
+
+
+def count_raw_csv(file):
+    # Fallback for a raw export without an index: parse a single column only
+    header = pd.read_csv(file, nrows=0).columns
+    if "Sample Type" in header:
+        return pd.read_csv(file, usecols=["Sample Type"])["Sample Type"].astype(str).value_counts()
+    n_rows = len(pd.read_csv(file, usecols=[header[0]]))
+    return pd.Series({get_sample_type_from_filename(Path(file).name): n_rows})
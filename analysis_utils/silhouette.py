@@ -0,0 +1,88 @@
+import numpy as np
+from scipy.stats import norm
+
+from analysis_utils.subsampling import stratified_subsample
+
+
+def _encode_labels(labels):
+    groups, codes = np.unique(np.asarray(labels).astype(str), return_inverse=True)
+    return groups, codes
+
+
+def silhouette_samples_blockwise(values, labels, query=None, block_size=1024, chunk_size=4096):
+    # Silhouette value of each query row (default: every row) against all rows. Distances are
+    # computed for block_size x chunk_size tiles and reduced straight into per-group distance
+    # sums, so memory is bounded by one tile and the full distance matrix never exists.
+    # Follows sklearn.metrics.silhouette_samples (Euclidean; 0 for single-member groups).
+    values = np.asarray(values, dtype=float)
+    groups, codes = _encode_labels(labels)
+    query = np.arange(len(values)) if query is None else np.asarray(query)
+    group_sizes = np.bincount(codes, minlength=len(groups)).astype(float)
+    squared_norms = np.einsum("ij,ij->i", values, values)
+    one_hot = np.zeros((len(values), len(groups)))
+    one_hot[np.arange(len(values)), codes] = 1.0
+
+    distance_sums = np.zeros((len(query), len(groups)))
+    for q_start in range(0, len(query), block_size):
+        q_idx = query[q_start:q_start + block_size]
+        q_values, q_norms = values[q_idx], squared_norms[q_idx]
+        block_sums = distance_sums[q_start:q_start + block_size]
+        for start in range(0, len(values), chunk_size):
+            stop = min(start + chunk_size, len(values))
+            squared = q_norms[:, None] + squared_norms[None, start:stop] - 2 * q_values @ values[start:stop].T
+            np.maximum(squared, 0, out=squared)
+            # A row's distance to itself is exactly 0 (the expansion above leaves rounding noise)
+            own = np.flatnonzero((q_idx >= start) & (q_idx < stop))
+            squared[own, q_idx[own] - start] = 0
+            block_sums += np.sqrt(squared, out=squared) @ one_hot[start:stop]
+
+    q_codes = codes[query]
+    rows = np.arange(len(query))
+    own_sizes = group_sizes[q_codes]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = distance_sums[rows, q_codes] / (own_sizes - 1)
+        other_means = distance_sums / group_sizes
+        other_means[rows, q_codes] = np.inf
+        b = other_means.min(axis=1)
+        s = (b - a) / np.maximum(a, b)
+    s[own_sizes <= 1] = 0.0
+    return np.nan_to_num(s)
+
+
+def silhouette_score_blockwise(values, labels, block_size=1024, chunk_size=4096):
+    groups, _ = _encode_labels(labels)
+    if not 2 <= len(groups) <= len(values) - 1:
+        raise ValueError(f"Silhouette needs 2 to n_samples - 1 groups, got {len(groups)}")
+    return float(silhouette_samples_blockwise(values, labels, block_size=block_size, chunk_size=chunk_size).mean())
+
+
+def stratified_sample(labels, per_group, seed=0):
+    # Up to per_group row indices from every group, drawn without replacement by the same engine
+    # as the PCA/UMAP subsampling (analysis_utils/subsampling.py)
+    return stratified_subsample(labels, per_group, seed)
+
+
+def sampled_silhouette(values, labels, per_group=2000, confidence=0.95, seed=0, block_size=1024, chunk_size=4096,
+                       query=None):
+    # Stratified estimate of the mean silhouette: sampled rows are scored exactly against all rows,
+    # group means are weighted by group size, and the standard error uses the finite-population
+    # correction per group. Returns (estimate, ci_lower, ci_upper, n_scored).
+    # query: sorted positions of a stratified sample drawn elsewhere (e.g. a saved one), else drawn here
+    groups, codes = _encode_labels(labels)
+    if not 2 <= len(groups) <= len(values) - 1:
+        raise ValueError(f"Silhouette needs 2 to n_samples - 1 groups, got {len(groups)}")
+    if query is None:
+        query = stratified_sample(labels, per_group, seed)
+    s = silhouette_samples_blockwise(values, labels, query=query, block_size=block_size, chunk_size=chunk_size)
+
+    q_codes = codes[query]
+    weights = np.bincount(codes, minlength=len(groups)) / len(codes)
+    estimate, variance = 0.0, 0.0
+    for g in range(len(groups)):
+        s_g = s[q_codes == g]
+        population, n = np.sum(codes == g), len(s_g)
+        estimate += weights[g] * s_g.mean()
+        if n > 1:
+            variance += weights[g] ** 2 * s_g.var(ddof=1) / n * (1 - n / population)
+    margin = norm.ppf(0.5 + confidence / 2) * np.sqrt(variance)
+    return float(estimate), float(estimate - margin), float(estimate + margin), len(query)
@@ -0,0 +1,61 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from analysis_utils.column_stats import column_skew
+
+ZERO_FILL = 1e-5
+TRANSFORMS = {"log1p": np.log1p, "sqrt": np.sqrt}
+
+
+def skew_plan_from_stats(feature_cols, col_skew, col_min):
+    # |skew| > 1 -> log1p, 0.5 < |skew| <= 1 -> sqrt, otherwise left unchanged.
+    # Columns with any value <= 0 are shifted by |min| + 1 first.
+    abs_skew = np.abs(col_skew)
+    shift = np.where(col_min <= 0, np.abs(col_min) + 1, 0.0)
+    transform = np.select([abs_skew > 1.0, abs_skew > 0.5], ["log1p", "sqrt"], "none")
+    return pd.DataFrame({"Skew": col_skew, "Shift": shift, "Transform": transform},
+                        index=pd.Index(feature_cols, name="Feature"))
+
+
+def fit_skew_transforms(values, feature_cols):
+    # Skewness, shift and transform choice for every column of a 2D float array in one pass
+    work = np.where(values == 0, ZERO_FILL, values)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        col_min = np.nanmin(work, axis=0)
+    return skew_plan_from_stats(feature_cols, column_skew(work), col_min)
+
+
+def apply_skew_transforms(values, plan):
+    # Apply a fitted plan to a 2D float array in place (columns in plan order)
+    kinds = plan["Transform"].to_numpy()
+    shifts = plan["Shift"].to_numpy(dtype=values.dtype)
+    for kind, func in TRANSFORMS.items():
+        idx = np.flatnonzero(kinds == kind)
+        if not idx.size:
+            continue
+        block = values[:, idx]
+        block[block == 0] = ZERO_FILL
+        block += shifts[idx]
+        func(block, out=block)
+        values[:, idx] = block
+    return values
+
+
+def align_skew_plan(plan, feature_cols):
+    # Reorder a saved plan to the given feature columns, failing on columns it does not cover
+    plan = plan.reindex(feature_cols)
+    missing = plan.index[plan["Transform"].isna()].tolist()
+    if missing:
+        raise KeyError(f"Skew plan has no entry for columns: {missing}")
+    return plan
+
+
+def save_skew_plan(plan, path):
+    plan.to_csv(path)
+
+
+def load_skew_plan(path):
+    return pd.read_csv(path, index_col="Feature")
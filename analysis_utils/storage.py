@@ -0,0 +1,166 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from analysis_utils.feature_schema import compact_dtypes, read_dtypes
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow missing: fall back to CSV everywhere
+    pa = pq = None
+
+# Intermediate tables are written as Parquet when pyarrow is available. Readers look for
+# Parquet, then Feather, then CSV, so older CSV outputs are still picked up.
+TABLE_FORMAT = "parquet" if pa is not None else "csv"
+SUFFIXES = {"parquet": ".parquet", "feather": ".feather", "csv": ".csv"}
+
+
+def _base(path):
+    path = Path(path)
+    return path.with_suffix("") if path.suffix in SUFFIXES.values() else path
+
+
+def table_path(base, fmt=TABLE_FORMAT):
+    base = _base(base)
+    return base.with_name(base.name + SUFFIXES[fmt])
+
+
+def find_table(base):
+    for fmt in ("parquet", "feather", "csv"):
+        path = table_path(base, fmt)
+        if path.exists():
+            return path
+    raise FileNotFoundError(f"No parquet, feather or csv table found for {_base(base)}")
+
+
+def table_exists(base):
+    return any(table_path(base, fmt).exists() for fmt in SUFFIXES)
+
+
+def _format_of(path):
+    return {suffix: fmt for fmt, suffix in SUFFIXES.items()}[Path(path).suffix]
+
+
+def write_table(df, base, fmt=TABLE_FORMAT, export_csv=False):
+    # Write df as base.<fmt>; export_csv additionally writes base.csv. Returns the written paths.
+    path = table_path(base, fmt)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == "parquet":
+        df.to_parquet(path, index=False)
+    elif fmt == "feather":
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        df.to_csv(path, index=False)
+    paths = [path]
+    if export_csv and fmt != "csv":
+        csv_path = table_path(base, "csv")
+        df.to_csv(csv_path, index=False)
+        paths.append(csv_path)
+    return paths
+
+
+def _read_csv(path, columns=None, **kwargs):
+    dtypes = read_dtypes(columns if columns is not None else pd.read_csv(path, nrows=0).columns)
+    return pd.read_csv(path, usecols=columns, dtype=dtypes, **kwargs)
+
+
+def read_table(base, columns=None):
+    # Load a table, reading only `columns` when given (column projection). Known feature and
+    # metadata columns come back in their compact dtypes (analysis_utils/feature_schema.py).
+    path = find_table(base)
+    fmt = _format_of(path)
+    if fmt == "parquet":
+        df = pd.read_parquet(path, columns=columns)
+    elif fmt == "feather":
+        df = pd.read_feather(path, columns=columns)
+    else:
+        df = _read_csv(path, columns)
+    return compact_dtypes(df)
+
+
+def read_table_columns(base):
+    # Column names only, without loading any data
+    path = find_table(base)
+    fmt = _format_of(path)
+    if fmt == "parquet":
+        return list(pq.read_schema(path).names)
+    if fmt == "feather":
+        with pa.ipc.open_file(path) as reader:
+            return list(reader.schema.names)
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def iter_table_chunks(base, columns=None, chunk_size=200_000):
+    # Stream a table as DataFrame chunks with bounded memory, in compact dtypes like read_table
+    path = find_table(base)
+    fmt = _format_of(path)
+    if fmt == "parquet":
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield compact_dtypes(batch.to_pandas())
+    elif fmt == "feather":
+        with pa.ipc.open_file(path) as reader:
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if columns is not None:
+                    batch = batch.select(columns)
+                yield compact_dtypes(batch.to_pandas())
+    else:
+        for chunk in _read_csv(path, columns, chunksize=chunk_size):
+            yield compact_dtypes(chunk)
+
+
+def _partial(path):
+    return path.with_name(path.name + ".partial")
+
+
+class TableWriter:
+    # Append DataFrame chunks to one table. The schema is fixed by the first chunk; later
+    # chunks are cast to it (e.g. a float column with NaNs into an integer column).
+    # Chunks go to <name>.partial files that replace the outputs on close, so an existing table
+    # (or a hardlink to it) is never seen half-written; leaving a with block on an error
+    # discards them.
+
+    def __init__(self, base, fmt=TABLE_FORMAT, export_csv=False):
+        self.fmt = fmt
+        self.path = table_path(base, fmt)
+        self.csv_path = table_path(base, "csv") if export_csv or fmt == "csv" else None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._writer = None
+        self._schema = None
+        self._csv_started = False
+
+    def write(self, chunk):
+        if self.fmt != "csv":
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._schema is None:
+                self._schema = table.schema.remove_metadata()
+                if self.fmt == "parquet":
+                    self._writer = pq.ParquetWriter(_partial(self.path), self._schema)
+                else:
+                    self._writer = pa.ipc.new_file(str(_partial(self.path)), self._schema)
+            self._writer.write_table(table.select(self._schema.names).cast(self._schema))
+        if self.csv_path is not None:
+            chunk.to_csv(_partial(self.csv_path), mode="a" if self._csv_started else "w",
+                          header=not self._csv_started, index=False)
+            self._csv_started = True
+
+    def close(self, discard=False):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        paths = [path for path in (self.path if self.fmt != "csv" else None, self.csv_path) if path]
+        for path in paths:
+            if _partial(path).exists():
+                if discard:
+                    os.remove(_partial(path))
+                else:
+                    os.replace(_partial(path), path)
+        return paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close(discard=exc_type is not None)
@@ -0,0 +1,159 @@
+import warnings
+
+import numpy as np
+
+from analysis_utils.outliers import column_extremes
+
+
+class RunningMoments:
+    # Per-column count, mean, 2nd/3rd central moment sums, min and max, merged chunk by
+    # chunk (Chan/Pebay pairwise update). Memory is O(columns) regardless of row count.
+
+    def __init__(self, n_cols):
+        self.n = np.zeros(n_cols)
+        self.mean = np.zeros(n_cols)
+        self.m2 = np.zeros(n_cols)
+        self.m3 = np.zeros(n_cols)
+        self.min = np.full(n_cols, np.inf)
+        self.max = np.full(n_cols, -np.inf)
+
+    @classmethod
+    def from_values(cls, values):
+        values = np.asarray(values, dtype=float)
+        moments = cls(values.shape[1])
+        with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+            warnings.simplefilter("ignore", RuntimeWarning)
+            moments.n = np.sum(~np.isnan(values), axis=0).astype(float)
+            moments.mean = np.nan_to_num(np.nanmean(values, axis=0))
+            centered = values - moments.mean
+            moments.m2 = np.nansum(centered ** 2, axis=0)
+            moments.m3 = np.nansum(centered ** 3, axis=0)
+            moments.min = np.fmin(moments.min, np.nanmin(values, axis=0))
+            moments.max = np.fmax(moments.max, np.nanmax(values, axis=0))
+        return moments
+
+    def update(self, values):
+        self.__dict__.update(self.merge(RunningMoments.from_values(values)).__dict__)
+
+    def merge(self, other):
+        # Combine with moments accumulated elsewhere (another chunk or another plate)
+        merged = RunningMoments(len(self.n))
+        n_a, n_b = self.n, other.n
+        n = n_a + n_b
+        safe_n = np.where(n > 0, n, 1)
+        delta = other.mean - self.mean
+        merged.n = n
+        merged.mean = self.mean + delta * n_b / safe_n
+        merged.m2 = self.m2 + other.m2 + delta ** 2 * n_a * n_b / safe_n
+        merged.m3 = (self.m3 + other.m3
+                     + delta ** 3 * n_a * n_b * (n_a - n_b) / safe_n ** 2
+                     + 3 * delta * (n_a * other.m2 - n_b * self.m2) / safe_n)
+        merged.min = np.fmin(self.min, other.min)
+        merged.max = np.fmax(self.max, other.max)
+        return merged
+
+    def variance(self, ddof=0):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.m2 / (self.n - ddof)
+
+    def std(self, ddof=0):
+        return np.sqrt(self.variance(ddof))
+
+    def skew(self):
+        # Biased sample skewness, as scipy.stats.skew
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(self.n) * self.m3 / self.m2 ** 1.5
+
+
+class QuantileSketch:
+    # Mergeable per-column quantile sketch with bounded memory. The first `exact_rows` rows
+    # (default `size`) are kept verbatim. After that, chunks of up to `size` rows are kept
+    # verbatim and larger chunks are summarised by `size` evenly spaced quantiles, each
+    # standing in for an equal share of the chunk's rows; once the buffer holds more than
+    # 8 * size points per column it is compressed back to `size` weighted points. Quantiles
+    # are exact while nothing has been summarised and approximate (rank error on the order
+    # of 1 / size) afterwards.
+
+    def __init__(self, n_cols, size=2048, exact_rows=None):
+        self.n_cols = n_cols
+        self.size = size
+        self.probs = (np.arange(size) + 0.5) / size
+        self.exact_rows = size if exact_rows is None else max(exact_rows, size)
+        self.exact = True
+        self.n_rows = 0
+        self.values = []
+        self.weights = []
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        self.n_rows += values.shape[0]
+        if self.exact and self.n_rows <= self.exact_rows:
+            self.values.append(values)
+            self.weights.append(np.where(np.isnan(values), 0.0, 1.0))
+            return
+        if self.exact:
+            # First rows past exact_rows: summarise what was kept verbatim
+            self.exact = False
+            if self.values:
+                self._compress()
+        if values.shape[0] <= self.size:
+            self.values.append(values)
+            self.weights.append(np.where(np.isnan(values), 0.0, 1.0))
+        else:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                summary = np.nanquantile(values, self.probs, axis=0)
+            counts = np.sum(~np.isnan(values), axis=0)
+            self.values.append(summary)
+            self.weights.append(np.broadcast_to(counts / self.size, summary.shape))
+        if sum(len(block) for block in self.values) > 8 * self.size:
+            self._compress()
+
+    def _sorted_column(self, values, weights, j):
+        keep = ~np.isnan(values[:, j]) & (weights[:, j] > 0)
+        order = np.argsort(values[keep, j], kind="stable")
+        col_values = values[keep, j][order]
+        col_weights = weights[keep, j][order]
+        total = col_weights.sum()
+        # Rank of each point's centre of mass, scaled like numpy's linear interpolation
+        positions = (np.cumsum(col_weights) - (col_weights + 1) / 2) / max(total - 1, 1)
+        return col_values, positions, total
+
+    def _compress(self):
+        values = np.concatenate(self.values)
+        weights = np.concatenate(self.weights)
+        compressed = np.full((self.size, self.n_cols), np.nan)
+        totals = np.zeros(self.n_cols)
+        for j in range(self.n_cols):
+            col_values, positions, total = self._sorted_column(values, weights, j)
+            if total > 0:
+                compressed[:, j] = np.interp(self.probs, positions, col_values)
+                totals[j] = total
+        self.values = [compressed]
+        self.weights = [np.broadcast_to(totals / self.size, compressed.shape)]
+
+    def quantile(self, q):
+        q = np.atleast_1d(q)
+        values = np.concatenate(self.values)
+        weights = np.concatenate(self.weights)
+        result = np.full((len(q), self.n_cols), np.nan)
+        for j in range(self.n_cols):
+            col_values, positions, total = self._sorted_column(values, weights, j)
+            if total > 0:
+                result[:, j] = np.interp(q, positions, col_values)
+        return result
+
+
+class RunningExtremes:
+    # The k smallest and k largest values seen per column
+
+    def __init__(self, n_cols, k):
+        self.k = k
+        self.lows = np.full((0, n_cols), np.nan)
+        self.highs = np.full((0, n_cols), np.nan)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        lows, highs = column_extremes(np.concatenate([self.lows, values]), self.k)
+        _, highs = column_extremes(np.concatenate([self.highs, values]), self.k)
+        self.lows, self.highs = lows, highs
@@ -0,0 +1,167 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analysis_utils.feature_schema import compact_dtypes
+from analysis_utils.storage import find_table, iter_table_chunks
+
+# Stratified subsampling: at most `cap` rows per sample type, for PCA/UMAP fits and plots.
+#
+# Every row gets a pseudo-random key computed from the seed and its row position only, and a sample
+# keeps the `cap` rows with the smallest keys of each sample type (bottom-k sampling). This works
+# as a reservoir filled chunk by chunk: the result does not depend on the chunk size or on whether
+# the table was streamed, and one seed picks the same rows of tables whose rows line up (e.g. the
+# feature group tables, which are split from one dataset).
+# Samples are saved under a name (row positions + labels as .npz) so that every script using the
+# name, cap and seed works on the same cells. A saved sample is reused while its source (the table
+# file, or the label column it was drawn from) is unchanged.
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(z):
+    # splitmix64 finalizer
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def random_keys(positions, seed=0):
+    # Uniform [0, 1) key per row position, a function of (seed, position) only
+    with np.errstate(over="ignore"):
+        stream = _mix(np.uint64(seed) * _GOLDEN + _GOLDEN)
+        z = _mix(stream + (np.asarray(positions, dtype=np.uint64) + np.uint64(1)) * _GOLDEN)
+    return (z >> np.uint64(11)) * (1.0 / 2 ** 53)
+
+
+def _clean_labels(labels):
+    labels = pd.Series(labels)
+    if isinstance(labels.dtype, pd.CategoricalDtype):
+        # Strip the categories rather than every row (code -1, a missing label, maps to "nan")
+        categories = np.append(labels.cat.categories.astype(str).str.strip().to_numpy(dtype=object), "nan")
+        return categories[labels.cat.codes.to_numpy()]
+    return labels.astype(str).str.strip().to_numpy()
+
+
+class StratifiedReservoir:
+    # Bottom-k reservoir per sample type over rows fed in table order, chunk by chunk.
+    # Memory is O(cap x sample types) however many rows are fed.
+
+    def __init__(self, cap, seed=0):
+        self.cap = cap
+        self.seed = seed
+        self.n_rows = 0
+        self._kept = {}  # label -> (keys, positions)
+
+    def update(self, labels):
+        labels = _clean_labels(labels)
+        positions = np.arange(self.n_rows, self.n_rows + len(labels))
+        keys = random_keys(positions, self.seed)
+        self.n_rows += len(labels)
+        codes, groups = pd.factorize(labels)
+        for g, label in enumerate(groups):
+            members = codes == g
+            kept_keys, kept_positions = self._kept.get(label, (np.empty(0), np.empty(0, dtype=np.int64)))
+            kept_keys = np.concatenate([kept_keys, keys[members]])
+            kept_positions = np.concatenate([kept_positions, positions[members]])
+            if len(kept_keys) > self.cap:
+                smallest = np.argpartition(kept_keys, self.cap - 1)[:self.cap]
+                kept_keys, kept_positions = kept_keys[smallest], kept_positions[smallest]
+            self._kept[label] = (kept_keys, kept_positions)
+        return self
+
+    def sample(self):
+        # (row positions in table order, their labels)
+        if not self._kept:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=str)
+        positions = np.concatenate([kept[1] for kept in self._kept.values()])
+        labels = np.concatenate([np.full(len(kept[1]), label) for label, kept in self._kept.items()])
+        order = np.argsort(positions)
+        return positions[order], labels[order]
+
+
+def stratified_subsample(labels, cap, seed=0):
+    # Sorted positions of up to `cap` rows of every sample type in an in-memory label column
+    return StratifiedReservoir(cap, seed).update(labels).sample()[0]
+
+
+def sample_path(sample_dir, name, cap, seed):
+    return Path(sample_dir) / f"{name}_cap{cap}_seed{seed}.npz"
+
+
+def load_sample(path):
+    # dict with positions, labels, n_rows and source, or None if nothing is saved
+    if not Path(path).exists():
+        return None
+    with np.load(path) as stored:
+        return {"positions": stored["positions"], "labels": stored["labels"], "n_rows": int(stored["n_rows"]),
+                "source": str(stored["source"])}
+
+
+def save_sample(path, positions, labels, n_rows, source=""):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp.npz")
+    np.savez(tmp_path, positions=positions, labels=np.asarray(labels).astype(str), n_rows=n_rows,
+             source=np.array(source))
+    os.replace(tmp_path, path)
+
+
+def labels_fingerprint(labels):
+    # Identifies an in-memory label column (values and order) for matching saved samples
+    hashes = pd.util.hash_array(np.asarray(labels, dtype=object))
+    return f"labels|{len(hashes)}|{hashlib.sha256(hashes.tobytes()).hexdigest()}"
+
+
+def sample_rows(labels, cap, seed=0, sample_dir=None, name=None):
+    # Positions of the rows to keep from an in-memory label column. With sample_dir and name, a
+    # sample saved for the same labels is reused, otherwise the new draw is saved for later stages
+    # and other scripts.
+    labels = _clean_labels(labels)
+    path = sample_path(sample_dir, name, cap, seed) if sample_dir is not None else None
+    fingerprint = labels_fingerprint(labels) if path is not None else None
+    stored = load_sample(path) if path is not None else None
+    if stored is not None and stored["source"] == fingerprint:
+        return stored["positions"]
+    positions, sampled_labels = StratifiedReservoir(cap, seed).update(labels).sample()
+    if path is not None:
+        save_sample(path, positions, sampled_labels, len(labels), fingerprint)
+    return positions
+
+
+def sample_table(base, label_col, cap, seed=0, sample_dir=None, name=None, chunk_size=200_000):
+    # Positions of the rows to keep from a stored table, drawn from its label column streamed chunk
+    # by chunk. With sample_dir and name, a sample saved for the unchanged table file (same path,
+    # size and modification time) is reused without reading the table.
+    source = find_table(base).resolve()
+    stat = source.stat()
+    fingerprint = f"{source}|{stat.st_size}|{stat.st_mtime_ns}"
+    path = sample_path(sample_dir, name, cap, seed) if sample_dir is not None else None
+    stored = load_sample(path) if path is not None else None
+    if stored is not None and stored["source"] == fingerprint:
+        return stored["positions"]
+    reservoir = StratifiedReservoir(cap, seed)
+    for chunk in iter_table_chunks(base, columns=[label_col], chunk_size=chunk_size):
+        reservoir.update(chunk[label_col])
+    positions, labels = reservoir.sample()
+    if path is not None:
+        save_sample(path, positions, labels, reservoir.n_rows, fingerprint)
+    return positions
+
+
+def read_rows(base, positions, columns=None, chunk_size=200_000):
+    # The rows of a table at the given sorted positions (kept as the index), read chunk by chunk so
+    # that only the sampled rows are held
+    positions = np.asarray(positions)
+    parts, start = [], 0
+    for chunk in iter_table_chunks(base, columns=columns, chunk_size=chunk_size):
+        lo, hi = np.searchsorted(positions, [start, start + len(chunk)])
+        part = chunk.iloc[positions[lo:hi] - start]
+        part.index = positions[lo:hi]
+        parts.append(part)
+        start += len(chunk)
+    # Chunks may carry different label categories, so the concatenated labels are recast
+    return compact_dtypes(pd.concat(parts)) if parts else pd.DataFrame(columns=columns)
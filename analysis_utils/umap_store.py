@@ -0,0 +1,70 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from analysis_utils.storage import find_table, read_table, write_table
+
+# Indexed store of UMAP sweep results: index.csv has one row per embedding, the embeddings
+# themselves are tables under embeddings/. "kNN Graph" names the cached neighbour graph the fit
+# used, which changes whenever the input cells do, so stale entries are never reused.
+INDEX_COLUMNS = ["Feature Group", "Experiment", "n_neighbors", "min_dist", "n_components",
+                 "Cells", "Fit Seconds", "kNN Graph", "Embedding"]
+KEY_COLUMNS = ["Feature Group", "Experiment", "n_neighbors", "min_dist", "n_components"]
+
+
+def embedding_name(group, experiment, n_neighbors, min_dist, n_components):
+    return f"{group}_controls_vs_{experiment}_nn{n_neighbors}_md{min_dist:g}_nc{n_components}_umap"
+
+
+def load_index(store_dir):
+    index_path = Path(store_dir) / "index.csv"
+    if not index_path.exists():
+        return pd.DataFrame(columns=INDEX_COLUMNS)
+    return pd.read_csv(index_path)
+
+
+def save_index(index, store_dir):
+    # Atomic rewrite; the index is small (one row per embedding)
+    index_path = Path(store_dir) / "index.csv"
+    tmp_path = index_path.with_suffix(".tmp")
+    index.sort_values(KEY_COLUMNS).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, index_path)
+
+
+def stored_keys(index):
+    # (key..., kNN Graph) tuples of the stored embeddings, for skipping finished fits
+    return set(index[KEY_COLUMNS + ["kNN Graph"]].itertuples(index=False, name=None))
+
+
+def add_entries(index, rows):
+    # New rows replace stored rows with the same parameters
+    new = pd.DataFrame(rows, columns=INDEX_COLUMNS)
+    if not len(index):
+        return new
+    return pd.concat([index, new], ignore_index=True).drop_duplicates(KEY_COLUMNS, keep="last")
+
+
+def save_embedding(store_dir, embedding, labels, name):
+    # Embedding table with UMAP1..UMAPn and the Sample Type of each cell
+    df = pd.DataFrame(embedding, columns=[f"UMAP{i + 1}" for i in range(embedding.shape[1])])
+    df["Sample Type"] = labels
+    write_table(df, Path(store_dir) / "embeddings" / name)
+    return name
+
+
+def query(store_dir, **filters):
+    # Index rows matching every filter, e.g. query(store, **{"Feature Group": "ser", "n_neighbors": 15});
+    # a list value matches any of its entries
+    index = load_index(store_dir)
+    for col, value in filters.items():
+        index = index[index[col].isin(value if isinstance(value, (list, tuple, set)) else [value])]
+    return index.reset_index(drop=True)
+
+
+def embedding_path(store_dir, row):
+    return find_table(Path(store_dir) / "embeddings" / row["Embedding"])
+
+
+def load_embedding(store_dir, row):
+    return read_table(Path(store_dir) / "embeddings" / row["Embedding"])
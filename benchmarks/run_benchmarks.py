@@ -0,0 +1,201 @@
+# Benchmark suite: runs the pipeline stages on synthetic plates and records throughput and peak memory.
+#
+#   python benchmarks/run_benchmarks.py --cells 10000 100000
+#   python benchmarks/run_benchmarks.py --cells 10000000 --stages preprocess split pca report
+#   python benchmarks/run_benchmarks.py --compare benchmarks/results/<older>.json benchmarks/results/<newer>.json
+#
+# For every --cells scale the scripts are copied into a scratch workspace with their data root
+# pointed at it, synthetic plates are written there (benchmarks/synthetic_data.py) and each stage
+# runs as its own process, in pipeline order:
+#   preprocess  data_pre_processing/data_pre_processing.py
+#   split       data_pre_processing/feature_groups.py
+#   pca         PCA Code/pca_positive_control.py (also writes the positive-control tables)
+#   umap        UMAP Code/umap_positive_controls.py
+#   report      data_pre_processing/pre_processing_report.py
+# A stage's wall time and peak memory cover the whole process, including its worker processes;
+# the per-stage rows of its run report (analysis_utils/instrumentation.py) are kept alongside.
+# Results go to benchmarks/results/<commit>_<timestamp>.json, so runs of different commits can be
+# compared with --compare.
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from synthetic_data import write_plates
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+DATA_ROOT = "/Volumes/SM/RP1B Coding Portfolio"
+CODE_DIRS = ["analysis_utils", "data_pre_processing", "PCA Code", "UMAP Code"]
+# Output directories the scripts expect to exist already
+DATA_DIRS = ["raw datasets", "processed_datasets/Final Datasets", "UMAP and PCA", "Results/preprocessing summary"]
+
+STAGES = {
+    "preprocess": "data_pre_processing/data_pre_processing.py",
+    "split": "data_pre_processing/feature_groups.py",
+    "pca": "PCA Code/pca_positive_control.py",
+    "umap": "UMAP Code/umap_positive_controls.py",
+    "report": "data_pre_processing/pre_processing_report.py",
+}
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+try:
+    import resource
+except ImportError:  # Windows: no wait4, peak memory is not measured
+    resource = None
+
+
+def git_commit():
+    def git(*args):
+        result = subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else ""
+    return git("rev-parse", "HEAD") or "unknown", bool(git("status", "--porcelain", "--untracked-files=no"))
+
+
+def make_workspace(workspace):
+    # Copy of the scripts with every hardcoded data path under workspace/data
+    data_dir = workspace / "data"
+    for name in CODE_DIRS:
+        shutil.copytree(REPO_ROOT / name, workspace / name, ignore=shutil.ignore_patterns("__pycache__", "*.md"))
+        for script in (workspace / name).glob("*.py"):
+            script.write_text(script.read_text().replace(DATA_ROOT, str(data_dir)))
+    for name in DATA_DIRS:
+        (data_dir / name).mkdir(parents=True, exist_ok=True)
+    return data_dir
+
+
+def run_stage(workspace, stage, log_path):
+    # Runs one stage script; returns (exit code, wall seconds, peak RSS in MB of the process tree)
+    env = dict(os.environ, MPLBACKEND="Agg", RUN_REPORT_DIR=str(workspace / "run_reports" / stage))
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        process = subprocess.Popen([sys.executable, STAGES[stage]], cwd=workspace, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        if resource is None or not hasattr(os, "wait4"):
+            return process.wait(), time.perf_counter() - start, float("nan")
+        # ru_maxrss of the child covers its own waited-for children (the worker pools) too
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+    peak = usage.ru_maxrss / 2 ** 20 if sys.platform == "darwin" else usage.ru_maxrss / 2 ** 10
+    return process.returncode, wall, peak
+
+
+def stage_report(workspace, stage):
+    # Stage rows of the run report the script wrote, if it writes one
+    reports = sorted((workspace / "run_reports" / stage).glob("*.json"))
+    if not reports:
+        return []
+    with open(reports[-1]) as handle:
+        return json.load(handle)["stages"]
+
+
+def benchmark_scale(n_cells, stages, workspace, seed, keep_going):
+    data_dir = make_workspace(workspace)
+    start = time.perf_counter()
+    write_plates(data_dir / "raw datasets", n_cells, seed=seed)
+    print(f"\n{n_cells:,} cells: synthetic plates written in {time.perf_counter() - start:.1f} s ({workspace})")
+
+    results = []
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        log_path = workspace / f"{stage}.log"
+        code, wall, peak = run_stage(workspace, stage, log_path)
+        result = {
+            "cells": n_cells,
+            "stage": stage,
+            "script": STAGES[stage],
+            "status": "ok" if code == 0 else f"exit {code}",
+            "wall_seconds": round(wall, 3),
+            "cells_per_second": round(n_cells / wall, 1),
+            "peak_rss_mb": round(peak, 1),
+            "stages": stage_report(workspace, stage),
+        }
+        results.append(result)
+        print(f"  {stage:<10} {result['status']:<8} {wall:9.2f} s {result['cells_per_second']:>12,.0f} cells/s "
+              f"{peak:9.1f} MB peak")
+        if code != 0:
+            print(f"  {stage} failed, see {log_path}")
+            if not keep_going:
+                break
+    return results
+
+
+def compare(baseline_path, current_path):
+    # Side by side wall time and peak memory of two result files, per scale and stage
+    runs = []
+    for path in (baseline_path, current_path):
+        with open(path) as handle:
+            result = json.load(handle)
+        runs.append(result)
+        print(f"{path}: {result['commit'][:10]}{' (dirty)' if result['dirty'] else ''} {result['started']}")
+    baseline = {(r["cells"], r["stage"]): r for r in runs[0]["runs"]}
+    print(f"\n{'cells':>12} {'stage':<10} {'wall s':>9} {'-> wall s':>10} {'ratio':>7} {'peak MB':>9} "
+          f"{'-> peak MB':>11}")
+    for run in runs[1]["runs"]:
+        base = baseline.get((run["cells"], run["stage"]))
+        if base is None:
+            continue
+        ratio = run["wall_seconds"] / base["wall_seconds"] if base["wall_seconds"] else float("nan")
+        print(f"{run['cells']:>12,} {run['stage']:<10} {base['wall_seconds']:>9.2f} {run['wall_seconds']:>10.2f} "
+              f"{ratio:>6.2f}x {base['peak_rss_mb']:>9.1f} {run['peak_rss_mb']:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic plates")
+    parser.add_argument("--cells", type=int, nargs="+", default=[10_000],
+                        help="total cells per benchmark run (10k up to 10M)")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES),
+                        help="stages to run, always in pipeline order; each needs the outputs of the ones before")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workspace", type=Path, default=None,
+                        help="scratch directory, kept afterwards (default: a temporary directory)")
+    parser.add_argument("--keep-workspace", action="store_true", help="keep the temporary directory")
+    parser.add_argument("--keep-going", action="store_true", help="run the later stages after a failure")
+    parser.add_argument("--output", type=Path, default=None, help="result file (default: benchmarks/results/)")
+    parser.add_argument("--compare", type=Path, nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    commit, dirty = git_commit()
+    started = datetime.now()
+    root = args.workspace or Path(tempfile.mkdtemp(prefix="macrophage_bench_"))
+    runs = []
+    try:
+        for n_cells in args.cells:
+            workspace = root / f"cells_{n_cells}"
+            if workspace.exists():
+                shutil.rmtree(workspace)
+            runs.extend(benchmark_scale(n_cells, args.stages, workspace, args.seed, args.keep_going))
+    finally:
+        if args.workspace is None and not args.keep_workspace:
+            shutil.rmtree(root, ignore_errors=True)
+
+    output = args.output or RESULTS_DIR / f"{commit[:10]}{'-dirty' if dirty else ''}_{started:%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump({
+            "commit": commit,
+            "dirty": dirty,
+            "started": started.isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "runs": runs,
+        }, handle, indent=2, default=str)
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# Synthetic high-content plates with the columns of the real exports: the metadata columns matched
+# by META_PATTERNS in data_pre_processing.py and every feature of analysis_utils/feature_schema.py.
+#
+#   python benchmarks/synthetic_data.py --cells 1000000 --out "/tmp/synthetic/raw datasets"
+#
+# --cells is the total over all plates: one plate per sample type (M0, M1, M2, SIS, UBM, Cardiac),
+# or --plates per sample type. Cells share a few latent factors whose means differ by sample type
+# (and slightly by well), so PCA/UMAP find structure; features are skewed (log-normal areas and
+# intensities, bounded ratios, counts) with a small share of spiked outliers, NaNs and zeros.
+# Plates are written in --chunk-size-row pieces, so 10M cells take no more memory than 10k.
+# The same arguments always give the same files.
+import argparse
+import string
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from analysis_utils.feature_schema import FEATURE_GROUPS
+from analysis_utils.ingest import SAMPLE_TYPE_MAPPING, get_sample_type_from_filename
+
+FEATURES = [col for cols in FEATURE_GROUPS.values() for col in cols]
+# One column per META_PATTERNS entry (Experiment, Well, Unique, Row, Column, Field, Object, Plate)
+META_COLUMNS = ["Experiment", "Plate", "Well ID", "Row", "Column", "Field", "Object Number (per well)",
+                "Unique ID"]
+SAMPLE_TYPES = list(SAMPLE_TYPE_MAPPING)
+
+# Inner 60 wells of a 96-well plate (rows B-G, columns 2-11), nine fields per well
+WELL_ROWS = range(2, 8)
+WELL_COLUMNS = range(2, 12)
+FIELDS_PER_WELL = 9
+N_FACTORS = 6
+
+
+def feature_kind(name):
+    # Distribution family, from the feature name
+    if name in ("number_protrusions", "skeleton_node_count"):
+        return "count"
+    if "percent" in name.lower():
+        return "percent"
+    if any(key in name for key in ("Roundness", "roundness", "HarCorr", "HarHom")):
+        return "fraction"
+    if name.startswith("log"):
+        return "normal"
+    return "lognormal"
+
+
+class FeatureModel:
+    # Per-feature distribution parameters, factor loadings and sample type / well effects,
+    # all drawn from the seed so every plate and chunk shares them
+
+    def __init__(self, seed=0):
+        rng = np.random.default_rng([seed, 0])
+        n = len(FEATURES)
+        self.kinds = np.array([feature_kind(name) for name in FEATURES])
+        self.loadings = rng.normal(0, 0.6, (n, N_FACTORS)) * (rng.random((n, N_FACTORS)) < 0.5)
+        self.noise = rng.uniform(0.3, 0.8, n)
+        self.location = rng.uniform(1, 8, n)
+        self.scale = rng.uniform(0.4, 1.2, n)
+        # One factor mean per sample type, so the groups overlap but separate
+        self.type_means = {sample_type: rng.normal(0, 1.2, N_FACTORS) for sample_type in SAMPLE_TYPES}
+        self.well_sd = 0.15
+
+    def latent(self, rng, sample_type, well_effects):
+        factors = self.type_means[sample_type] + well_effects + rng.standard_normal((len(well_effects), N_FACTORS))
+        z = factors @ self.loadings.T + rng.standard_normal((len(well_effects), len(FEATURES))) * self.noise
+        return z / np.sqrt((self.loadings ** 2).sum(axis=1) + self.noise ** 2)
+
+    def values(self, z, rng):
+        out = np.empty_like(z)
+        for kind in np.unique(self.kinds):
+            cols = self.kinds == kind
+            zc, loc, scale = z[:, cols], self.location[cols], self.scale[cols]
+            if kind == "lognormal":
+                out[:, cols] = np.exp(np.log(loc) + scale * zc)
+            elif kind == "normal":
+                out[:, cols] = loc - 4 + scale * zc
+            elif kind == "fraction":
+                out[:, cols] = 1 / (1 + np.exp(-(loc / 4 - 1 + scale * zc)))
+            elif kind == "percent":
+                out[:, cols] = 100 / (1 + np.exp(-(loc / 2 - 3 + 1.5 * scale * zc)))
+            else:
+                out[:, cols] = rng.poisson(np.exp(np.log(loc) / 2 + 0.5 * scale * zc))
+        return out
+
+
+def well_layout(n_cells):
+    # Well index of each cell position: contiguous, nearly equal blocks over the inner wells
+    wells = [(row, col) for row in WELL_ROWS for col in WELL_COLUMNS]
+    n_wells = min(len(wells), max(1, n_cells))
+    starts = np.arange(n_wells + 1) * n_cells // n_wells
+    return wells[:n_wells], starts
+
+
+def plate_chunk(model, sample_type, plate, n_cells, start, stop, id_offset, seed=0,
+                outlier_rate=1e-3, missing_rate=1e-4, zero_rate=1e-4):
+    # Cells start..stop of a plate of n_cells (metadata depends only on the position, so chunking
+    # does not change it)
+    rng = np.random.default_rng([seed, plate, start])
+    position = np.arange(start, stop)
+    wells, starts = well_layout(n_cells)
+    well = np.searchsorted(starts, position, side="right") - 1
+    well_size = starts[well + 1] - starts[well]
+    object_number = position - starts[well] + 1
+
+    well_rng = np.random.default_rng([seed, plate, 1_000_000_000])
+    well_effects = well_rng.normal(0, model.well_sd, (len(wells), N_FACTORS))[well]
+    values = model.values(model.latent(rng, sample_type, well_effects), rng)
+
+    # Spiked outliers (far in the tail of each feature), missing values and exact zeros
+    spikes = rng.random(values.shape) < outlier_rate
+    normal = model.kinds == "normal"
+    values[spikes & ~normal] *= rng.uniform(10, 50, (spikes & ~normal).sum())
+    values[spikes & normal] += rng.choice([-1, 1], (spikes & normal).sum()) * 10 * np.broadcast_to(
+        model.scale, values.shape)[spikes & normal]
+    values[rng.random(values.shape) < zero_rate] = 0
+    values[rng.random(values.shape) < missing_rate] = np.nan
+
+    rows, columns = np.array(wells).T[:, well]
+    meta = pd.DataFrame({
+        "Experiment": "MacsExpt1",
+        "Plate": f"Plate{plate + 1}",
+        "Well ID": [f"{string.ascii_uppercase[r - 1]}{c:02d}" for r, c in zip(rows, columns)],
+        "Row": rows,
+        "Column": columns,
+        "Field": 1 + (object_number - 1) * FIELDS_PER_WELL // well_size,
+        "Object Number (per well)": object_number,
+        "Unique ID": id_offset + position + 1,
+    })
+    return pd.concat([meta[META_COLUMNS], pd.DataFrame(values, columns=FEATURES)], axis=1)
+
+
+def plate_name(label, sample_type, copy):
+    return f"MacsExpt1_{label}_{sample_type}.csv" if copy == 0 else f"MacsExpt1_{label}_{sample_type}_{copy + 1}.csv"
+
+
+def write_plates(out_dir, n_cells, plates_per_type=1, label="10k", seed=0, chunk_size=200_000,
+                 outlier_rate=1e-3, missing_rate=1e-4, zero_rate=1e-4):
+    # Writes n_cells cells over plates_per_type plates of every sample type; returns the file paths
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model = FeatureModel(seed)
+    plates = [(sample_type, copy) for copy in range(plates_per_type) for sample_type in SAMPLE_TYPES]
+    sizes = [n_cells // len(plates) + (i < n_cells % len(plates)) for i in range(len(plates))]
+    paths, id_offset = [], 0
+    for plate, ((sample_type, copy), size) in enumerate(zip(plates, sizes)):
+        path = out_dir / plate_name(label, sample_type, copy)
+        assert get_sample_type_from_filename(path.name) == sample_type, path.name
+        tmp_path = path.with_suffix(".tmp")
+        for start in range(0, size, chunk_size):
+            chunk = plate_chunk(model, sample_type, plate, size, start, min(start + chunk_size, size), id_offset,
+                                seed, outlier_rate, missing_rate, zero_rate)
+            chunk.to_csv(tmp_path, mode="w" if start == 0 else "a", header=start == 0, index=False,
+                         float_format="%.6g")
+        tmp_path.replace(path)
+        id_offset += size
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic high-content imaging plates")
+    parser.add_argument("--cells", type=int, default=10_000, help="total cells over all plates")
+    parser.add_argument("--out", type=Path, required=True, help="directory for the raw CSV plates")
+    parser.add_argument("--plates", type=int, default=1, help="plates per sample type")
+    parser.add_argument("--label", default="10k",
+                        help="file name label (MacsExpt1_<label>_<type>.csv; pre_processing_report.py expects 10k)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=200_000)
+    parser.add_argument("--outlier-rate", type=float, default=1e-3, help="share of values spiked far into the tail")
+    parser.add_argument("--missing-rate", type=float, default=1e-4)
+    parser.add_argument("--zero-rate", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = write_plates(args.out, args.cells, args.plates, args.label, args.seed, args.chunk_size,
+                         args.outlier_rate, args.missing_rate, args.zero_rate)
+    size_mb = sum(path.stat().st_size for path in paths) / 2 ** 20
+    print(f"{len(paths)} plates, {args.cells:,} cells x {len(FEATURES)} features ({size_mb:,.1f} MB) "
+          f"written to {args.out} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,82 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 import re
-from scipy.stats import skew, t
 import os
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.preprocessing import StandardScaler
+import sys
 import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from analysis_utils.boxplots import (
+    BackgroundBoxplotRenderer, boxplot_stats, boxplot_stats_from_summary, render_boxplots
+)
+from analysis_utils.feature_schema import FEATURE_DTYPE, compact_dtypes, read_dtypes
+from analysis_utils import plate_store
+from analysis_utils.ingest import add_sample_type, update_manifest
+from analysis_utils.instrumentation import RunReport, StageRecorder
+from analysis_utils.sample_counts import count_sample_types, merge_counts, save_count_index
+from analysis_utils.profiles import aggregate_profiles, merge_profiles, profile_name, standardize_profiles
+from analysis_utils.outliers import apply_outlier_rules, outlier_rules_from_stats, remove_outliers
+from analysis_utils.skew_transform import (
+    align_skew_plan, apply_skew_transforms, fit_skew_transforms, load_skew_plan, save_skew_plan,
+    skew_plan_from_stats
+)
+from analysis_utils.storage import TableWriter, iter_table_chunks, read_table_columns, write_table
+from analysis_utils.streaming_stats import QuantileSketch, RunningExtremes, RunningMoments
 
 # Define paths
 RAW_DATA_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/raw datasets")
 PROCESSED_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/processed_datasets")
 NORMALIZED_DIR = PROCESSED_DIR / "normalized_data"
 BOXPLOT_DIR = PROCESSED_DIR / "boxplots"
+SKEW_PLAN_DIR = PROCESSED_DIR / "skew_plans"
+FINAL_DATASETS_DIR = PROCESSED_DIR / "Final Datasets"
+INGEST_MANIFEST = PROCESSED_DIR / "ingest_manifest.json"
+# Rows per stage, file and sample type (raw, after_outliers, normalized), read by the summary report
+COUNT_INDEX = PROCESSED_DIR / "sample_count_index.csv"
+
+# Optional saved *_skew_plan.csv to apply to every plate instead of fitting one per plate
+SKEW_PLAN_SOURCE = None
+
+# Worker processes for per-plate preprocessing (1 = run every plate in this process)
+N_WORKERS = os.cpu_count() or 1
+
+# Incremental mode: only new or changed raw files are cleaned (skew transform + outlier handling)
+# and kept as plates in PLATE_STORE_DIR; the merged and normalized datasets are then rebuilt from
+# the store using pooled per-plate statistics (see analysis_utils/plate_store.py)
+INCREMENTAL = False
+PLATE_STORE_DIR = PROCESSED_DIR / "plate_store"
+NORMALIZATION_STATS = PROCESSED_DIR / "normalization_stats.csv"
+
+# Streaming (out-of-core) mode for raw exports larger than RAM: every file is read in
+# CHUNK_SIZE-row chunks, so peak memory depends on the chunk size, not the dataset size
+STREAMING = False
+CHUNK_SIZE = 200_000
+QUANTILE_SKETCH_SIZE = 4096
+# Rows per block when the normalization mean/variance is accumulated over an in-memory dataset
+# (each block is held as a few float64 temporaries, so it is kept well below CHUNK_SIZE)
+STATS_BLOCK_SIZE = 25_000
+
+# Boxplots of the features before outlier removal, drawn from summary statistics:
+# "background" renders them on a worker thread, "sync" before outlier handling, "off" skips them
+BOXPLOT_MODE = "background"
+MAX_BOXPLOT_FLIERS = 200
+
+# Well and field profiles (median, MAD and cell count of every feature per well / per field,
+# analysis_utils/profiles.py), written next to the normalized dataset as
+# merged_dataset_normalized_<level>_profiles; [] skips them. Not built in streaming mode.
+PROFILE_LEVELS = ["well", "field"]
+
+# Merged/normalized datasets are written as Parquet; set True to also export CSV copies
+EXPORT_CSV = False
+
+# Run report: wall/CPU time, peak memory, rows and bytes per stage, as JSON + CSV
+# (analysis_utils/instrumentation.py); PROFILE_STAGES adds a cProfile dump per stage
+RUN_REPORT_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/run_reports")
+PROFILE_STAGES = False
 
 # Create directories if they don't exist
-for dir_path in [PROCESSED_DIR, NORMALIZED_DIR, BOXPLOT_DIR]:
+for dir_path in [PROCESSED_DIR, NORMALIZED_DIR, BOXPLOT_DIR, SKEW_PLAN_DIR]:
     dir_path.mkdir(exist_ok=True)
 
 # Get all CSV files (exclude hidden macOS files)
@@ -30,40 +91,20 @@ META_PATTERNS = [
     r'Field', r'Object', r'Plate'
 ]
 
-# Sample types
-SAMPLE_TYPE_MAPPING = {
-    'SIS': ['SIS', 'sis'],
-    'UBM': ['UBM', 'ubm'],
-    'Cardiac': ['Cardiac', 'cardiac'],
-    'M0': ['M0', 'm0'],
-    'M1': ['M1', 'm1'],
-    'M2': ['M2', 'm2']
-}
-
 EXCLUDE_NORM_COLS = ["Well ID", "Unique ID", "Row", "Column", "Field",
                      "Object Number (per well)", "Sample Type", "Experiment"]
 
-def get_sample_type_from_filename(filename):
-    filename = str(filename).lower()
-    for sample_type, patterns in SAMPLE_TYPE_MAPPING.items():
-        if any(pattern.lower() in filename for pattern in patterns):
-            return sample_type
-    return 'Unknown'
+# Outlier test run alongside the IQR rule: "grubbs" (one outlier per column) or
+# "esd" (generalized ESD, up to ESD_MAX_OUTLIERS per column)
+OUTLIER_TEST = "grubbs"
+ESD_MAX_OUTLIERS = 10
 
-def add_sample_type_to_raw_files():
-    backup_dir = RAW_DATA_DIR / "original_files_backup"
-    backup_dir.mkdir(exist_ok=True)
-    for file in data_files:
-        backup_path = backup_dir / file.name
-        if not backup_path.exists():
-            shutil.copy2(file, backup_path)
-        df = pd.read_csv(file)
-        if 'Sample Type' in df.columns:
-            continue
-        sample_type = get_sample_type_from_filename(file.name)
-        df.insert(0, 'Sample Type', sample_type)
-        df.to_csv(file, index=False)
-        print(f"Added Sample Type '{sample_type}' to {file.name}")
+def update_ingest_manifest():
+    # The raw directory is read-only: Sample Type is derived from the file name at load time and
+    # the manifest records size, mtime, hash, row count and sample type for every raw file
+    manifest, changed = update_manifest(data_files, INGEST_MANIFEST)
+    print(f"Ingest manifest: {len(changed)} new or changed, {len(manifest) - len(changed)} unchanged raw files")
+    return manifest, changed
 
 def clean_column_names(df):
     df.columns = [col.strip() for col in df.columns]
@@ -73,110 +114,439 @@ def get_meta_columns(df):
     meta_cols = [col for col in df.columns if any(re.search(patt, col, re.IGNORECASE) for patt in META_PATTERNS)]
     return meta_cols + ['Sample Type']
 
-def transform_skewed_features(df, feature_cols):
-    for col in feature_cols:
-        col_data = df[col].replace(0, 1e-5)
-        col_skew = skew(col_data.dropna())
-        shift = abs(col_data.min()) + 1 if (col_data <= 0).any() else 0
-        if abs(col_skew) > 1.0:
-            df[col] = np.log1p(col_data + shift)
-        elif 0.5 < abs(col_skew) <= 1.0:
-            df[col] = np.sqrt(col_data + shift)
-    return df
+def raw_dtypes(file):
+    # Parse every feature column of a raw export straight into float32 and the labels into
+    # categoricals (keys are the column names as written in the file)
+    header = pd.read_csv(file, nrows=0).columns
+    names = [col.strip() for col in header]
+    meta_cols = get_meta_columns(pd.DataFrame(columns=names))
+    dtypes = read_dtypes(names, [col for col in names if col not in meta_cols])
+    return {raw: dtypes[name] for raw, name in zip(header, names) if name in dtypes}
 
-def grubbs_test(data, alpha=0.05):
-    data = data.dropna()
-    n = len(data)
-    if n < 3:
-        return [], None, None, None, None
-    mean = data.mean()
-    std_dev = data.std()
-    max_value, min_value = data.max(), data.min()
-    G_max = abs(max_value - mean) / std_dev
-    G_min = abs(min_value - mean) / std_dev
-    G_value = max(G_max, G_min)
-    outlier = max_value if G_max > G_min else min_value
-    t_value = t.ppf(1 - alpha / (2 * n), n - 2)
-    critical_value = ((n - 1) * t_value) / (((n - 2 + t_value ** 2) ** 0.5))
-    return [outlier] if G_value > critical_value else [], mean, std_dev, G_value, critical_value
+def transform_skewed_features(df, feature_cols, plan=None):
+    # Fit (or reuse) a per-column skew plan and apply it to the whole feature block at once
+    values = df[feature_cols].to_numpy(dtype=FEATURE_DTYPE, copy=True)
+    if plan is None:
+        plan = fit_skew_transforms(values, feature_cols)
+    else:
+        plan = align_skew_plan(plan, feature_cols)
+    apply_skew_transforms(values, plan)
+    df[feature_cols] = values
+    return df, plan
 
-def handle_outliers(df, feature_cols, dataset_name):
-    samples_removed = 0
-    plt.figure(figsize=(15, len(feature_cols) * 1.5))
-    for idx, col in enumerate(feature_cols, 1):
-        plt.subplot((len(feature_cols) // 3) + 1, 3, idx)
-        sns.boxplot(y=df[col], flierprops=dict(markerfacecolor='red', marker='o'))
-        plt.title(col)
-    plt.tight_layout()
+def summarize_boxplots(stats, dataset_name, stages):
+    # Returns a (stats, path) job for background rendering, or None once handled here
     boxplot_path = BOXPLOT_DIR / f"{dataset_name}_boxplots.png"
-    plt.savefig(boxplot_path)
-    plt.close()
-    print(f"Boxplot saved at {boxplot_path}")
-    df_reset = df.copy()
-    for col in feature_cols:
-        Q1, Q3 = df[col].quantile([0.25, 0.75])
-        IQR = Q3 - Q1
-        lower, upper = Q1 - 1.5 * IQR, Q3 + 1.5 * IQR
-        iqr_outliers = df[(df[col] < lower) | (df[col] > upper)][col]
-        grubbs_outliers, *_ = grubbs_test(df[col])
-        all_outliers = set(iqr_outliers.tolist() + grubbs_outliers)
-        for val in all_outliers:
-            outlier_rows = df_reset[df_reset[col] == val]
-            if not outlier_rows.empty:
-                index = outlier_rows.index[0]
-                if index in df_reset.index:
-                    if abs(skew(df[col].dropna())) > 1:
-                        df_reset.loc[index, col] = np.log1p(val)
-                    else:
-                        df_reset = df_reset.drop(index)
-        samples_removed += len(all_outliers)
-    return df_reset, samples_removed
-
-def normalize_and_save(merged_df):
-    final_processed_folder = NORMALIZED_DIR
-    exclude_columns = EXCLUDE_NORM_COLS + ["sample_type"]
-    existing_exclude_columns = [col for col in exclude_columns if col in merged_df.columns]
+    if BOXPLOT_MODE == "sync":
+        with stages.stage("boxplot render", file=dataset_name) as stage:
+            render_boxplots(stats, boxplot_path)
+            stage.wrote(boxplot_path)
+        print(f"Boxplot saved at {boxplot_path}")
+        return None
+    return stats, boxplot_path
 
-    numeric_columns = merged_df.select_dtypes(include=['number']).columns
-    columns_to_normalize = [col for col in numeric_columns if col not in existing_exclude_columns]
-    constant_columns = [col for col in columns_to_normalize if merged_df[col].var() == 0]
+def handle_outliers(df, feature_cols, dataset_name):
+    df_clean, outlier_counts = remove_outliers(df, feature_cols, method=OUTLIER_TEST,
+                                               max_outliers=ESD_MAX_OUTLIERS)
+    print(f"Outliers in {dataset_name}: {len(df) - len(df_clean)} rows dropped, "
+          f"{int(outlier_counts['Values Log-transformed'].sum())} values log-transformed")
+    return df_clean, outlier_counts
 
-    if constant_columns:
-        print(f"The following columns have no variance (constant values): {constant_columns}")
-        columns_to_normalize = [col for col in columns_to_normalize if col not in constant_columns]
+def normalization_candidates(df):
+    # Numeric columns other than the metadata
+    exclude_columns = EXCLUDE_NORM_COLS + ["sample_type"]
+    return [col for col in df.select_dtypes(include=['number']).columns if col not in exclude_columns]
 
-    scaler = StandardScaler()
-    merged_df_normalized = merged_df.copy()
-    merged_df_normalized[columns_to_normalize] = scaler.fit_transform(merged_df[columns_to_normalize])
+def standardize_chunk(chunk, columns, mean, std):
+    # The chunk's feature block as one contiguous float32 array, standardized in place
+    values = chunk[columns].to_numpy(dtype=FEATURE_DTYPE, copy=True)
+    values -= mean.astype(FEATURE_DTYPE)
+    values /= std.astype(FEATURE_DTYPE)
+    chunk[columns] = values
+    return chunk
 
-    output_file = final_processed_folder / "merged_dataset_normalized.csv"
-    merged_df_normalized.to_csv(output_file, index=False)
+def normalize_and_save(merged_df, stages):
+    # Same result as a StandardScaler fit on merged_df, without a normalized copy of it: the mean
+    # and variance are accumulated over STATS_BLOCK_SIZE-row blocks (float64), then each
+    # CHUNK_SIZE-row block is standardized and appended to the output, so peak memory is merged_df
+    # plus one block. merged_df itself is left unchanged.
+    final_processed_folder = NORMALIZED_DIR
+    candidate_columns = normalization_candidates(merged_df)
+    with stages.stage("normalization", rows_in=len(merged_df)) as stage:
+        moments = RunningMoments(len(candidate_columns))
+        for start in range(0, len(merged_df), STATS_BLOCK_SIZE):
+            moments.update(merged_df.iloc[start:start + STATS_BLOCK_SIZE][candidate_columns].to_numpy(dtype=float))
+        variance = moments.variance()
+        constant_columns = [col for col, var in zip(candidate_columns, variance) if var == 0]
+        if constant_columns:
+            print(f"The following columns have no variance (constant values): {constant_columns}")
+        norm_idx = [j for j, var in enumerate(variance) if var != 0]
+        columns_to_normalize = [candidate_columns[j] for j in norm_idx]
+        mean, std = moments.mean[norm_idx], np.sqrt(variance[norm_idx])
+
+        count_frames = []
+        with TableWriter(final_processed_folder / "merged_dataset_normalized", export_csv=EXPORT_CSV) as writer:
+            for start in range(0, len(merged_df), CHUNK_SIZE):
+                chunk = standardize_chunk(merged_df.iloc[start:start + CHUNK_SIZE], columns_to_normalize, mean, std)
+                writer.write(chunk)
+                count_frames.append(count_sample_types(chunk, "merged_dataset_normalized", "normalized"))
+        output_files = writer.close()
+        stage.rows_out = len(merged_df)
+        stage.wrote(*output_files)
     print("Normalized dataset saved.")
+    with stages.stage("link to final datasets") as stage:
+        link_to_final_datasets(output_files)
+        stage.wrote(*output_files)
+    return merge_counts(count_frames), (columns_to_normalize, mean, std)
 
-    # Copy to final destination
-    final_destination = Path("/Volumes/SM/RP1B Coding Portfolio/processed_datasets/Final Datasets/merged_dataset_normalized.csv")
-    shutil.copy(output_file, final_destination)
-    print(f"Copy saved to: {final_destination}")
+def save_profiles(profiles, columns, mean, std, stages):
+    # profiles: level -> profiles of the cleaned (unscaled) cells. They are written as the profiles
+    # of the normalized cells by scaling their medians and MADs with the same mean and std.
+    for level, level_profiles in profiles.items():
+        base = NORMALIZED_DIR / profile_name("merged_dataset_normalized", level)
+        with stages.stage("profile write", rows_in=len(level_profiles), level=level) as stage:
+            output_files = write_table(standardize_profiles(level_profiles, columns, mean, std), base,
+                                       export_csv=EXPORT_CSV)
+            stage.rows_out = len(level_profiles)
+            stage.wrote(*output_files)
+        print(f"{level.capitalize()} profiles saved: {len(level_profiles)} rows")
 
-def preprocess_all():
-    add_sample_type_to_raw_files()
-    cleaned_dataframes = []
-    for file in data_files:
-        df = pd.read_csv(file)
+def link_to_final_datasets(output_files):
+    # Final Datasets gets a hardlink to each output rather than a second copy of the bytes;
+    # where links are not supported (another volume, exFAT) the file is copied instead
+    FINAL_DATASETS_DIR.mkdir(parents=True, exist_ok=True)
+    for output_file in output_files:
+        final_destination = FINAL_DATASETS_DIR / output_file.name
+        final_destination.unlink(missing_ok=True)
+        try:
+            os.link(output_file, final_destination)
+            print(f"Linked to: {final_destination}")
+        except OSError:
+            shutil.copy(output_file, final_destination)
+            print(f"Copy saved to: {final_destination}")
+
+def process_file(file, reference_plan=None, profile_dir=None):
+    # Also returns the stage records of this plate, merged into the run report by the caller
+    stages = StageRecorder(profile_dir)
+    with stages.stage("CSV load", file=file.name) as stage:
+        df = pd.read_csv(file, dtype=raw_dtypes(file))
         df = clean_column_names(df)
-        meta_cols = get_meta_columns(df)
-        feature_cols = [col for col in df.columns if col not in meta_cols]
+        df = compact_dtypes(add_sample_type(df, file))
+        stage.read(file)
+        stage.rows_out = len(df)
+    meta_cols = get_meta_columns(df)
+    feature_cols = [col for col in df.columns if col not in meta_cols]
 
-        print(f"Processing {file.name} (Sample Type: {df['Sample Type'].iloc[0]})")
+    print(f"Processing {file.name} (Sample Type: {df['Sample Type'].iloc[0]})")
+    raw_counts = count_sample_types(df, file.name, "raw")
+    with stages.stage("skew transform", rows_in=len(df), file=file.name) as stage:
         df[feature_cols] = df[feature_cols].fillna(1e-5).replace(0, 1e-5)
-        df = transform_skewed_features(df, feature_cols)
+        df, skew_plan = transform_skewed_features(df, feature_cols, plan=reference_plan)
+        plan_path = SKEW_PLAN_DIR / f"{file.stem}_skew_plan.csv"
+        save_skew_plan(skew_plan, plan_path)
+        stage.rows_out = len(df)
+        stage.wrote(plan_path)
+    boxplot_job = None
+    if BOXPLOT_MODE != "off":
+        with stages.stage("boxplot stats", rows_in=len(df), file=file.name):
+            stats = boxplot_stats(df[feature_cols].to_numpy(dtype=float), feature_cols,
+                                  max_fliers=MAX_BOXPLOT_FLIERS)
+        boxplot_job = summarize_boxplots(stats, file.stem, stages)
+    with stages.stage("outlier handling", rows_in=len(df), file=file.name) as stage:
         df_clean, _ = handle_outliers(df, feature_cols, file.stem)
-        cleaned_dataframes.append(df_clean)
+        stage.rows_out = len(df_clean)
+    counts = merge_counts([raw_counts, count_sample_types(df_clean, file.name, "after_outliers")])
+    return df_clean, boxplot_job, counts, stages.records
+
+def process_files(files, reference_plan=None, n_workers=N_WORKERS, boxplot_renderer=None, report=None):
+    # Plates are independent, so run them in a process pool and return results in file order.
+    # Boxplot jobs are handed to the background renderer as soon as each plate finishes.
+    n_workers = max(1, min(n_workers, len(files)))
+    results, counts, failures = {}, {}, {}
+    profile_dir = report.profile_dir if report else None
+    if n_workers == 1:
+        for file in files:
+            try:
+                results[file], boxplot_job, counts[file], records = process_file(file, reference_plan, profile_dir)
+            except Exception as e:
+                failures[file] = e
+                print(f"Failed to process {file.name}: {type(e).__name__}: {e}")
+                continue
+            if report:
+                report.add(records)
+            if boxplot_job and boxplot_renderer:
+                boxplot_renderer.submit(*boxplot_job)
+    else:
+        print(f"Processing {len(files)} files with {n_workers} worker processes")
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {pool.submit(process_file, file, reference_plan, profile_dir): file for file in files}
+            for future in as_completed(futures):
+                file = futures[future]
+                try:
+                    results[file], boxplot_job, counts[file], records = future.result()
+                except Exception as e:
+                    failures[file] = e
+                    print(f"Failed to process {file.name}: {type(e).__name__}: {e}")
+                    continue
+                if report:
+                    report.add(records)
+                if boxplot_job and boxplot_renderer:
+                    boxplot_renderer.submit(*boxplot_job)
+
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {len(files)} files failed to process: "
+                           f"{[file.name for file in failures]}")
+    return [results[file] for file in files], merge_counts([counts[file] for file in files])
+
+def preprocess_all(n_workers=N_WORKERS, report=None):
+    report = report or StageRecorder()
+    with report.stage("ingest manifest"):
+        update_ingest_manifest()
+    reference_plan = load_skew_plan(SKEW_PLAN_SOURCE) if SKEW_PLAN_SOURCE else None
+    boxplot_renderer = BackgroundBoxplotRenderer(report) if BOXPLOT_MODE == "background" else None
+    with report.stage("process plates", n_workers=n_workers):
+        cleaned_dataframes, file_counts = process_files(data_files, reference_plan, n_workers=n_workers,
+                                                        boxplot_renderer=boxplot_renderer, report=report)
 
-    merged_df = pd.concat(cleaned_dataframes, ignore_index=True)
-    merged_df.to_csv(NORMALIZED_DIR / "merged_dataset_with_sample_type.csv", index=False)
+    with report.stage("merge") as stage:
+        # Plates with different label sets concatenate to plain strings; recast to categoricals
+        merged_df = compact_dtypes(pd.concat(cleaned_dataframes, ignore_index=True))
+        del cleaned_dataframes
+        stage.wrote(*write_table(merged_df, NORMALIZED_DIR / "merged_dataset_with_sample_type",
+                                 export_csv=EXPORT_CSV))
+        stage.rows_out = len(merged_df)
     print(f"Merged dataset saved with {len(merged_df)} rows.")
-    normalize_and_save(merged_df)
+    normalized_counts, scaling = normalize_and_save(merged_df, report)
+    if PROFILE_LEVELS:
+        with report.stage("profile aggregation", rows_in=len(merged_df)):
+            feature_cols = normalization_candidates(merged_df)
+            profiles = {level: aggregate_profiles(merged_df, level, feature_cols) for level in PROFILE_LEVELS}
+        save_profiles(profiles, *scaling, report)
+    save_count_index(merge_counts([file_counts, normalized_counts]), COUNT_INDEX)
+    if boxplot_renderer:
+        boxplot_renderer.wait_at_exit()
+
+def read_chunks(file, chunk_size=CHUNK_SIZE):
+    for chunk in pd.read_csv(file, chunksize=chunk_size, dtype=raw_dtypes(file)):
+        yield compact_dtypes(add_sample_type(clean_column_names(chunk), file))
+
+def filled_features(chunk, feature_cols):
+    values = chunk[feature_cols].to_numpy(dtype=FEATURE_DTYPE, copy=True)
+    values[np.isnan(values) | (values == 0)] = 1e-5
+    return values
+
+def stream_file_rules(file, feature_cols, reference_plan=None):
+    # Pass 1: moments of the raw features -> skew plan.
+    # Pass 2: moments, quartile sketch and extremes of the transformed features -> outlier rules
+    if reference_plan is None:
+        raw_moments = RunningMoments(len(feature_cols))
+        for chunk in read_chunks(file):
+            raw_moments.update(filled_features(chunk, feature_cols))
+        plan = skew_plan_from_stats(feature_cols, raw_moments.skew(), raw_moments.min)
+    else:
+        plan = align_skew_plan(reference_plan, feature_cols)
+
+    moments = RunningMoments(len(feature_cols))
+    # Quartiles stay exact for files of up to one chunk
+    sketch = QuantileSketch(len(feature_cols), QUANTILE_SKETCH_SIZE, exact_rows=CHUNK_SIZE)
+    extremes = RunningExtremes(len(feature_cols), ESD_MAX_OUTLIERS) if OUTLIER_TEST == "esd" else None
+    for chunk in read_chunks(file):
+        values = apply_skew_transforms(filled_features(chunk, feature_cols), plan)
+        moments.update(values)
+        sketch.update(values)
+        if extremes is not None:
+            extremes.update(values)
+
+    q1, med, q3 = sketch.quantile([0.25, 0.5, 0.75])
+    rules = outlier_rules_from_stats(feature_cols, moments, q1, q3, extremes,
+                                     method=OUTLIER_TEST, max_outliers=ESD_MAX_OUTLIERS)
+    stats = boxplot_stats_from_summary(feature_cols, q1, med, q3, moments.min, moments.max)
+    return plan, rules, stats
+
+def preprocess_all_streaming(report=None):
+    # Out-of-core variant of preprocess_all; boxplots come from the streamed quartiles
+    report = report or StageRecorder()
+    with report.stage("ingest manifest"):
+        update_ingest_manifest()
+    reference_plan = load_skew_plan(SKEW_PLAN_SOURCE) if SKEW_PLAN_SOURCE else None
+
+    # Output columns are the union of all file headers, in order of first appearance
+    headers = {file: add_sample_type(clean_column_names(pd.read_csv(file, nrows=0)), file).columns
+               for file in data_files}
+    columns = list(dict.fromkeys(col for header in headers.values() for col in header))
+    exclude_columns = EXCLUDE_NORM_COLS + ["sample_type"]
+    candidate_columns = [col for col in columns if col not in exclude_columns]
+    non_numeric = set()
+    boxplot_renderer = BackgroundBoxplotRenderer(report) if BOXPLOT_MODE == "background" else None
+    norm_moments = RunningMoments(len(candidate_columns))
+
+    # Pass 3: transform + outlier filtering chunk by chunk, appended to the merged dataset
+    merged_base = NORMALIZED_DIR / "merged_dataset_with_sample_type"
+    merged_writer = TableWriter(merged_base, export_csv=EXPORT_CSV)
+    total_rows = 0
+    count_frames = []
+    for file in data_files:
+        meta_cols = get_meta_columns(pd.DataFrame(columns=headers[file]))
+        feature_cols = [col for col in headers[file] if col not in meta_cols]
+        print(f"Streaming {file.name} in chunks of {CHUNK_SIZE} rows")
+        with report.stage("skew transform + outlier rules (streamed)", file=file.name) as stage:
+            plan, rules, stats = stream_file_rules(file, feature_cols, reference_plan)
+            plan_path = SKEW_PLAN_DIR / f"{file.stem}_skew_plan.csv"
+            save_skew_plan(plan, plan_path)
+            stage.read(*[file] * (1 if reference_plan is not None else 2))
+            stage.wrote(plan_path)
+        boxplot_job = summarize_boxplots(stats, file.stem, report) if BOXPLOT_MODE != "off" else None
+        if boxplot_job and boxplot_renderer:
+            boxplot_renderer.submit(*boxplot_job)
+
+        rows_in, rows_out = 0, 0
+        with report.stage("outlier handling (streamed)", file=file.name) as stage:
+            for chunk in read_chunks(file):
+                count_frames.append(count_sample_types(chunk, file.name, "raw"))
+                values = apply_skew_transforms(filled_features(chunk, feature_cols), plan)
+                chunk[feature_cols] = values
+                chunk_clean, _ = apply_outlier_rules(chunk, feature_cols, rules, values=values)
+                count_frames.append(count_sample_types(chunk_clean, file.name, "after_outliers"))
+                chunk_clean = chunk_clean.reindex(columns=columns)
+                merged_writer.write(chunk_clean)
+
+                is_numeric = np.array([pd.api.types.is_numeric_dtype(chunk_clean[col])
+                                       for col in candidate_columns], dtype=bool)
+                non_numeric.update(np.array(candidate_columns)[~is_numeric])
+                numeric_block = np.full((len(chunk_clean), len(candidate_columns)), np.nan)
+                numeric_block[:, is_numeric] = chunk_clean[
+                    [col for col, numeric in zip(candidate_columns, is_numeric) if numeric]
+                ].to_numpy(dtype=float)
+                norm_moments.update(numeric_block)
+                rows_in += len(chunk)
+                rows_out += len(chunk_clean)
+            stage.read(file)
+            stage.rows_in, stage.rows_out = rows_in, rows_out
+        total_rows += rows_out
+        print(f"Outliers in {file.stem}: {rows_in - rows_out} rows dropped")
+    merged_writer.close()
+    print(f"Merged dataset saved with {total_rows} rows.")
+
+    # Pass 4: standardize the merged dataset chunk by chunk with the pooled statistics
+    variance = norm_moments.variance()
+    norm_idx = [j for j, col in enumerate(candidate_columns) if col not in non_numeric]
+    constant_columns = [candidate_columns[j] for j in norm_idx if variance[j] == 0]
+    if constant_columns:
+        print(f"The following columns have no variance (constant values): {constant_columns}")
+    norm_idx = [j for j in norm_idx if variance[j] != 0]
+    columns_to_normalize = [candidate_columns[j] for j in norm_idx]
+    mean, std = norm_moments.mean[norm_idx], norm_moments.std()[norm_idx]
+
+    with report.stage("normalization (streamed)", rows_in=total_rows) as stage:
+        with TableWriter(NORMALIZED_DIR / "merged_dataset_normalized", export_csv=EXPORT_CSV) as writer:
+            for chunk in iter_table_chunks(merged_base, chunk_size=CHUNK_SIZE):
+                writer.write(standardize_chunk(chunk, columns_to_normalize, mean, std))
+                count_frames.append(count_sample_types(chunk, "merged_dataset_normalized", "normalized"))
+        output_files = writer.close()
+        stage.read(merged_writer.path)
+        stage.wrote(*output_files)
+        stage.rows_out = total_rows
+    print("Normalized dataset saved.")
+    with report.stage("link to final datasets") as stage:
+        link_to_final_datasets(output_files)
+        stage.wrote(*output_files)
+    if PROFILE_LEVELS:
+        # Medians need every cell of a well at once, which the chunked passes never hold
+        print("Well/field profiles are not built in streaming mode (use INCREMENTAL for large screens)")
+    save_count_index(merge_counts(count_frames), COUNT_INDEX)
+    if boxplot_renderer:
+        boxplot_renderer.wait_at_exit()
+
+def preprocessing_settings():
+    # Settings a stored plate depends on; changing any of them reprocesses every plate
+    return {"outlier_test": OUTLIER_TEST, "esd_max_outliers": ESD_MAX_OUTLIERS,
+            "skew_plan_source": str(SKEW_PLAN_SOURCE) if SKEW_PLAN_SOURCE else None,
+            "profile_levels": list(PROFILE_LEVELS)}
+
+def preprocess_incremental(n_workers=N_WORKERS, report=None):
+    # Cleans only the plates whose raw file is new or changed (or whose stored version was built
+    # with other settings), then rebuilds the merged and normalized datasets from the plate store.
+    # The scaler statistics are pooled from the stored per-plate moments, so the cleaned plates are
+    # only read back once, chunk by chunk, to write the outputs.
+    report = report or StageRecorder()
+    with report.stage("ingest manifest"):
+        manifest, _ = update_ingest_manifest()
+    settings = preprocessing_settings()
+    index = plate_store.load_index(PLATE_STORE_DIR)
+    names = [file.stem for file in data_files]
+    todo = [file for file in data_files
+            if not plate_store.is_current(index, file.stem, manifest[file.name]["sha256"], settings)]
+    removed = [name for name in index if name not in names]
+    print(f"Plate store: {len(todo)} plates to process, {len(names) - len(todo)} up to date, "
+          f"{len(removed)} removed")
+
+    boxplot_renderer = BackgroundBoxplotRenderer(report) if BOXPLOT_MODE == "background" else None
+    if todo:
+        reference_plan = load_skew_plan(SKEW_PLAN_SOURCE) if SKEW_PLAN_SOURCE else None
+        with report.stage("process plates", n_workers=n_workers):
+            cleaned_dataframes, file_counts = process_files(todo, reference_plan, n_workers=n_workers,
+                                                            boxplot_renderer=boxplot_renderer, report=report)
+        with report.stage("plate store update", rows_in=sum(len(df) for df in cleaned_dataframes)) as stage:
+            for file, df in zip(todo, cleaned_dataframes):
+                counts = file_counts[file_counts["File Name"] == file.name]
+                norm_columns = normalization_candidates(df)
+                profiles = {level: aggregate_profiles(df, level, norm_columns) for level in PROFILE_LEVELS}
+                plate_store.add_plate(PLATE_STORE_DIR, index, file.stem, df, manifest[file.name]["sha256"],
+                                      settings, norm_columns, counts, profiles)
+                stage.wrote(plate_store.plate_base(PLATE_STORE_DIR, file.stem))
+            del cleaned_dataframes
+    plate_store.remove_plates(PLATE_STORE_DIR, index, removed)
+    plate_store.save_index(index, PLATE_STORE_DIR)
+
+    # Pooled mean and variance of every normalization column over all stored plates
+    plate_bases = [plate_store.plate_base(PLATE_STORE_DIR, name) for name in names]
+    columns = list(dict.fromkeys(col for base in plate_bases for col in read_table_columns(base)))
+    candidate_columns = list(dict.fromkeys(col for name in names for col in index[name]["moments"]["columns"]))
+    moments = plate_store.pooled_moments(index, names, candidate_columns)
+    variance = moments.variance()
+    constant_columns = [col for col, var in zip(candidate_columns, variance) if var == 0]
+    if constant_columns:
+        print(f"The following columns have no variance (constant values): {constant_columns}")
+    norm_idx = [j for j, var in enumerate(variance) if var != 0]
+    columns_to_normalize = [candidate_columns[j] for j in norm_idx]
+    mean, std = moments.mean[norm_idx], np.sqrt(variance[norm_idx])
+    pd.DataFrame({"Column": columns_to_normalize, "Mean": mean, "Std": std, "Cells": moments.n[norm_idx]}
+                 ).to_csv(NORMALIZATION_STATS, index=False)
+
+    count_frames = [pd.DataFrame(index[name]["counts"]) for name in names]
+    total_rows = sum(index[name]["rows"] for name in names)
+    with report.stage("merge + normalization (from plate store)", rows_in=total_rows) as stage:
+        with TableWriter(NORMALIZED_DIR / "merged_dataset_with_sample_type", export_csv=EXPORT_CSV) as merged_writer, \
+                TableWriter(NORMALIZED_DIR / "merged_dataset_normalized", export_csv=EXPORT_CSV) as writer:
+            for base in plate_bases:
+                for chunk in iter_table_chunks(base, chunk_size=CHUNK_SIZE):
+                    chunk = chunk.reindex(columns=columns)
+                    merged_writer.write(chunk)
+                    chunk = standardize_chunk(chunk, columns_to_normalize, mean, std)
+                    writer.write(chunk)
+                    count_frames.append(count_sample_types(chunk, "merged_dataset_normalized", "normalized"))
+        output_files = writer.close()
+        stage.read(*plate_bases)
+        stage.wrote(merged_writer.path, *output_files, NORMALIZATION_STATS)
+        stage.rows_out = total_rows
+    print(f"Merged dataset saved with {total_rows} rows.")
+    print("Normalized dataset saved.")
+    with report.stage("link to final datasets") as stage:
+        link_to_final_datasets(output_files)
+        stage.wrote(*output_files)
+    # Each plate's profiles were aggregated when it was stored; only the scaling is redone
+    profiles = {level: merge_profiles([plate_store.load_profiles(PLATE_STORE_DIR, name, level) for name in names])
+                for level in PROFILE_LEVELS}
+    save_profiles(profiles, columns_to_normalize, mean, std, report)
+    save_count_index(merge_counts(count_frames), COUNT_INDEX)
+    if boxplot_renderer:
+        boxplot_renderer.wait_at_exit()
 
 if __name__ == "__main__":
-    preprocess_all()
+    run_report = RunReport("data_pre_processing", RUN_REPORT_DIR, profile=PROFILE_STAGES)
+    if INCREMENTAL:
+        preprocess_incremental(report=run_report)
+    elif STREAMING:
+        preprocess_all_streaming(run_report)
+    else:
+        preprocess_all(report=run_report)
@@ -1,56 +1,70 @@
-import pandas as pd
+import sys
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from analysis_utils.feature_schema import FEATURE_GROUPS, intensity_and_texture, ser_features, shape_and_size
+from analysis_utils.instrumentation import RunReport
+from analysis_utils.profiles import profile_name, select_profile_columns
+from analysis_utils.storage import read_table, read_table_columns, table_exists, write_table
+
 # === CONFIG ===
-input_path = Path("/Volumes/SM/RP1B Coding Portfolio/processed_datasets/normalized_data/merged_dataset_normalized.csv")
+# Tables are read/written as Parquet (CSV inputs are still picked up); set EXPORT_CSV to also write CSV
+input_path = Path("/Volumes/SM/RP1B Coding Portfolio/processed_datasets/normalized_data/merged_dataset_normalized")
 output_dir = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/feature_groups_split")
 output_dir.mkdir(parents=True, exist_ok=True)
+EXPORT_CSV = False
+
+# Well/field profiles written by data_pre_processing.py next to the input table are split the same
+# way, into <group>_<level>_profiles (keys and cell counts kept in every group); [] skips them
+PROFILE_LEVELS = ["well", "field"]
+
+# Run report: wall/CPU time, peak memory, rows and bytes per stage, as JSON + CSV
+# (analysis_utils/instrumentation.py); PROFILE_STAGES adds a cProfile dump per stage
+RUN_REPORT_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/run_reports")
+PROFILE_STAGES = False
+run_report = RunReport("feature_groups", RUN_REPORT_DIR, profile=PROFILE_STAGES)
 
-# === FEATURE GROUPS ===
-
-shape_and_size = [
-    "body_roundness", "CellArea", "cellbody_area", "Cell_Elongation", "cell_full_length",
-    "cell_half_width", "Cell_length_by_area", "Cell_width_by_area", "cytoplasm_area",
-    "NucleusArea", "Nuc_Elongation", "Nuc_full_length", "Nuc_half_width", "Nuc_Roundness",
-    "number_protrusions", "percentProtrusion", "protrusion_extent", "mean_prlength",
-    "mean_protrusionarea", "skeleton_area", "skeleton_node_count", "skeletonareapercent",
-    "total_protrusionarea", "ringregion_area"
-]
-
-intensity_and_texture = [
-    "cytointensityAct", "cytointensityTub", "CytoIntensityH", "CytoNonMembraneIntensityAct",
-    "CytoNonMembraneIntensityTub", "GaborMax1_Actin", "GaborMin1_Actin", "HarConCellAct",
-    "HarConCytoTub", "HarConMembAct", "HarCorrCellAct", "HarCorrCytoTub", "HarCorrMembAct",
-    "HarHomCellAct", "HarHomCytoTub", "HarHomMembAct", "HarSVCellAct", "HarSVCytoTub",
-    "HarSVMembAct", "logNucbyRingAct", "logNucbyRingTub", "MembranebyCytoOnlyAct",
-    "MembranebyCytoOnlyTub", "MembraneIntensityAct", "MembraneIntensityTub", "NucbyCytoArea",
-    "NucbyRingAct", "NucbyRingTub", "NucIntensityAct", "NucIntensityTub", "NucIntensityH",
-    "NucPlusRingAct", "NucPlusRingTub", "ProtrusionIntensityAct", "ProtrusionIntensityTub",
-    "RingbyCytoAct", "RingbyCytoTub", "ringIntensityAct", "ringIntensityTub", "RingIntensityH",
-    "WholeCellIntensityAct", "WholeCellIntensityTub", "WholeCellIntensityH"
-]
-
-ser_features = [
-    f"SER{pattern}{region}" for pattern in [
-        "Bright", "Dark", "Edge", "Hole", "Ridge", "Saddle", "Spot", "Valley"
-    ] for region in ["CellAct", "CytoTub", "MembAct", "Nuc"]
-]
-
-# === Load the merged dataset ===
-df = pd.read_csv(input_path)
+# === Load only the sample column and the grouped feature columns ===
+available_cols = read_table_columns(input_path)
 
 # Find sample column (handles naming variations)
-sample_col = "Sample Type" if "Sample Type" in df.columns else "sample_type"
+sample_col = "Sample Type" if "Sample Type" in available_cols else "sample_type"
+
+grouped_features = set(shape_and_size + intensity_and_texture + ser_features)
+with run_report.stage("table load") as stage:
+    df = read_table(input_path, columns=[sample_col] + [col for col in available_cols if col in grouped_features])
+    stage.read(input_path)
+    stage.rows_out = len(df)
 
 # Function to filter and export each group
 def export_feature_group(name, feature_list):
-    selected_cols = [sample_col] + [col for col in feature_list if col in df.columns]
-    subset_df = df[selected_cols]
-    out_path = output_dir / f"{name}.csv"
-    subset_df.to_csv(out_path, index=False)
-    print(f" Saved {name} to {out_path}")
+    with run_report.stage("group split", rows_in=len(df), group=name) as stage:
+        selected_cols = [sample_col] + [col for col in feature_list if col in df.columns]
+        subset_df = df[selected_cols]
+        out_paths = write_table(subset_df, output_dir / name, export_csv=EXPORT_CSV)
+        stage.rows_out = len(subset_df)
+        stage.wrote(*out_paths)
+    print(f" Saved {name} to {', '.join(str(path) for path in out_paths)}")
 
 # === Export all three feature groups ===
 export_feature_group("shape_and_size", shape_and_size)
 export_feature_group("intensity_and_texture", intensity_and_texture)
 export_feature_group("ser", ser_features)
+
+# === Split the well/field profiles ===
+for level in PROFILE_LEVELS:
+    profile_path = input_path.parent / profile_name(input_path.name, level)
+    if not table_exists(profile_path):
+        print(f" No {level} profiles found at {profile_path}, skipped")
+        continue
+    with run_report.stage("table load", level=level) as stage:
+        profiles_df = read_table(profile_path)
+        stage.read(profile_path)
+        stage.rows_out = len(profiles_df)
+    for name, feature_list in FEATURE_GROUPS.items():
+        with run_report.stage("group split", rows_in=len(profiles_df), group=name, level=level) as stage:
+            subset_df = profiles_df[select_profile_columns(profiles_df.columns, feature_list)]
+            out_paths = write_table(subset_df, output_dir / profile_name(name, level), export_csv=EXPORT_CSV)
+            stage.rows_out = len(subset_df)
+            stage.wrote(*out_paths)
+        print(f" Saved {name} {level} profiles to {', '.join(str(path) for path in out_paths)}")
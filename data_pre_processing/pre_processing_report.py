@@ -1,22 +1,23 @@
+import sys
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.decomposition import PCA
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from matplotlib.backends.backend_pdf import PdfPages
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from analysis_utils.principal_components import leading_component
+from analysis_utils.sample_counts import count_raw_csv, load_count_index, stage_counts
+from analysis_utils.storage import read_table
+
 # === File Paths ===
-# Load and merge all raw CSV files
 raw_folder = Path("/Volumes/SM/RP1B Coding Portfolio/raw datasets")
 file_pattern = "MacsExpt1_10k_*.csv"
-raw_files = list(raw_folder.glob(file_pattern))
-print("Found raw files:")
-for f in raw_files:
-    print(f.name)
-raw_df = pd.concat([pd.read_csv(f) for f in raw_files], ignore_index=True)
+processed_data_path = Path("/Volumes/SM/RP1B Coding Portfolio/processed_datasets/Final Datasets/merged_dataset_normalized")
 
-processed_data_path = Path("/Volumes/SM/RP1B Coding Portfolio/processed_datasets/Final Datasets/merged_dataset_normalized.csv")
-processed_df = pd.read_csv(processed_data_path)
+# Sample count index written by data_pre_processing.py (rows per stage, file and sample type)
+count_index_path = Path("/Volumes/SM/RP1B Coding Portfolio/processed_datasets/sample_count_index.csv")
 
 feature_group_dir = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/feature_groups_split")
 output_pdf_path = Path("/Volumes/SM/RP1B Coding Portfolio/Results/preprocessing summary/feature_summary.pdf")
@@ -26,20 +27,36 @@ positive_controls = ["M0", "M1", "M2"]
 experimental = ["Cardiac", "SIS", "UBM"]
 all_sample_types = positive_controls + experimental
 
+# Threads for the per-subset PC1 rankings (the linear algebra releases the GIL)
+N_WORKERS = 6
+
 # === Feature Group Files ===
 feature_group_files = {
-    "Shape/Size": feature_group_dir / "shape_and_size.csv",
-    "Intensity/Texture": feature_group_dir / "intensity_and_texture.csv",
-    "SER": feature_group_dir / "ser.csv",
+    "Shape/Size": feature_group_dir / "shape_and_size",
+    "Intensity/Texture": feature_group_dir / "intensity_and_texture",
+    "SER": feature_group_dir / "ser",
 }
 
 # === Count Samples by Group ===
-def count_samples(df):
-    counts = df["Sample Type"].value_counts().reindex(all_sample_types, fill_value=0)
+def count_samples(counts):
+    counts = counts.reindex(all_sample_types, fill_value=0)
     return counts.to_frame(name="Sample Count")
 
-raw_counts = count_samples(raw_df)
-processed_counts = count_samples(processed_df)
+count_index = load_count_index(count_index_path)
+if count_index is not None:
+    print(f"Using sample count index: {count_index_path}")
+    # Raw counts cover the file_pattern exports only, like the fallback below
+    raw_counts = count_samples(stage_counts(count_index, "raw", file_pattern))
+    processed_counts = count_samples(stage_counts(count_index, "normalized"))
+else:
+    # No index yet: count from the data, parsing only the Sample Type column (or one column of each raw file)
+    raw_files = list(raw_folder.glob(file_pattern))
+    print("Found raw files:")
+    for f in raw_files:
+        print(f.name)
+    raw_counts = count_samples(pd.concat([count_raw_csv(f) for f in raw_files]).groupby(level=0).sum())
+    processed_df = read_table(processed_data_path, columns=["Sample Type"])
+    processed_counts = count_samples(processed_df["Sample Type"].value_counts())
 
 # === Set Up PDF Output ===
 pdf = PdfPages(output_pdf_path)
@@ -63,28 +80,31 @@ plt.close()
 top_features_all = {sample_type: [] for sample_type in all_sample_types}
 
 # === PCA and Feature Ranking ===
+# Only the PC1 loadings are used, so each subset gets a PC1-only decomposition
+def rank_pc1_features(features):
+    pc1, _ = leading_component(features.to_numpy(dtype=float))
+    return pd.Series(np.abs(pc1), index=features.columns).sort_values(ascending=False).head(10)
+
+subsets = []
 for group_name, file_path in feature_group_files.items():
     print(f"🔍 Processing feature group: {group_name}")
-    group_df = pd.read_csv(file_path)
+    group_df = read_table(file_path)
 
     for sample_type in all_sample_types:
-        subset = group_df[group_df["Sample Type"] == sample_type].copy()
+        subset = group_df[group_df["Sample Type"] == sample_type]
         features = subset.drop(columns=["Sample Type", "Unique ID"], errors='ignore')
 
         if features.shape[0] < 1:
             print(f" Skipping {sample_type} for {group_name} — no data.")
             continue
+        subsets.append((group_name, sample_type, features))
 
+# Run the subsets concurrently; results are collected in submission order
+with ThreadPoolExecutor(max_workers=N_WORKERS) as executor:
+    futures = [executor.submit(rank_pc1_features, features) for _, _, features in subsets]
+    for (group_name, sample_type, _), future in zip(subsets, futures):
         try:
-            pca = PCA(n_components=min(len(features.columns), len(features)))
-            pca.fit(features)
-            loadings = pd.DataFrame(
-                pca.components_.T,
-                index=features.columns,
-                columns=[f"PC{i + 1}" for i in range(pca.n_components_)]
-            )
-            top10_pc1 = loadings["PC1"].abs().sort_values(ascending=False).head(10)
-
+            top10_pc1 = future.result()
             for feat in top10_pc1.index:
                 top_features_all[sample_type].append((feat, top10_pc1[feat], group_name))
 
@@ -0,0 +1,139 @@
+import os
+import sys
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from analysis_utils import umap_store
+from analysis_utils.silhouette import sampled_silhouette, silhouette_score_blockwise
+from analysis_utils.storage import table_exists
+from analysis_utils.subsampling import sample_rows
+
+# === CONFIG ===
+# PCA/UMAP outputs are searched recursively for *_pca_components.csv and *_umap_2d.csv
+SEARCH_DIRS = [
+    Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA"),
+]
+FILE_PATTERNS = ["*_pca_components.csv", "*_umap_2d.csv"]
+# Results stores written by umap_sweep.py; every embedding listed in their index is scored into
+# SWEEP_SUMMARY_NAME inside the store, separately from the pipeline outputs
+SWEEP_STORES = [
+    Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/umap_sweep"),
+]
+SWEEP_SUMMARY_NAME = "validation_summary.csv"
+
+# Summary read by validation_visual.py, plus a companion file with cell counts and confidence intervals
+SUMMARY_PATH = Path("/Volumes/SM/RP1B Coding Portfolio/pca_umap_validation_summary.csv")
+DETAILS_PATH = Path("/Volumes/SM/RP1B Coding Portfolio/pca_umap_validation_details.csv")
+
+# "exact": every cell is scored against every other cell, blockwise with bounded memory
+# "sampled": a stratified sample of SAMPLE_PER_GROUP cells per sample type is scored against
+#   all cells, giving an estimate with a CONFIDENCE interval at a fraction of the cost
+SILHOUETTE_MODE = "exact"
+SAMPLE_PER_GROUP = 2000
+CONFIDENCE = 0.95
+RANDOM_SEED = 42
+# Sampled cells per file are saved here (as silhouette_<file>_cap<N>_seed<seed>.npz, see
+# analysis_utils/subsampling.py) and reused while the file's labels are unchanged; None: not saved
+SAMPLE_DIR = Path("/Volumes/SM/RP1B Coding Portfolio/UMAP and PCA/sample_indices")
+
+# Distance tiles are BLOCK_SIZE x CHUNK_SIZE (32 MB at the defaults)
+BLOCK_SIZE = 1024
+CHUNK_SIZE = 4096
+
+# Worker processes, one file per task
+N_WORKERS = os.cpu_count() or 1
+
+def find_embedding_files():
+    files = []
+    for search_dir in SEARCH_DIRS:
+        for pattern in FILE_PATTERNS:
+            files.extend(sorted(search_dir.rglob(pattern)))
+    files = [f for f in files if not f.name.startswith('._')]
+    return files
+
+def embedding_columns(columns):
+    # Component columns only (PC1..PCn / UMAP1..UMAPn), never labels or tags such as "PCA Mode"
+    return [col for col in columns if col.startswith("PC") and col[2:].isdigit()
+            or col.startswith("UMAP") and col[4:].isdigit()]
+
+def score_file(file):
+    df = pd.read_parquet(file) if file.suffix == ".parquet" else pd.read_csv(file)
+    label_col = "Sample Type" if "Sample Type" in df.columns else "sample_type"
+    component_cols = embedding_columns(df.columns)
+    df = df.dropna(subset=component_cols)
+    labels = df[label_col].astype(str).str.strip()
+    values = df[component_cols].to_numpy(dtype=float)
+
+    result = {
+        "File Name": file.name,
+        "Groups Compared": ", ".join(sorted(labels.unique())),
+        "Method": SILHOUETTE_MODE,
+        "Cells": len(df),
+    }
+    if SILHOUETTE_MODE == "sampled":
+        query = sample_rows(labels, SAMPLE_PER_GROUP, RANDOM_SEED, SAMPLE_DIR, f"silhouette_{file.stem}")
+        score, lower, upper, n_scored = sampled_silhouette(
+            values, labels, per_group=SAMPLE_PER_GROUP, confidence=CONFIDENCE, seed=RANDOM_SEED,
+            block_size=BLOCK_SIZE, chunk_size=CHUNK_SIZE, query=query
+        )
+        result.update({"Silhouette Score": score, "Cells Scored": n_scored, "CI Lower": lower, "CI Upper": upper})
+    else:
+        score = silhouette_score_blockwise(values, labels, block_size=BLOCK_SIZE, chunk_size=CHUNK_SIZE)
+        result.update({"Silhouette Score": score, "Cells Scored": len(df), "CI Lower": score, "CI Upper": score})
+    result["Source"] = str(file)
+    return result
+
+def score_files(files, n_workers=N_WORKERS):
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, min(n_workers, len(files)))) as pool:
+        futures = {file: pool.submit(score_file, file) for file in files}
+        for file, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Skipping {file.name}: {type(e).__name__}: {e}")
+                continue
+            print(f"{file.name}: silhouette {result['Silhouette Score']:.4f} ({result['Groups Compared']})")
+            results.append(result)
+    return pd.DataFrame(results, columns=["File Name", "Groups Compared", "Silhouette Score", "Method",
+                                          "Cells", "Cells Scored", "CI Lower", "CI Upper", "Source"])
+
+def validate_sweep(store, n_workers=N_WORKERS):
+    # Scores of a sweep store's embeddings next to their hyperparameters, saved in the store.
+    # Stores that umap_sweep.py has not written yet, and index rows whose embedding is gone, are skipped.
+    store = Path(store)
+    if not (store / "index.csv").exists():
+        print(f"No sweep results in {store}, skipping")
+        return
+    rows = umap_store.query(store)
+    present = [table_exists(store / "embeddings" / name) for name in rows["Embedding"]]
+    if not all(present):
+        print(f"Skipping {len(present) - sum(present)} sweep embeddings missing from {store / 'embeddings'}")
+        rows = rows[present]
+    if rows.empty:
+        print(f"No sweep embeddings to score in {store}, skipping")
+        return
+    rows = rows.assign(Source=[str(umap_store.embedding_path(store, row)) for _, row in rows.iterrows()])
+    print(f"Found {len(rows)} sweep embeddings to score in {store} ({SILHOUETTE_MODE})")
+    details = score_files([Path(source) for source in rows["Source"]], n_workers)
+    summary = rows[umap_store.KEY_COLUMNS + ["Source"]].merge(details, on="Source")
+    summary = summary[umap_store.KEY_COLUMNS + list(details.columns)]
+    summary_path = store / SWEEP_SUMMARY_NAME
+    summary.to_csv(summary_path, index=False)
+    print(f"Sweep summary saved to: {summary_path}")
+
+def validate_all(n_workers=N_WORKERS):
+    files = find_embedding_files()
+    print(f"Found {len(files)} PCA/UMAP outputs to score ({SILHOUETTE_MODE})")
+    details = score_files(files, n_workers)
+    details[["File Name", "Groups Compared", "Silhouette Score"]].to_csv(SUMMARY_PATH, index=False)
+    details.to_csv(DETAILS_PATH, index=False)
+    print(f"Silhouette summary saved to: {SUMMARY_PATH}")
+    print(f"Details saved to: {DETAILS_PATH}")
+    for store in SWEEP_STORES:
+        validate_sweep(store, n_workers)
+
+if __name__ == "__main__":
+    validate_all()